@@ -5,10 +5,13 @@ import logging
 import requests
 import urllib3
 from datetime import datetime, timedelta, date
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 from dotenv import load_dotenv
 import unidecode
 from time import sleep
+from float.task_ranges import collapse_scheduled_tasks
+from float.float_journal import TaskJournal, FLOAT_JOURNAL_PATH
 
 load_dotenv()
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -27,6 +30,10 @@ FORECAST_SHEET = os.environ["FORECAST_SHEET"]
 FORECAST_TOKEN = os.environ["FORECAST_TOKEN"]
 FORECAST_ACCOUNT_ID = os.environ["FORECAST_ACCOUNT_ID"]
 FLOAT_TOKEN = os.environ["FLOAT_TOKEN"]
+BACKFILL_FROM = os.environ.get("BACKFILL_FROM")  # 'YYYY-MM-DD', backfill mode when set
+BACKFILL_TO = os.environ.get("BACKFILL_TO", date.today().strftime('%Y-%m-%d'))
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", 4))
+FLOAT_JOURNAL = os.environ.get("FLOAT_JOURNAL", FLOAT_JOURNAL_PATH)
 
 
 class HarvestAnalytics:
@@ -281,7 +288,7 @@ class FloatAnalytics:
         self.float_api = 'https://api.float.com/v3'
         self.float_clients = self.get_clients()
         self.float_projects = self.get_projects()
-        # self.float_users = self.get_people()
+        self.float_users = self.get_people()
         # self.float_tasks = self.get_tasks()
         self.harvest_users = users
         self.harvest_projects = projects
@@ -457,7 +464,8 @@ class FloatAnalytics:
 
     def create_tasks_from_ghseet(self, gsheet_data, scheduled=False):
         """
-        Create Float task
+        Create Float task. Scheduled tasks of consecutive working days with the same person, project, name and
+        hours are created as a single ranged task
         :return: none
         """
         task_type = 'tasks' if scheduled else 'logged-time'
@@ -469,13 +477,20 @@ class FloatAnalytics:
         try:
             print(f'Creating Float {task_type} Tasks')
             count = 0
+            tasks = []
+            skipped = 0
             for row in gsheet_data[1:]:
                 if row[1][:4] == '2021':
-                    body = {
-                        "project_id": self.get_project_id(row[6].upper(), row[7]),
-                        "people_id": self.float_users[unidecode.unidecode(row[2])]['id'],
-                        "hours": round(float(row[11]) * 4) / 4 if float(row[11]) >= 0.25 else 0.25,
-                    }
+                    try:
+                        body = {
+                            "project_id": self.get_project_id(row[6].upper(), row[7]),
+                            "people_id": self.float_users[unidecode.unidecode(row[2])]['id'],
+                            "hours": round(float(row[11]) * 4) / 4 if float(row[11]) >= 0.25 else 0.25,
+                        }
+                    except Exception as e:
+                        skipped += 1
+                        print(f'Error while building task for row {row[0]}, skipped. Error was {e!r}')
+                        continue
                     if scheduled:
                         body.update({
                             "start_date": row[1],
@@ -489,21 +504,29 @@ class FloatAnalytics:
                             "billable": 1 if row[9].upper() == 'TRUE' else 0,
                             "task_name": row[8]
                         })
-                    response = requests.post(tasks_url, verify=False, headers=headers, data=body)
-                    if 'X-RateLimit-Remaining-Minute' in response.headers:
-                        rate_limit_remaining = response.headers['X-RateLimit-Remaining-Minute']
-                        if int(rate_limit_remaining) <= 15:
-                            print("Cooling down 1:30 minute")
-                            sleep(90)
-                    else:
-                        sleep(0.8)  # 800ms pause to avoid API Throttle
-                    count += 1
-                    if response.status_code == 200:
-                        print(count, response.status_code, response.json())
-                    else:
-                        print(count, response.status_code, row)
+                    tasks.append((row, body))
+            if scheduled:
+                rows_count = len(tasks)
+                tasks = collapse_scheduled_tasks(tasks)
+                print(f'{rows_count} scheduled rows collapsed into {len(tasks)} ranged tasks')
+            else:
+                tasks = [([row], body) for row, body in tasks]
+            for rows, body in tasks:
+                response = requests.post(tasks_url, verify=False, headers=headers, data=body)
+                if 'X-RateLimit-Remaining-Minute' in response.headers:
+                    rate_limit_remaining = response.headers['X-RateLimit-Remaining-Minute']
+                    if int(rate_limit_remaining) <= 15:
+                        print("Cooling down 1:30 minute")
+                        sleep(90)
+                else:
+                    sleep(0.8)  # 800ms pause to avoid API Throttle
+                count += 1
+                if response.status_code == 200:
+                    print(count, response.status_code, response.json())
+                else:
+                    print(count, response.status_code, rows[0] if len(rows) == 1 else body)
 
-            print(f" {count} Tasks were successfully created")
+            print(f" {count} Tasks were successfully created, {skipped} rows skipped")
         except Exception as e:
             print(f'Error while creating tasks. Error was {e}')
 
@@ -616,6 +639,79 @@ class FloatAnalytics:
             print(f'Error while updating {endpoint}/{id}: {e}')
 
 
+def month_windows(start_date, end_date):
+    """
+    Split a date range into calendar month windows
+    :param start_date: 'YYYY-MM-DD'
+    :param end_date: 'YYYY-MM-DD', included
+    :return: [(from_date, to_date)] list, the first and last windows being cut to the range
+    """
+    windows = []
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    while start <= end:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        windows.append((start.strftime('%Y-%m-%d'), min(end, next_month - timedelta(days=1)).strftime('%Y-%m-%d')))
+        start = next_month
+    return windows
+
+
+def backfill(start_date, end_date, workers=4, journal_path=FLOAT_JOURNAL_PATH):
+    """
+    Migrate Harvest time entries to Float logged time month by month, windows being fetched with Harvest date
+    filters and posted concurrently. Every row is journaled and every window checkpointed once all its rows are
+    on Float, so a rerun skips the completed windows and resumes the others where they stopped. Float requests
+    of every worker share the account rate governor, more workers only help while the rate budget isn't spent
+    :param start_date: 'YYYY-MM-DD'
+    :param end_date: 'YYYY-MM-DD', included
+    :param workers: windows processed at once
+    :param journal_path: journal SQLite file
+    :return: created tasks count
+    """
+    from float.float_wrapper import FloatAnalytics as FloatWriter
+    from harvest.harvest_wrapper import HarvestAnalytics as HarvestReader
+    from gsheet.gsheet_wrapper import GoogleRunner
+    task_type = 'logged-time'
+    journal = TaskJournal(journal_path)
+    # only the roles of the roles sheet are migrated, as on the entries sheet the backfill replaces
+    eligible_roles = GoogleRunner(SPREADSHEET_ID, CREDENTIALS_FILE, ENTRIES_SHEET, LOGS_SHEET, ROLES_SHEET,
+                                  WEEKLY_TASKS_SHEET, PROJECTS_SHEET).get_eligible_roles()
+    harvest_runner = HarvestAnalytics(PAST_ENTRIES_LOOKUP, HARVEST_ACCOUNT_ID, HARVEST_TOKEN)
+    harvest_reader = HarvestReader(PAST_ENTRIES_LOOKUP, HARVEST_ACCOUNT_ID, HARVEST_TOKEN,
+                                   eligible_roles=eligible_roles)
+    float_writer = FloatWriter(FLOAT_TOKEN, users=harvest_runner.harvest_users,
+                               projects=harvest_runner.harvest_projects, clients=harvest_runner.harvest_clients)
+    completed = journal.completed_windows(task_type)
+    windows = [window for window in month_windows(start_date, end_date)
+               if f'{task_type}:{window[0]}:{window[1]}' not in completed]
+    print(f'Backfilling {len(windows)} monthly windows from {start_date} to {end_date} with {workers} workers, '
+          f'{len(completed)} windows already completed')
+
+    def backfill_window(from_date, to_date):
+        window_key = f'{task_type}:{from_date}:{to_date}'
+        rows = [row for page_rows in harvest_reader.iter_window_pages(from_date, to_date) for row in page_rows]
+        # rows posted by an interrupted run without their response being journaled are found on Float
+        existing = float_writer.get_logged_time_index(from_date, to_date)
+        created = float_writer.create_tasks_from_ghseet(rows, journal=journal, existing=existing)
+        final = journal.final_count(journal.row_key(row, task_type) for row in rows)
+        status = 'complete' if final == len(rows) else 'incomplete'
+        journal.finish_window(window_key, task_type, status, len(rows), created)
+        print(f'Window {from_date} - {to_date}: {len(rows)} entries, {created} created, {status}')
+        return created
+
+    created = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(backfill_window, *window): window for window in windows}
+        for future in as_completed(futures):
+            try:
+                created += future.result()
+            except Exception as e:
+                print(f'Error while backfilling {futures[future][0]} - {futures[future][1]}. Error was {e}')
+    print(f'Backfill done, {created} tasks created. Journal: {journal.summary(task_type)}')
+    journal.close()
+    return created
+
+
 def read_gsheet_data(credentials_file, spreadsheet_id, sheet_range):
     """
     Append rows to Google Sheet
@@ -659,6 +755,9 @@ def google_auth(credential_file):
 
 def main(event, context):
     logging.info(f'Payload input data is {event} and context {context}')
+    if BACKFILL_FROM:
+        backfill(BACKFILL_FROM, BACKFILL_TO, BACKFILL_WORKERS, FLOAT_JOURNAL)
+        return
     # harvest_runner = HarvestAnalytics(PAST_ENTRIES_LOOKUP, HARVEST_ACCOUNT_ID, HARVEST_TOKEN)
     # harvest_projects = harvest_runner.harvest_projects
     # harvest_users = harvest_runner.harvest_users
@@ -0,0 +1,503 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+
+HARVEST_PER_PAGE = 100
+FLOAT_PER_PAGE = 50
+FLOAT_MAX_PER_PAGE = 200
+SHEETS_MIN_ROW_COUNT = 1000
+CELL = re.compile(r'^([A-Z]*)(\d*)$')
+
+
+class FakeApiSettings:
+    """
+    A class to hold the behaviour of a fake API: latency, rate limit and injected 429s
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=None, rate_window=60, error_ratio=0.0, seed=0):
+        """
+        :param latency: seconds added to every response
+        :param jitter: extra random seconds, up to this value
+        :param rate_limit: requests allowed per rate window, unlimited if None
+        :param rate_window: rate limit window in seconds, 15 for Harvest and 60 for Float and Sheets
+        :param error_ratio: share of requests answered with a 429 regardless of the rate limit
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.error_ratio = error_ratio
+        self.random = random.Random(seed)
+
+
+class RateWindow:
+    """
+    A class to count requests over a sliding window, as the real APIs rate limit them
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.requests = deque()
+        self.lock = threading.Lock()
+
+    def hit(self):
+        """
+        Count a request
+        :return: (allowed, remaining requests, seconds until a slot frees up)
+        """
+        with self.lock:
+            now = time.monotonic()
+            while self.requests and now - self.requests[0] >= self.window:
+                self.requests.popleft()
+            if self.limit is None:
+                self.requests.append(now)
+                return True, None, 0
+            if len(self.requests) >= self.limit:
+                return False, 0, self.window - (now - self.requests[0])
+            self.requests.append(now)
+            return True, self.limit - len(self.requests), 0
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """
+    Base request handler, applying latency, rate limits and injected errors before routing the request
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        settings = self.server.settings
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        url = urlparse(self.path)
+        self.raw_path = url.path
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        delay = settings.latency + (settings.random.uniform(0, settings.jitter) if settings.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        allowed, remaining, retry_after = self.server.rate_window.hit()
+        self.rate_headers = self.get_rate_headers(remaining)
+        self.server.count(method, url.path, allowed)
+        if not allowed or (settings.error_ratio and settings.random.random() < settings.error_ratio):
+            self.rate_limited(max(1, round(retry_after)))
+            return
+        try:
+            self.route(method)
+        except KeyError as e:
+            self.send_json(404, {"error": f"Not found: {e}"})
+
+    def get_rate_headers(self, remaining):
+        return {}
+
+    def rate_limited(self, retry_after):
+        self.send_json(429, {"error": "Too many requests"}, {"Retry-After": str(retry_after)})
+
+    def form(self):
+        """
+        Decode a form or JSON request body
+        """
+        if not self.body:
+            return {}
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            return json.loads(self.body)
+        return {key: values[-1] for key, values in parse_qs(self.body.decode()).items()}
+
+    def send_json(self, status, payload, headers=None):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in {**self.rate_headers, **(headers or {})}.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def route(self, method):
+        raise NotImplementedError
+
+
+class HarvestHandler(FakeApiHandler):
+    """
+    Harvest v2 endpoints used by HarvestAnalytics, paginated by a total_pages body field
+    """
+
+    def route(self, method):
+        account = self.server.account
+        path = self.raw_path.split('/v2/', 1)[-1].strip('/')
+        if method == 'GET' and path == 'users':
+            # users are read from the first page only, the whole list is returned at once
+            self.send_page('users', account.harvest_users(), per_page=len(account.people))
+        elif method == 'GET' and path == 'projects':
+            self.send_page('projects', account.harvest_projects())
+        elif method == 'GET' and path == 'tasks':
+            self.send_page('tasks', account.harvest_tasks())
+        elif method == 'GET' and path == 'clients':
+            self.send_page('clients', account.harvest_clients())
+        elif method == 'GET' and path == 'reports/project_budget':
+            self.send_page('results', account.harvest_budgets())
+        elif method == 'GET' and path == 'time_entries':
+            self.send_time_entries()
+        elif method == 'POST' and path == 'time_entries':
+            with self.server.lock:
+                self.server.created_id += 1
+                entry = dict(self.form(), id=self.server.created_id)
+            self.send_json(201, entry)
+        elif method == 'DELETE' and path.startswith('time_entries/'):
+            self.send_json(200, {"id": int(path.split('/')[-1])})
+        else:
+            raise KeyError(path)
+
+    def page_number(self):
+        return max(1, int(self.query.get('page', 1)))
+
+    def send_page(self, key, items, per_page=HARVEST_PER_PAGE):
+        page = self.page_number()
+        total_pages = max(1, -(-len(items) // per_page))
+        self.send_json(200, {key: items[(page - 1) * per_page:page * per_page],
+                             "per_page": per_page,
+                             "total_pages": total_pages,
+                             "total_entries": len(items),
+                             "page": page})
+
+    def send_time_entries(self):
+        account = self.server.account
+        page = self.page_number()
+        start, stop = account.entry_range(self.query.get('from'), self.query.get('to'))
+        total_pages = max(1, -(-(stop - start) // HARVEST_PER_PAGE))
+        first = start + (page - 1) * HARVEST_PER_PAGE
+        entries = [account.time_entry(index) for index in range(first, min(stop, first + HARVEST_PER_PAGE))]
+        self.send_json(200, {"time_entries": entries,
+                             "per_page": HARVEST_PER_PAGE,
+                             "total_pages": total_pages,
+                             "total_entries": stop - start,
+                             "page": page})
+
+
+class FloatHandler(FakeApiHandler):
+    """
+    Float v3 endpoints used by FloatAnalytics, paginated by X-Pagination headers and rate limited per minute
+    """
+
+    def get_rate_headers(self, remaining):
+        limit = self.server.settings.rate_limit
+        if limit is None:
+            return {}
+        return {"X-RateLimit-Limit-Minute": str(limit), "X-RateLimit-Remaining-Minute": str(remaining)}
+
+    def route(self, method):
+        collections = self.server.collections
+        path = self.raw_path.split('/v3/', 1)[-1].strip('/')
+        resource, _, item_id = path.partition('/')
+        if method == 'GET' and not item_id:
+            self.send_page(self.filter_dates(collections[resource]))
+        elif method == 'POST' and not item_id and resource in ('logged-time', 'tasks', 'clients', 'projects'):
+            self.send_json(200, self.server.create(resource, self.form()))
+        elif method == 'PATCH' and item_id:
+            self.send_json(200, self.server.update(resource, int(item_id), self.form()))
+        else:
+            raise KeyError(path)
+
+    def filter_dates(self, items):
+        start_date = self.query.get('start_date')
+        end_date = self.query.get('end_date')
+        if not start_date and not end_date:
+            return items
+        return [item for item in items if (not start_date or item.get("date", "") >= start_date)
+                and (not end_date or item.get("date", "") <= end_date)]
+
+    def send_page(self, items):
+        page = max(1, int(self.query.get('page', 1)))
+        per_page = min(FLOAT_MAX_PER_PAGE, int(self.query.get('per-page', FLOAT_PER_PAGE)))
+        page_count = max(1, -(-len(items) // per_page))
+        self.send_json(200, items[(page - 1) * per_page:page * per_page],
+                       {"X-Pagination-Total-Count": str(len(items)),
+                        "X-Pagination-Page-Count": str(page_count),
+                        "X-Pagination-Current-Page": str(page),
+                        "X-Pagination-Per-Page": str(per_page)})
+
+
+class SheetsHandler(FakeApiHandler):
+    """
+    Sheets v4 values endpoints used by GoogleRunner, with the Sheets A1 notation subset it writes
+    """
+
+    def rate_limited(self, retry_after):
+        self.send_json(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                       "message": "Quota exceeded for quota metric 'Read requests'"}})
+
+    def route(self, method):
+        path = self.raw_path.split('/v4/spreadsheets/', 1)[-1]
+        spreadsheet_id, _, rest = path.partition('/')
+        sheets = self.server.spreadsheet
+        if method == 'GET' and not rest:
+            sheet_name = unquote(self.query.get('ranges', '')).split('!')[0].strip("'")
+            row_count = max(SHEETS_MIN_ROW_COUNT, len(sheets.rows(sheet_name)))
+            self.send_json(200, {"sheets": [{"properties": {"title": sheet_name, "gridProperties": {
+                "rowCount": row_count, "columnCount": 26}}}]})
+        elif method == 'POST' and rest == 'values:batchUpdate':
+            data = self.form()["data"]
+            updated = [sheets.write(value_range["range"], value_range["values"]) for value_range in data]
+            updated_sheets = {value_range["range"].split('!')[0] for value_range in data}
+            self.send_json(200, {"spreadsheetId": spreadsheet_id,
+                                 "totalUpdatedRows": sum(rows for rows, _ in updated),
+                                 "totalUpdatedCells": sum(cells for _, cells in updated),
+                                 "totalUpdatedSheets": len(updated_sheets),
+                                 "responses": []})
+        elif method == 'POST' and rest.startswith('values/') and rest.endswith(':append'):
+            sheet_range = unquote(rest[len('values/'):-len(':append')])
+            updated_range, rows, cells = sheets.append(sheet_range, self.form().get("values", []))
+            self.send_json(200, {"spreadsheetId": spreadsheet_id, "updates": {
+                "updatedRange": updated_range, "updatedRows": rows, "updatedCells": cells}})
+        elif method == 'PUT' and rest.startswith('values/'):
+            sheet_range = unquote(rest[len('values/'):])
+            rows, cells = sheets.write(sheet_range, self.form().get("values", []))
+            self.send_json(200, {"spreadsheetId": spreadsheet_id, "updatedRange": sheet_range,
+                                 "updatedRows": rows, "updatedCells": cells})
+        elif method == 'GET' and rest.startswith('values/'):
+            sheet_range = unquote(rest[len('values/'):])
+            formatted = self.query.get('valueRenderOption', 'FORMATTED_VALUE') == 'FORMATTED_VALUE'
+            values = sheets.read(sheet_range, formatted)
+            response = {"range": sheet_range, "majorDimension": "ROWS"}
+            if values:
+                response["values"] = values
+            self.send_json(200, response)
+        else:
+            raise KeyError(rest)
+
+
+class FakeSpreadsheet:
+    """
+    A class to hold a spreadsheet as rows of raw values by sheet name
+    """
+
+    def __init__(self, sheets):
+        self.sheets = sheets
+        self.lock = threading.Lock()
+
+    def rows(self, sheet):
+        if sheet not in self.sheets:
+            raise KeyError(f'Unable to parse range: {sheet}')
+        return self.sheets[sheet]
+
+    @staticmethod
+    def column_index(letters):
+        index = 0
+        for letter in letters:
+            index = index * 26 + ord(letter) - 64
+        return index - 1
+
+    def parse_range(self, sheet_range):
+        """
+        Parse an A1 range, 'Sheet', 'Sheet!A2:M', 'Sheet!5:10' or 'Sheet!C5'
+        :return: (sheet, first row, last row or None, first column, last column or None), zero based
+        """
+        sheet, _, cells = sheet_range.partition('!')
+        sheet = sheet.strip("'")
+        if not cells:
+            return sheet, 0, None, 0, None
+        first, _, last = cells.partition(':')
+        first_column, first_row = CELL.match(first).groups()
+        last_column, last_row = CELL.match(last).groups() if last else (first_column, first_row)
+        return (sheet,
+                int(first_row) - 1 if first_row else 0,
+                int(last_row) - 1 if last_row else None,
+                self.column_index(first_column) if first_column else 0,
+                self.column_index(last_column) if last_column else None)
+
+    @staticmethod
+    def formatted(value):
+        if isinstance(value, bool):
+            return str(value).upper()
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return '' if value is None else str(value)
+
+    def read(self, sheet_range, formatted=True):
+        """
+        Read a range as the values API does, trailing empty rows and cells left out
+        """
+        sheet, first_row, last_row, first_column, last_column = self.parse_range(sheet_range)
+        with self.lock:
+            rows = self.rows(sheet)[first_row:None if last_row is None else last_row + 1]
+            values = []
+            for row in rows:
+                row = row[first_column:None if last_column is None else last_column + 1]
+                while row and row[-1] in ('', None):
+                    row = row[:-1]
+                values.append([self.formatted(value) for value in row] if formatted else list(row))
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def write(self, sheet_range, values):
+        """
+        Write values from the top left cell of a range
+        :return: (updated rows, updated cells)
+        """
+        sheet, first_row, _, first_column, _ = self.parse_range(sheet_range)
+        with self.lock:
+            rows = self.rows(sheet)
+            while len(rows) < first_row + len(values):
+                rows.append([])
+            for offset, values_row in enumerate(values):
+                row = rows[first_row + offset]
+                if len(row) < first_column + len(values_row):
+                    row.extend([''] * (first_column + len(values_row) - len(row)))
+                row[first_column:first_column + len(values_row)] = ['' if value is None else value
+                                                                    for value in values_row]
+        return len(values), sum(len(values_row) for values_row in values)
+
+    def append(self, sheet_range, values):
+        """
+        Append rows after the last non empty row of a sheet
+        :return: (updated range, updated rows, updated cells)
+        """
+        sheet = self.parse_range(sheet_range)[0]
+        with self.lock:
+            rows = self.rows(sheet)
+            while rows and not any(value not in ('', None) for value in rows[-1]):
+                rows.pop()
+            first_row = len(rows) + 1
+            rows.extend([['' if value is None else value for value in row] for row in values])
+        cells = sum(len(row) for row in values)
+        return f'{sheet}!A{first_row}:{first_row + len(values) - 1}', len(values), cells
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server sharing a synthetic account, settings and request counters with its handlers
+    """
+    daemon_threads = True
+
+    def __init__(self, handler, account, settings):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.account = account
+        self.settings = settings
+        self.rate_window = RateWindow(settings.rate_limit, settings.rate_window)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.created_id = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count(self, method, path, allowed):
+        endpoint = re.sub(r'/\d+(?=/|$)', '/{id}', re.sub(r'/values/[^:/]+', '/values/{range}', path))
+        key = f'{method} {endpoint}'
+        with self.lock:
+            counters = self.requests.setdefault(key, {"requests": 0, "rate_limited": 0})
+            counters["requests"] += 1
+            counters["rate_limited"] += 0 if allowed else 1
+
+
+class FakeFloatServer(FakeApiServer):
+    """
+    Float server keeping the records created and patched during a run
+    """
+
+    def __init__(self, account, settings):
+        super().__init__(FloatHandler, account, settings)
+        self.collections = {"clients": account.float_clients(),
+                            "projects": account.float_projects(),
+                            "people": account.float_people(),
+                            "logged-time": [],
+                            "tasks": []}
+        self.id_keys = {"clients": "client_id", "projects": "project_id", "people": "people_id",
+                        "logged-time": "logged_time_id", "tasks": "task_id"}
+        self.indexes = {resource: {item[self.id_keys[resource]]: item for item in items}
+                        for resource, items in self.collections.items()}
+
+    def create(self, resource, fields):
+        with self.lock:
+            self.created_id += 1
+            item = dict(fields, **{self.id_keys[resource]: self.created_id})
+            self.collections[resource].append(item)
+            self.indexes[resource][self.created_id] = item
+            return item
+
+    def update(self, resource, item_id, fields):
+        with self.lock:
+            item = self.indexes[resource][item_id]
+            item.update(fields)
+            return item
+
+
+class FakeSheetsServer(FakeApiServer):
+    def __init__(self, account, settings, sheets):
+        super().__init__(SheetsHandler, account, settings)
+        self.spreadsheet = FakeSpreadsheet(sheets)
+
+
+class FakeApis:
+    """
+    A class to run fake Harvest, Float and Sheets servers for a synthetic account, each on its own thread
+    """
+
+    def __init__(self, account, sheets, harvest_settings=None, float_settings=None, sheets_settings=None):
+        self.harvest = FakeApiServer(HarvestHandler, account, harvest_settings or FakeApiSettings(rate_window=15))
+        self.float = FakeFloatServer(account, float_settings or FakeApiSettings())
+        self.sheets = FakeSheetsServer(account, sheets_settings or FakeApiSettings(), sheets)
+        self.servers = [self.harvest, self.float, self.sheets]
+        self.threads = []
+
+    def start(self):
+        for server in self.servers:
+            thread = threading.Thread(target=server.serve_forever, name=f'fake-{server.__class__.__name__}',
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def env(self):
+        """
+        Environment variables pointing the wrappers to the fake servers
+        """
+        return {"HARVEST_API_URL": f'{self.harvest.url}/v2/',
+                "FLOAT_API_URL": f'{self.float.url}/v3',
+                "SHEETS_API_URL": f'{self.sheets.url}/'}
+
+    def stats(self):
+        """
+        Requests served per endpoint, Float records created and the entries sheet size
+        """
+        return {"harvest": dict(self.harvest.requests),
+                "float": dict(self.float.requests),
+                "sheets": dict(self.sheets.requests),
+                "float_logged_time": len(self.float.collections["logged-time"]),
+                "float_tasks": len(self.float.collections["tasks"])}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
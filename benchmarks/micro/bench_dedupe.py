@@ -0,0 +1,43 @@
+import pytest
+from gsheet.gsheet_wrapper import GoogleRunner
+from gsheet.sheet_schema import decode_rows, ENTRIES_SCHEMA
+
+
+SIZES = [1000, 10000, 100000]
+
+
+def google_runner(current_rows):
+    """
+    GoogleRunner reading the given typed rows as the entries sheet
+    """
+    runner = GoogleRunner.__new__(GoogleRunner)
+    runner.entries_sheet = 'Entries'
+    runner.read_typed_rows = lambda sheet_range, schema, header=True: current_rows
+    return runner
+
+
+def dedupe_data(account):
+    """
+    Half of the account already on the sheet, every entry coming from Harvest
+    """
+    input_rows = [account.entry_row(index) for index in range(account.entries)]
+    current_rows = decode_rows(input_rows[::2], ENTRIES_SCHEMA)
+    return input_rows, current_rows
+
+
+@pytest.mark.parametrize('entries', SIZES)
+def bench_get_missing_rows(benchmark, accounts, entries):
+    account = accounts(entries)
+    input_rows, current_rows = dedupe_data(account)
+    runner = google_runner(current_rows)
+    new_rows = benchmark(runner.get_missing_rows, input_rows, account.days + 1)
+    assert len(new_rows) == entries // 2
+
+
+@pytest.mark.parametrize('entries', SIZES)
+def bench_get_new_rows(benchmark, accounts, entries):
+    account = accounts(entries)
+    input_rows, current_rows = dedupe_data(account)
+    runner = google_runner(current_rows)
+    new_rows = benchmark(runner.get_new_rows, input_rows, account.days + 1)
+    assert len(new_rows) == entries // 2
@@ -0,0 +1,105 @@
+import pytest
+from float.float_wrapper import FloatAnalytics
+from float.float_rate import FloatRateGovernor
+from identity.identity_map import IdentityMap
+
+
+# account sizes of 20, 200 and 2000 projects
+SIZES = [10000, 100000, 1000000]
+LOOKUPS = 200
+TASK_ROWS = [1000, 10000]
+
+
+def float_runner(account, session=None):
+    """
+    FloatAnalytics with the account Float and Harvest reference data, skipping the requests __init__ makes
+    """
+    runner = FloatAnalytics.__new__(FloatAnalytics)
+    runner.float_token = 'benchmark'
+    runner.float_api = 'https://api.float.com/v3'
+    runner.session = session
+    # unbounded, the replayed responses don't count against any rate limit
+    runner.governor = FloatRateGovernor(requests_per_minute=10 ** 9)
+    runner.float_projects = {project["project_id"]: {"name": project["name"].upper(),
+                                                     "budget": project["budget_total"],
+                                                     "client": project["client_id"],
+                                                     "code": project["tags"][0] if project["tags"] else "",
+                                                     "is_active": project["active"],
+                                                     "is_billable": project["non_billable"]}
+                             for project in account.float_projects()}
+    runner.float_users = {person["name"]: {"id": person["people_id"], "role": person["job_title"],
+                                           "default_hourly_rate": person["default_hourly_rate"],
+                                           "active": person["active"] == 1} for person in account.float_people()}
+    runner.harvest_projects = {project["id"]: {"name": project["name"], "code": project["code"],
+                                               "is_active": project["is_active"],
+                                               "is_billable": project["is_billable"],
+                                               "client": project["client"]} for project in account.projects}
+    runner.float_clients = {client["name"]: {"id": client["client_id"]} for client in account.float_clients()}
+    runner.harvest_users = {person["name"]: {"id": person["id"], "role": person["role"],
+                                             "default_hourly_rate": person["default_hourly_rate"],
+                                             "active": person["is_active"]} for person in account.people}
+    runner.identity = IdentityMap()
+    runner.identity.update(runner.float_users, runner.float_projects, runner.float_clients, runner.harvest_users,
+                           runner.harvest_projects)
+    return runner
+
+
+def lookups(account):
+    """
+    Project names and codes spread over the whole projects list
+    """
+    step = max(1, len(account.projects) // LOOKUPS)
+    return [(project["name"], project["code"]) for project in account.projects[::step]]
+
+
+@pytest.mark.parametrize('entries', SIZES)
+def bench_identity_match_project(benchmark, accounts, entries):
+    account = accounts(entries)
+    runner = float_runner(account)
+    projects = lookups(account)
+    # the match a name not seen yet goes through, IdentityMap.project caching its result
+    project_ids = benchmark(lambda: [runner.identity.match_project(name, code) for name, code in projects])
+    assert all(project_ids)
+
+
+@pytest.mark.parametrize('entries', SIZES)
+def bench_identity_project(benchmark, accounts, entries):
+    account = accounts(entries)
+    runner = float_runner(account)
+    projects = lookups(account)
+    project_ids = benchmark(lambda: [runner.identity.project(name, code) for name, code in projects])
+    assert all(project_ids)
+
+
+@pytest.mark.parametrize('entries', SIZES)
+def bench_fuzzy_project_search(benchmark, accounts, entries):
+    account = accounts(entries)
+    runner = float_runner(account)
+    fuzzy_index = runner.identity.project_index()
+    # drifted names, a character dropped from the name and the code
+    projects = [(name[:-2] + name[-1], code[:-1]) for name, code in lookups(account)]
+    ranked = benchmark(lambda: [fuzzy_index.search(name, code) for name, code in projects])
+    assert all(ranked)
+
+
+@pytest.mark.parametrize('entries', SIZES)
+def bench_identity_harvest_project(benchmark, accounts, entries):
+    account = accounts(entries)
+    runner = float_runner(account)
+    projects = lookups(account)
+
+    def harvest_project(name, code):
+        harvest_id = runner.identity.harvest_id('projects', runner.identity.project(name, code))
+        return runner.harvest_projects.get(harvest_id)
+
+    project_data = benchmark(lambda: [harvest_project(name, code) for name, code in projects])
+    assert all(project_data)
+
+
+@pytest.mark.parametrize('rows', TASK_ROWS)
+def bench_create_tasks_bodies(benchmark, accounts, replay_session, rows):
+    account = accounts(100000)
+    runner = float_runner(account, replay_session())
+    sheet_rows = [account.entry_row(index) for index in range(rows)]
+    created = benchmark(runner.create_tasks_from_ghseet, sheet_rows)
+    assert created == rows
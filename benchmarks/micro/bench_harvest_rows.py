@@ -0,0 +1,37 @@
+import pytest
+from benchmarks.synthetic import ROLES
+from harvest.harvest_wrapper import HarvestAnalytics
+
+
+SIZES = [1000, 10000, 100000]
+PER_PAGE = 100
+
+
+def harvest_runner(account, session):
+    """
+    HarvestAnalytics with the account reference data, skipping the requests __init__ makes
+    """
+    runner = HarvestAnalytics.__new__(HarvestAnalytics)
+    runner.past_entries_lookup = account.days + 1
+    runner.harvest_api = 'https://api.harvestapp.com/v2/'
+    runner.harvest_token = 'benchmark'
+    runner.harvest_account = '1'
+    runner.session = session
+    runner.harvest_eligible_roles = dict(ROLES)
+    runner.harvest_users = {person["name"]: {"role": person["role"],
+                                             "geography": 'USA' if 'US' in person["timezone"].upper() else 'SPAIN',
+                                             "id": person["id"],
+                                             "default_hourly_rate": person["default_hourly_rate"],
+                                             "active": person["is_active"]} for person in account.people}
+    return runner
+
+
+@pytest.mark.parametrize('entries', SIZES)
+def bench_get_row_list(benchmark, accounts, replay_session, entries):
+    account = accounts(entries)
+    total_pages = -(-entries // PER_PAGE)
+    pages = [{"time_entries": [account.time_entry(index) for index in range(first, min(first + PER_PAGE, entries))],
+              "total_pages": total_pages} for first in range(0, entries, PER_PAGE)]
+    runner = harvest_runner(account, replay_session(pages))
+    rows = benchmark(runner.get_row_list, runner.harvest_api + 'time_entries', {}, total_pages)
+    assert len(rows) == entries
@@ -0,0 +1,35 @@
+import os
+import re
+import subprocess
+import sys
+import pytest
+from benchmarks.run_e2e import ROOT_DIR
+
+
+HEAVY_MODULES = ("requests", "urllib3", "googleapiclient", "oauth2client", "httplib2", "unidecode")
+IMPORT_ROUNDS = 5
+IMPORT_LINE = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| (\S+)$')
+
+
+def cold_import(module):
+    """
+    Import a module on a fresh interpreter with an empty environment, as a Cloud Function cold start does
+    :return: (cumulative import microseconds, heavy modules loaded)
+    """
+    code = f'import sys, {module}; print(",".join(name for name in {HEAVY_MODULES!r} if name in sys.modules))'
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT_DIR, capture_output=True,
+                               text=True, env={"PATH": os.environ.get("PATH", "")}, check=True)
+    microseconds = [int(match.group(1)) for match in map(IMPORT_LINE.match, completed.stderr.splitlines())
+                    if match and match.group(2) == module]
+    return microseconds[-1], [name for name in completed.stdout.strip().split(',') if name]
+
+
+@pytest.mark.parametrize('module', ['cloud_function'])
+def bench_cold_import(request, module):
+    budget_ms = request.config.getoption('import_budget_ms')
+    timings = [cold_import(module) for _ in range(IMPORT_ROUNDS)]
+    import_ms = min(microseconds for microseconds, _ in timings) / 1000
+    heavy_modules = timings[0][1]
+    print(f'{module} cold import: {import_ms:.1f} ms, budget {budget_ms:.0f} ms')
+    assert not heavy_modules, f'{module} imports {heavy_modules} at module load'
+    assert import_ms <= budget_ms, f'{module} cold import took {import_ms:.1f} ms, over the {budget_ms:.0f} ms budget'
@@ -0,0 +1,161 @@
+import json
+import os
+import statistics
+import sys
+import time
+import pytest
+
+
+MICRO_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(os.path.dirname(MICRO_DIR))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.synthetic import SyntheticAccount  # noqa: E402
+
+
+DEFAULT_BASELINE_FILE = os.path.join(MICRO_DIR, 'baselines.json')
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption('--baseline-file', default=DEFAULT_BASELINE_FILE, help='stored baselines JSON file')
+    group.addoption('--save-baselines', action='store_true',
+                    help='store this run timings as the new baselines instead of comparing against them')
+    group.addoption('--tolerance', type=float, default=0.25,
+                    help='allowed slowdown over the baseline minimum time, 0.25 being 25%%')
+    group.addoption('--min-rounds', type=int, default=5, help='minimum timed rounds per benchmark')
+    group.addoption('--min-time', type=float, default=0.5, help='minimum seconds spent timing each benchmark')
+    group.addoption('--import-budget-ms', type=float, default=100,
+                    help='cold import time allowed for the Cloud Function entry point module')
+
+
+class Benchmark:
+    """
+    A class to time a callable over several rounds, pytest-benchmark style, and check it against its baseline
+    """
+
+    def __init__(self, name, baseline, tolerance, min_rounds, min_time, max_rounds=1000):
+        self.name = name
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.min_rounds = min_rounds
+        self.min_time = min_time
+        self.max_rounds = max_rounds
+        self.stats = None
+
+    def __call__(self, func, *args, **kwargs):
+        """
+        Run func once to warm up, then time it until both the minimum rounds and minimum time are reached
+        :return: func result
+        """
+        result = func(*args, **kwargs)
+        timings = []
+        started = time.perf_counter()
+        while len(timings) < self.max_rounds and (len(timings) < self.min_rounds or
+                                                  time.perf_counter() - started < self.min_time):
+            round_started = time.perf_counter()
+            func(*args, **kwargs)
+            timings.append(time.perf_counter() - round_started)
+        self.stats = {"min": min(timings), "median": statistics.median(timings), "rounds": len(timings)}
+        if self.baseline and self.stats["min"] > self.baseline["min"] * (1 + self.tolerance):
+            pytest.fail(f'{self.name} regressed: {self.stats["min"] * 1000:.3f} ms against a '
+                        f'{self.baseline["min"] * 1000:.3f} ms baseline, over the {self.tolerance:.0%} tolerance',
+                        pytrace=False)
+        return result
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+@pytest.fixture
+def benchmark(request):
+    config = request.config
+    if not hasattr(config, 'benchmark_baselines'):
+        config.benchmark_baselines = load_baselines(config.getoption('baseline_file'))
+        config.benchmark_results = {}
+    name = request.node.nodeid.split('::', 1)[-1]
+    baseline = None if config.getoption('save_baselines') else config.benchmark_baselines.get(name)
+    bench = Benchmark(name, baseline, config.getoption('tolerance'), config.getoption('min_rounds'),
+                      config.getoption('min_time'))
+    yield bench
+    if bench.stats:
+        config.benchmark_results[name] = bench.stats
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    results = getattr(config, 'benchmark_results', {})
+    if not results:
+        return
+    terminalreporter.section('benchmarks')
+    for name, stats in sorted(results.items()):
+        baseline = config.benchmark_baselines.get(name)
+        change = f'{stats["min"] / baseline["min"] - 1:+.1%}' if baseline else 'no baseline'
+        terminalreporter.write_line(f'{name:<60} min {stats["min"] * 1000:10.3f} ms  '
+                                    f'median {stats["median"] * 1000:10.3f} ms  {stats["rounds"]:5} rounds  {change}')
+
+
+def pytest_sessionfinish(session):
+    config = session.config
+    results = getattr(config, 'benchmark_results', {})
+    if not results or not config.getoption('save_baselines'):
+        return
+    baselines = dict(config.benchmark_baselines)
+    baselines.update({name: {"min": stats["min"], "median": stats["median"]} for name, stats in results.items()})
+    with open(config.getoption('baseline_file'), 'w') as baseline_file:
+        json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+
+
+class PageResponse:
+    """
+    In-memory stand-in for the requests responses the wrappers read
+    """
+
+    def __init__(self, payload, headers=None, status_code=200):
+        self.payload = payload
+        self.headers = headers or {}
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+
+class ReplaySession:
+    """
+    A session answering GET requests with pre-built pages and POST / PATCH requests with a fixed response
+    """
+
+    def __init__(self, pages=None, post_response=None):
+        self.pages = pages or []
+        self.post_response = post_response or PageResponse({}, {"X-RateLimit-Remaining-Minute": "1000"})
+
+    def get(self, url, verify=True, params=None, headers=None):
+        return PageResponse(self.pages[(params or {}).get('page', 1) - 1])
+
+    def post(self, url, verify=True, headers=None, data=None):
+        return self.post_response
+
+    def request(self, method, url, **kwargs):
+        if method.lower() == 'get':
+            return self.get(url, **kwargs)
+        return self.post_response
+
+
+@pytest.fixture(scope='session')
+def accounts():
+    cache = {}
+
+    def get_account(entries):
+        if entries not in cache:
+            cache[entries] = SyntheticAccount(entries, days=365)
+        return cache[entries]
+    return get_account
+
+
+@pytest.fixture
+def replay_session():
+    return ReplaySession
@@ -0,0 +1,176 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from benchmarks.fake_apis import FakeApis, FakeApiSettings
+from benchmarks.synthetic import SyntheticAccount
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_MARKER = 'BENCHMARK_RESULT '
+SHEET_NAMES = {"ENTRIES_SHEET": "Entries", "LOGS_SHEET": "Logs", "ROLES_SHEET": "Roles",
+               "WEEKLY_TASKS_SHEET": "Weekly Tasks", "PROJECTS_SHEET": "Projects", "TEST_SHEET": "Test"}
+TARGETS = ("cloud_function", "main_local")
+
+
+def serve(options, entries, connection):
+    """
+    Run the fake APIs of a synthetic account on their own process, so serving requests doesn't compete
+    with the benchmarked pipeline for the GIL
+    :param options: parsed command line options
+    :param entries: account size
+    :param connection: pipe end, receiving the fake APIs env first and their stats once told to stop
+    """
+    account = SyntheticAccount(entries, days=options.days, existing_ratio=options.existing_ratio)
+    sheets = account.sheets(*(SHEET_NAMES[name] for name in ("ENTRIES_SHEET", "LOGS_SHEET", "ROLES_SHEET",
+                                                            "WEEKLY_TASKS_SHEET", "PROJECTS_SHEET", "TEST_SHEET")))
+    latency = options.latency_ms / 1000
+    jitter = options.jitter_ms / 1000
+    fake_apis = FakeApis(account, sheets,
+                         harvest_settings=FakeApiSettings(latency, jitter, options.harvest_rate_limit, 15),
+                         float_settings=FakeApiSettings(latency, jitter, options.float_rate_limit, 60),
+                         sheets_settings=FakeApiSettings(latency, jitter, options.sheets_rate_limit, 60,
+                                                         error_ratio=options.sheets_429_ratio))
+    with fake_apis:
+        connection.send(fake_apis.env())
+        connection.recv()
+        stats = fake_apis.stats()
+        stats["entries_sheet_rows"] = len(sheets[SHEET_NAMES["ENTRIES_SHEET"]]) - 1
+        connection.send(stats)
+
+
+def run_target(target):
+    """
+    Run a pipeline entry point in this process, measuring wall time and peak memory
+    :param target: cloud_function or main_local
+    :return: measures dict
+    """
+    trace = os.environ.get("BENCHMARK_TRACEMALLOC", "true") == "true"
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    if target == "cloud_function":
+        import cloud_function
+        imported = time.perf_counter()
+        cloud_function.runner({"benchmark": True}, None)
+    else:
+        import main_local
+        imported = time.perf_counter()
+        main_local.main('benchmark', None)
+    finished = time.perf_counter()
+    peak = tracemalloc.get_traced_memory()[1] if trace else None
+    return {"import_seconds": round(imported - started, 3),
+            "run_seconds": round(finished - imported, 3),
+            "wall_seconds": round(finished - started, 3),
+            "peak_traced_mb": round(peak / 2 ** 20, 1) if trace else None,
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def benchmark(options, entries, target):
+    """
+    Benchmark a pipeline entry point against fresh fake APIs of a given size, on a child process
+    :return: result dict
+    """
+    parent_connection, child_connection = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(options, entries, child_connection), daemon=True)
+    server.start()
+    fake_env = parent_connection.recv()
+    report_file = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+    report_file.close()
+    # journal and identity map start empty on every run, state left by a previous run would skip its posts or
+    # link the reused fake ids
+    state_dir = tempfile.TemporaryDirectory(prefix='benchmark-state-')
+    env = dict(os.environ, **SHEET_NAMES, **fake_env)
+    env.update({"SPREADSHEET_ID": "benchmark",
+                "CREDENTIALS_FILE": "benchmark-credentials.json",
+                "HARVEST_TOKEN": "benchmark",
+                "HARVEST_ACCOUNT_ID": "1",
+                "FLOAT_TOKEN": "benchmark",
+                "PAST_ENTRIES_LOOKUP": str(options.days),
+                "STREAM_ENTRIES": "true" if options.stream else "false",
+                "RUN_REPORT_PATH": report_file.name,
+                "FLOAT_JOURNAL": os.path.join(state_dir.name, 'float_journal.sqlite3'),
+                "IDENTITY_MAP": os.path.join(state_dir.name, 'identity_map.json'),
+                "BENCHMARK_TRACEMALLOC": "false" if options.no_tracemalloc else "true"})
+    try:
+        completed = subprocess.run([sys.executable, '-m', 'benchmarks.run_e2e', '--child', target], cwd=ROOT_DIR,
+                                   env=env, capture_output=True, text=True)
+    finally:
+        parent_connection.send('stop')
+        server_stats = parent_connection.recv()
+        server.join()
+        state_dir.cleanup()
+    result_lines = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_MARKER)]
+    if completed.returncode or not result_lines:
+        print(completed.stdout[-5000:])
+        print(completed.stderr[-5000:])
+        raise RuntimeError(f'{target} benchmark for {entries} entries failed')
+    measures = json.loads(result_lines[-1][len(RESULT_MARKER):])
+    with open(report_file.name) as run_report_file:
+        run_report = json.load(run_report_file)
+    os.remove(report_file.name)
+    measures.update({"target": target,
+                     "entries": entries,
+                     "entries_per_second": round(entries / measures["wall_seconds"], 1),
+                     "requests": sum(endpoint["requests"] for endpoint in run_report["endpoints"]),
+                     "sleep_seconds": run_report["sleep_seconds"],
+                     "retries": run_report["retries"],
+                     "float_logged_time": server_stats["float_logged_time"],
+                     "entries_sheet_rows": server_stats["entries_sheet_rows"],
+                     "fake_api_requests": {service: server_stats[service] for service in ("harvest", "float",
+                                                                                         "sheets")}})
+    return measures
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline end to end against local fake Harvest, '
+                                                 'Float and Sheets APIs')
+    parser.add_argument('--sizes', default='1000,10000', help='comma separated account sizes, in time entries')
+    parser.add_argument('--targets', default=','.join(TARGETS), help='cloud_function, main_local or both')
+    parser.add_argument('--days', type=int, default=365, help='days the time entries are spread over')
+    parser.add_argument('--existing-ratio', type=float, default=0.1,
+                        help='share of the entries already on the entries sheet')
+    parser.add_argument('--latency-ms', type=float, default=0, help='latency added to every fake API response')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='random extra latency, up to this value')
+    parser.add_argument('--harvest-rate-limit', type=int, default=None,
+                        help='Harvest requests per 15 seconds, 100 on production, unlimited by default')
+    parser.add_argument('--float-rate-limit', type=int, default=100000,
+                        help='Float requests per minute, 200 on production')
+    parser.add_argument('--sheets-rate-limit', type=int, default=None,
+                        help='Sheets requests per minute, 300 per project on production, unlimited by default')
+    parser.add_argument('--sheets-429-ratio', type=float, default=0, help='share of Sheets requests answered 429')
+    parser.add_argument('--stream', action='store_true', help='run cloud_function with STREAM_ENTRIES=true')
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help='skip peak memory tracing, which slows down the run')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--child', choices=TARGETS, help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    if options.child:
+        print(RESULT_MARKER + json.dumps(run_target(options.child)))
+        return
+    results = []
+    for entries in [int(size) for size in options.sizes.split(',')]:
+        for target in options.targets.split(','):
+            result = benchmark(options, entries, target)
+            print(f'{target} {entries} entries: {result["wall_seconds"]}s wall, '
+                  f'{result["entries_per_second"]} entries/s, peak {result["peak_traced_mb"]} MB traced, '
+                  f'{result["max_rss_mb"]} MB RSS, {result["requests"]} requests')
+            results.append(result)
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
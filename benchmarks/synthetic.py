@@ -0,0 +1,220 @@
+from datetime import date, timedelta
+import unicodedata
+
+
+ROLES = {"Analyst": 0.9, "Consultant": 0.85, "Senior Consultant": 0.8, "Manager": 0.6, "Director": 0.4}
+TASKS = ["Development", "Design", "Meetings", "Project Management", "QA", "Research", "Support", "Training"]
+FIRST_NAMES = ["Ana", "Bruno", "Carla", "Diego", "Elena", "Fabián", "Gloria", "Hugo", "Inés", "Javier", "Karen",
+               "Lucía", "Martín", "Nuria", "Óscar", "Paula", "Ramón", "Sofía", "Tomás", "Valeria"]
+LAST_NAMES = ["Álvarez", "Blanco", "Castro", "Díaz", "Estévez", "Fernández", "García", "Herrera", "Iglesias",
+              "Jiménez", "López", "Muñoz", "Navarro", "Ortega", "Pérez", "Ramírez", "Sánchez", "Torres"]
+ENTRY_ID_OFFSET = 1000000000
+
+
+class SyntheticAccount:
+    """
+    A class to generate a deterministic Harvest / Float / Sheets account of a given size, time entries being
+    built on demand by index so a 1M entries account doesn't have to be held in memory
+    """
+
+    def __init__(self, entries=1000, days=365, existing_ratio=0.1, today=None):
+        self.entries = entries
+        self.days = days
+        self.existing_ratio = existing_ratio
+        self.today = today or date.today()
+        self.people_count = max(5, min(100, entries // 200))
+        self.projects_count = max(5, min(2000, entries // 500))
+        self.clients_count = max(3, self.projects_count // 5)
+        self.people = [self.build_person(index) for index in range(self.people_count)]
+        self.clients = [{"id": 100 + index, "name": f"Client {index:04d}", "is_active": True}
+                        for index in range(self.clients_count)]
+        self.projects = [self.build_project(index) for index in range(self.projects_count)]
+        self.tasks = [{"id": 500 + index, "name": name, "billable_by_default": index % 3 != 2}
+                      for index, name in enumerate(TASKS)]
+
+    def build_person(self, index):
+        first_name = FIRST_NAMES[index % len(FIRST_NAMES)]
+        last_name = LAST_NAMES[(index // len(FIRST_NAMES)) % len(LAST_NAMES)]
+        if index >= len(FIRST_NAMES) * len(LAST_NAMES):
+            last_name = f'{last_name} {index}'
+        roles = list(ROLES)
+        return {"id": 2000 + index,
+                "first_name": first_name,
+                "last_name": last_name,
+                "name": f'{first_name} {last_name}',
+                "role": roles[index % len(roles)],
+                "timezone": "America/New_York" if index % 2 else "Europe/Madrid",
+                "default_hourly_rate": float(80 + index % 7 * 10),
+                "cost_rate": float(40 + index % 5 * 5),
+                "is_active": index % 17 != 16}
+
+    def build_project(self, index):
+        return {"id": 30000 + index,
+                "name": f"Project {index:05d}",
+                "code": f"PRJ-{index:05d}",
+                "client": f"Client {index % self.clients_count:04d}",
+                "client_id": 100 + index % self.clients_count,
+                "is_active": index % 9 != 8,
+                "is_billable": index % 4 != 3,
+                "budget": float(10000 + index * 250)}
+
+    def entry_id(self, index):
+        return ENTRY_ID_OFFSET + self.entries - index
+
+    def entry_date(self, index):
+        """
+        Spent date of an entry, entries being sorted by spent date descending as Harvest returns them
+        """
+        return (self.today - timedelta(days=index * self.days // self.entries)).strftime('%Y-%m-%d')
+
+    def time_entry(self, index):
+        """
+        Build a Harvest v2 time entry
+        :param index: 0 is the most recent entry
+        :return: time entry dict
+        """
+        person = self.people[index % self.people_count]
+        project = self.projects[index * 7 % self.projects_count]
+        task = self.tasks[index % len(self.tasks)]
+        spent_date = self.entry_date(index)
+        return {"id": self.entry_id(index),
+                "spent_date": spent_date,
+                "hours": (index % 32 + 1) * 0.25,
+                "billable": project["is_billable"] and task["billable_by_default"],
+                "is_locked": index % 5 == 0,
+                "cost_rate": person["cost_rate"],
+                "notes": None,
+                "created_at": f'{spent_date}T18:00:00Z',
+                "updated_at": f'{spent_date}T18:00:00Z',
+                "user": {"id": person["id"], "name": person["name"]},
+                "client": {"id": project["client_id"], "name": project["client"]},
+                "project": {"id": project["id"], "name": project["name"], "code": project["code"]},
+                "task": {"id": task["id"], "name": task["name"]},
+                "user_assignment": {"id": 70000 + index % 1000, "hourly_rate": person["default_hourly_rate"]}}
+
+    def entry_range(self, from_date=None, to_date=None):
+        """
+        Index range of the entries spent within a period, as Harvest from / to parameters filter them
+        :return: (start, stop) indexes, entries being sorted by spent date descending
+        """
+        start = self.first_index(lambda index: not to_date or self.entry_date(index) <= to_date)
+        stop = self.first_index(lambda index: from_date and self.entry_date(index) < from_date)
+        return start, max(start, stop)
+
+    def first_index(self, condition):
+        """
+        Binary search the first entry index meeting a condition that holds for every later index
+        """
+        low, high = 0, self.entries
+        while low < high:
+            middle = (low + high) // 2
+            if condition(middle):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def entry_row(self, index):
+        """
+        Entries sheet row of a time entry, as HarvestAnalytics builds it
+        """
+        entry = self.time_entry(index)
+        person = self.people[index % self.people_count]
+        geography = 'USA' if 'US' in person["timezone"].upper() else 'SPAIN'
+        return [entry["id"], entry["spent_date"], person["name"], person["role"], geography, entry["client"]["name"],
+                entry["project"]["name"], entry["project"]["code"], entry["task"]["name"],
+                str(entry["billable"]).upper(), str(entry["is_locked"]).upper(), entry["hours"],
+                ROLES[person["role"]], entry["cost_rate"], entry["user_assignment"]["hourly_rate"]]
+
+    def harvest_users(self):
+        return [{"id": person["id"],
+                 "first_name": person["first_name"],
+                 "last_name": person["last_name"],
+                 "roles": [person["role"]],
+                 "timezone": person["timezone"],
+                 "default_hourly_rate": person["default_hourly_rate"],
+                 "cost_rate": person["cost_rate"],
+                 "is_active": person["is_active"]} for person in self.people]
+
+    def harvest_projects(self):
+        created_at = (self.today - timedelta(days=self.days)).strftime('%Y-%m-%dT00:00:00Z')
+        return [{"id": project["id"],
+                 "name": project["name"],
+                 "code": project["code"],
+                 "is_active": project["is_active"],
+                 "is_billable": project["is_billable"],
+                 "client": {"id": project["client_id"], "name": project["client"]},
+                 "notes": "",
+                 "starts_on": created_at[:10],
+                 "ends_on": None,
+                 "created_at": created_at,
+                 "updated_at": created_at} for project in self.projects]
+
+    def harvest_budgets(self):
+        return [{"project_id": project["id"],
+                 "project_name": project["name"],
+                 "client_name": project["client"],
+                 "budget": project["budget"],
+                 "budget_spent": project["budget"] / 2,
+                 "budget_remaining": project["budget"] / 2} for project in self.projects]
+
+    def harvest_clients(self):
+        return list(self.clients)
+
+    def harvest_tasks(self):
+        return list(self.tasks)
+
+    def float_people(self):
+        """
+        Float people mirroring Harvest users with ASCII names, every 10th one with a stale rate for sync_people
+        """
+        return [{"people_id": 9000 + index,
+                 "name": self.ascii_name(person["name"]),
+                 "job_title": person["role"],
+                 "default_hourly_rate": str(person["default_hourly_rate"] + (5 if index % 10 == 0 else 0)),
+                 "active": 1 if person["is_active"] else 0} for index, person in enumerate(self.people)]
+
+    @staticmethod
+    def ascii_name(name):
+        return unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+
+    def float_clients(self):
+        return [{"client_id": 800 + index, "name": client["name"]} for index, client in enumerate(self.clients)]
+
+    def float_projects(self):
+        """
+        Float projects mirroring Harvest projects, every 7th one inactive for sync_projects to patch
+        """
+        return [{"project_id": 60000 + index,
+                 "name": project["name"],
+                 "client_id": 800 + project["client_id"] - 100,
+                 "tags": [project["code"]],
+                 "budget_total": project["budget"],
+                 "non_billable": 0 if project["is_billable"] else 1,
+                 "active": 0 if index % 7 == 0 else int(project["is_active"])} for index, project in
+                enumerate(self.projects)]
+
+    def existing_rows(self):
+        """
+        Entries sheet rows already synced, the oldest existing_ratio of the account
+        """
+        first_existing = self.entries - int(self.entries * self.existing_ratio)
+        return [self.entry_row(index) for index in range(self.entries - 1, first_existing - 1, -1)]
+
+    def sheets(self, entries_sheet, logs_sheet, roles_sheet, weekly_tasks_sheet, projects_sheet, test_sheet=None):
+        """
+        Initial spreadsheet values by sheet name
+        """
+        entries_header = ['id', 'date', 'staff_member', 'role', 'geography', 'client', 'project', 'project_code',
+                          'task', 'billable', 'locked', 'hours', 'target_utilization', 'cost_rate', 'hourly_rate']
+        sheets = {
+            entries_sheet: [entries_header] + self.existing_rows(),
+            logs_sheet: [['timestamp', 'event', 'message', 'fields']],
+            roles_sheet: [['role', 'target_utilization']] + [[role, target] for role, target in ROLES.items()],
+            weekly_tasks_sheet: [['user', 'project', 'code', 'task', 'date', 'hours']],
+            projects_sheet: [['id', 'name', 'code', 'is_active', 'is_billable', 'client', 'notes', 'start_date',
+                              'end_date', 'creation_date', 'update_date', 'budget', 'spent', 'remaining']]
+        }
+        if test_sheet:
+            sheets.setdefault(test_sheet, [entries_header])
+        return sheets
@@ -1,736 +1,192 @@
-import httplib2
-from googleapiclient.discovery import build
-from oauth2client.service_account import ServiceAccountCredentials
 import logging
-import requests
-import urllib3
-from datetime import datetime, timedelta, date
-import os
-import unidecode
-from time import sleep
+from datetime import datetime, timedelta
+from pipeline.config import load_config
+from pipeline.stage_graph import StageGraph
+from pipeline.streaming import RowStream
+from pipeline.run_metrics import start_run
+from pipeline.profiling import write_profiles, profiling_enabled
+from pipeline.warm_cache import get_warm_cache
 
 
-logging.info('Loading ENV vars')
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-SPREADSHEET_ID = os.environ["SPREADSHEET_ID"]
-CREDENTIALS_FILE = os.environ["CREDENTIALS_FILE"]
-ENTRIES_SHEET = os.environ["ENTRIES_SHEET"]
-LOGS_SHEET = os.environ["LOGS_SHEET"]
-ROLES_SHEET = os.environ["ROLES_SHEET"]
-WEEKLY_TASKS_SHEET = os.environ["WEEKLY_TASKS_SHEET"]
-PROJECTS_SHEET = os.environ["PROJECTS_SHEET"]
-HARVEST_TOKEN = os.environ["HARVEST_TOKEN"]
-HARVEST_ACCOUNT_ID = os.environ["HARVEST_ACCOUNT_ID"]
-PAST_ENTRIES_LOOKUP = int(os.environ["PAST_ENTRIES_LOOKUP"])
-FLOAT_TOKEN = os.environ["FLOAT_TOKEN"]
-
-
-class HarvestAnalytics:
-    """
-    A class to process and structure Harvest data
-    """
-    def __init__(self, entries_lookup, harvest_account, harvest_token, weekly_entries, eligible_roles):
-        self.past_entries_lookup = entries_lookup
-        self.harvest_api = 'https://api.harvestapp.com/v2/'
-        self.harvest_account = harvest_account
-        self.harvest_token = harvest_token
-        self.weekly_entries = weekly_entries
-        self.harvest_eligible_roles = eligible_roles
-        self.harvest_tasks = self.get_tasks()
-        self.harvest_projects = self.get_projects()
-        self.harvest_users = self.get_users_data()
-
-    def get_historical_data(self):
-        """
-        :return:
-        """
-        print('Getting Historical time entries from Harvest')
-        url_time_entries = self.harvest_api + 'time_entries'
-        headers = {
-            "User-Agent": "Python Harvest API Sample",
-            "Authorization": "Bearer {}".format(self.harvest_token),
-            "Harvest-Account-ID": self.harvest_account
-        }
-        try:
-            total_pages = requests.get(url_time_entries, verify=False, headers=headers).json()['total_pages']
-            users_full_data = self.get_row_list(url_time_entries, headers, total_pages)
-            print('Harvest Data was retrieved successfully')
-            return users_full_data
-        except Exception as e:
-            logging.fatal(f'Failed while getting data from Harvest. Error was: {e}')
-            print(f'Error while getting data from Harvest. Error was: {e}')
-
-    def get_users_data(self):
-        """
-        Get Harvest user roles
-        :return: users data dict of dict
-        """
-        url_users = self.harvest_api + 'users'
-        headers = {
-            "User-Agent": "Python Harvest API Sample",
-            "Authorization": "Bearer {}".format(self.harvest_token),
-            "Harvest-Account-ID": self.harvest_account
-        }
-        try:
-            users_data = {}
-            print('Getting Harvest Users data')
-            harvest_users_data = requests.get(url_users, verify=False, headers=headers).json()
-            for user in harvest_users_data['users']:
-                full_name = user['first_name'] + " " + user['last_name']
-                role = user['roles'][0] if user['roles'] else None
-                timezone = user['timezone']
-                if 'US' in timezone.upper():
-                    timezone = 'USA'
-                elif 'MADRID' in timezone.upper():
-                    timezone = 'SPAIN'
-                else:
-                    timezone = None
-                user_id = user['id']
-                hourly_rate = user['default_hourly_rate']
-                active = user['is_active']
-                user_info = {'role': role, 'geography': timezone, 'id': user_id, 'default_hourly_rate': hourly_rate,
-                             'active': active}
-                users_data.update({full_name: user_info})
-            return users_data
-        except Exception as e:
-            print(f'Error while getting users roles. Error was {e}')
-
-    def get_row_list(self, url, headers, total_pages):
-        """
-        Get rows list of lists, each list representing a new row
-        :param url:
-        :param headers:
-        :param total_pages:
-        :return:
-        """
-        available_roles = self.harvest_eligible_roles.keys()
-        users_entries = []
-        start_date = (datetime.today() - timedelta(days=self.past_entries_lookup)).strftime('%Y-%m-%d')
-        execution_date = datetime.today().strftime('%Y-%m-%d')
-        # start_date = '2019-01-01'
-        try:
-            for page in range(1, total_pages + 1):
-                print(f'Getting Harvest entries from page #{page}')
-                page_entries = requests.get(url, verify=False, params={'page': page}, headers=headers).json()
-                for entry in page_entries['time_entries']:
-                    entry_date = entry['spent_date']
-                    full_name = entry['user']['name']
-                    role = self.harvest_users[full_name]['role']
-                    if role in available_roles and start_date <= entry_date <= execution_date:
-                        entry_id = entry['id']
-                        date = entry_date
-                        staff_member = full_name
-                        geography = self.harvest_users[full_name]['geography']
-                        client = entry['client']['name']
-                        project = entry['project']['name']
-                        project_code = entry['project']['code']
-                        task = entry['task']['name']
-                        billable = str(entry['billable']).upper()
-                        locked = str(entry['is_locked']).upper()
-                        hours = entry['hours']
-                        target_utilization = self.harvest_eligible_roles[role]
-                        cost_rate = entry['cost_rate']
-                        hourly_rate = entry['user_assignment']['hourly_rate']
-                        row = [entry_id, date, staff_member, role, geography, client, project, project_code, task,
-                               billable, locked, hours, target_utilization, cost_rate, hourly_rate]
-                        users_entries.append(row)
-                    elif entry_date >= start_date:
-                        pass
-                    else:
-                        return users_entries
-            return users_entries
-        except Exception as e:
-            print(f'Error while getting page Data. Error was {e}')
-
-    def get_projects(self):
-        """
-        Get Harvest projects
-        :return: projects list of dicts
-        """
-        url_projects = self.harvest_api + 'projects'
-        headers = {
-            "User-Agent": "Python Harvest API Sample",
-            "Authorization": "Bearer {}".format(self.harvest_token),
-            "Harvest-Account-ID": self.harvest_account
-        }
-        try:
-            print('Getting Harvest Projects')
-            budgets = self.get_budgets()
-            projects_hashmap = {}
-            none_budget = {
-                "budget": 0,
-                "spent": 0,
-                "remaining": 0
-            }
-            total_pages = requests.get(url_projects, verify=False, headers=headers, ).json()['total_pages']
-            for page in range(1, total_pages + 1):
-                projects = requests.get(url_projects, verify=False, headers=headers, params={'page': page}).json()
-                for project in projects["projects"]:
-                    project_id = project["id"]
-                    project_data = {
-                        "name": project["name"],
-                        "code": project["code"],
-                        "is_active": project["is_active"],
-                        "is_billable": project["is_billable"],
-                        "client": project["client"]["name"],
-                        "notes": project["notes"],
-                        "start_date": project["starts_on"],
-                        "end_date": project["ends_on"],
-                        "creation_date": project["created_at"][:10],
-                        "update_date": project["updated_at"][:10]
-                    }
-                    projects_hashmap[project_id] = project_data
-                    if project_id in budgets:
-                        projects_hashmap[project_id].update(budgets[project_id])
-                    else:
-                        projects_hashmap[project_id].update(none_budget)
-            return projects_hashmap
-        except Exception as e:
-            print(f'Error while getting projects. Error was {e}')
-
-    def get_project_rows(self):
-        rows = [[project_id] + list(project_values.values()) for project_id, project_values
-                in self.harvest_projects.items()]
-        return rows
-
-    def get_budgets(self):
-        """
-        Get Harvest Project Budgets
-        :return: tasks list of dicts
-        """
-        url_budget = self.harvest_api + 'reports/project_budget'
-        headers = {
-            "User-Agent": "Python Harvest API Sample",
-            "Authorization": "Bearer {}".format(self.harvest_token),
-            "Harvest-Account-ID": self.harvest_account
-        }
-        try:
-            print('Getting Harvest Budgets')
-            budget_hashmap = {}
-            total_pages = requests.get(url_budget, verify=False, headers=headers).json()['total_pages']
-            for page in range(1, total_pages + 1):
-                projects = requests.get(url_budget, verify=False, headers=headers, params={'page': page}).json()
-                for project in projects["results"]:
-                    name = project["project_name"].upper()
-                    project_id = project["project_id"]
-                    budget = project["budget"]
-                    spent = project["budget_spent"]
-                    remaining = project["budget_remaining"]
-                    budget_hashmap.update({project_id: {"name": name, "budget": budget, "spent": spent,
-                                                        "remaining": remaining}})
-            return budget_hashmap
-        except Exception as e:
-            print(f'Error while getting tasks. Error was {e}')
-
-    def get_tasks(self):
-        """
-        Get Harvest tasks
-        :return: tasks list of dicts
-        """
-        url_tasks = self.harvest_api + 'tasks'
-        headers = {
-            "User-Agent": "Python Harvest API Sample",
-            "Authorization": "Bearer {}".format(self.harvest_token),
-            "Harvest-Account-ID": self.harvest_account
-        }
-        try:
-            print('Getting Harvest Tasks')
-            tasks_hashmap = {}
-            total_pages = requests.get(url_tasks, verify=False, headers=headers).json()['total_pages']
-            for page in range(1, total_pages + 1):
-                tasks = requests.get(url_tasks, verify=False, headers=headers, params={'page': page}).json()
-                for task in tasks["tasks"]:
-                    name = task["name"].upper()
-                    task_id = task["id"]
-                    tasks_hashmap.update({name: task_id})
-            return tasks_hashmap
-        except Exception as e:
-            print(f'Error while getting tasks. Error was {e}')
-
-    def create_time_entry(self, user_id, project_id, task_id, spent_date, hours):
-        """
-        Create a time entry on Harvest
-        :param user_id:
-        :param project_id:
-        :param task_id:
-        :param spent_date:
-        :param hours:
-        :return: entry_id
-        """
-        url_time_entries = self.harvest_api + 'time_entries'
-        headers = {
-            "User-Agent": "Python Harvest API Sample",
-            "Authorization": "Bearer {}".format(self.harvest_token),
-            "Harvest-Account-ID": self.harvest_account
-        }
-        body = {
-            "user_id": user_id,
-            "project_id": project_id,
-            "task_id": task_id,
-            "spent_date": spent_date,
-            "hours": hours
-        }
-        try:
-            response = requests.post(url_time_entries, verify=False, data=body, headers=headers).json()
-            # entry_id = response["id"]
-            print(f'Entry created, response was: {response}')
-            return response
-        except Exception as e:
-            print(f'Error while creating time-entry. Error was {e}')
-
-    def get_project_id(self, name, code):
-        """
-        Get project id for a given project name and code
-        """
-        for project_id, project_data in self.harvest_projects.items():
-            if project_data["name"].upper() == name.upper() and project_data["code"].upper() == code.upper():
-                return project_id
-        return
-
-    def create_weekly_entries(self):
-        print('Creating weekly Harvest time-entries')
-        for entry in self.weekly_entries:
-            user_id = self.harvest_users[entry["user"]]["id"]
-            project_id = self.get_project_id(entry["project"], entry["code"])
-            task_id = self.harvest_tasks[entry["task"].upper()]
-            hours = entry["hours"]
-            spent_date = self.to_spent_date(entry["date"].upper())
-            self.create_time_entry(user_id, project_id, task_id, spent_date, hours)
-
-    @staticmethod
-    def to_spent_date(week_day):
-        iso_week_days = {
-            "MONDAY": 1,
-            "TUESDAY": 2,
-            "WEDNESDAY": 3,
-            "THURSDAY": 4,
-            "FRIDAY": 5,
-            "SATURDAY": 6,
-            "SUNDAY": 7
-        }
-        offset = datetime.today().isoweekday() - iso_week_days[week_day]
-        spent_date = (datetime.today() - timedelta(days=offset) + timedelta(days=7)).strftime('%Y-%m-%d')
-        return spent_date
-
-
-class FloatAnalytics:
+def build_stage_graph(google_runner, run_log, config):
     """
-    A class to process and structure Float data
+    Build the Cloud Function run as a stage graph, each stage receiving its dependencies results by name
+    :param config: PipelineConfig, with stream_entries the new Harvest rows are posted to Float while Harvest
+    pages are still being fetched
+    :return: StageGraph
     """
-    def __init__(self, float_token, users=None, projects=None, clients=None, tasks=None):
-        self.float_token = float_token
-        self.float_api = 'https://api.float.com/v3'
-        self.float_clients = self.get_clients()
-        self.float_projects = self.get_projects()
-        self.float_users = self.get_people()
-        self.harvest_users = {unidecode.unidecode(user): data for user, data in users.items()}
-        self.harvest_projects = projects
-        self.harvest_clients = clients
-        self.harvest_tasks = tasks
-
-    def get_clients(self):
-        """
-        Get Float clients
-        :return: clients list of dicts
-        """
-        clients_url = f"{self.float_api}/clients"
-        headers = {
-            "User-Agent": "Python Float App",
-            "Authorization": f"Bearer {self.float_token}"
-        }
-        try:
-            print('Getting Float Clients')
-            clients_hashmap = {}
-            total_pages = requests.get(clients_url, verify=False, headers=headers).headers['X-Pagination-Page-Count']
-            for page in range(1, int(total_pages) + 1):
-                clients = requests.get(clients_url, verify=False, headers=headers, params={'page': page}).json()
-                for client in clients:
-                    name = client["name"]
-                    client_id = client["client_id"]
-                    clients_hashmap.update({name: {"id": client_id}})
-            return clients_hashmap
-        except Exception as e:
-            print(f'Error while getting clients. Error was {e}')
-
-    def get_projects(self):
-        """
-        Get Float projects
-        :return: projects list of dicts, by id given there aren't unique names on some cases
-        """
-        projects_url = f"{self.float_api}/projects"
-        headers = {
-            "User-Agent": "Python Float App",
-            "Authorization": f"Bearer {self.float_token}"
-        }
-        try:
-            print('Getting Float Projects')
-            projects_hashmap = {}
-            total_pages = requests.get(projects_url, verify=False, headers=headers).headers['X-Pagination-Page-Count']
-            for page in range(1, int(total_pages) + 1):
-                projects = requests.get(projects_url, verify=False, headers=headers, params={'page': page}).json()
-                for project in projects:
-                    name = project["name"].upper()
-                    project_id = project["project_id"]
-                    budget = project["budget_total"]
-                    client = project["client_id"]
-                    code = project["tags"][0] if project["tags"] else ""
-                    is_active = project["active"]
-                    is_billable = project["non_billable"]
-                    projects_hashmap.update({project_id: {"name": name, "budget": budget, "client": client,
-                                            "code": code, "is_active": is_active, "is_billable": is_billable}})
-            return projects_hashmap
-        except Exception as e:
-            print(f'Error while getting projects. Error was {e}')
-
-    def get_people(self):
-        """
-        Get Float Users
-        :return: users list of dicts
-        """
-        projects_url = f"{self.float_api}/people"
-        headers = {
-            "User-Agent": "Python Float App",
-            "Authorization": f"Bearer {self.float_token}"
-        }
-        try:
-            print('Getting Float Users')
-            user_hashmap = {}
-            total_pages = requests.get(projects_url, verify=False, headers=headers).headers['X-Pagination-Page-Count']
-            for page in range(1, int(total_pages) + 1):
-                users = requests.get(projects_url, verify=False, headers=headers, params={'page': page}).json()
-                for user in users:
-                    name = user["name"]
-                    people_id = user["people_id"]
-                    role = user["job_title"]
-                    hourly_rate = user["default_hourly_rate"]
-                    active = True if user["active"] == 1 else False
-                    user_hashmap.update({name: {"id": people_id, "role": role, "default_hourly_rate": hourly_rate,
-                                                "active": active}})
-            return user_hashmap
-        except Exception as e:
-            print(f'Error while getting users. Error was {e}')
-
-    def create_tasks_from_ghseet(self, gsheet_data, scheduled=False):
-        """
-        Create Float task
-        :return: none
-        """
-        task_type = 'tasks' if scheduled else 'logged-time'
-        tasks_url = f"{self.float_api}/{task_type}"
-        headers = {
-            "User-Agent": "Python Float App",
-            "Authorization": f"Bearer {self.float_token}"
-        }
-        try:
-            print(f'Creating Float {task_type} Tasks')
-            count = 0
-            for row in gsheet_data:
-                body = {
-                    "project_id": self.get_project_id(row[6].upper(), row[7]),
-                    "people_id": self.float_users[unidecode.unidecode(row[2])]['id'],
-                    "hours": round(float(row[11]) * 4) / 4 if float(row[11]) >= 0.25 else 0.25,
-                    "date": row[1],
-                    "billable": 1 if row[9].strip().upper() == 'TRUE' else 0,
-                    "task_name": row[8]
-                }
-                response = requests.post(tasks_url, verify=False, headers=headers, data=body)
-                count += 1
-                print(count, response.status_code, response.json())
-                if 'X-RateLimit-Remaining-Minute' in response.headers:
-                    rate_limit_remaining = response.headers['X-RateLimit-Remaining-Minute']
-                    if int(rate_limit_remaining) <= 15:
-                        print("Cooling down 30 secs")
-                        sleep(30)
-                else:
-                    sleep(0.4)  # 400ms pause to avoid API Throttle
-            print(f" {count} {task_type} Tasks were successfully created")
-        except Exception as e:
-            print(f'Error while creating tasks. Error was {e}')
-
-    def get_project_id(self, name, code):
-        """
-        Get Float project id, based on project name and code
-        """
-        for project_id, project_data in self.float_projects.items():
-            if code and project_data["code"]:
-                if project_data["name"].upper() == name.upper() and project_data["code"].upper() == code.upper():
-                    return project_id
-            elif project_data["name"].upper() == name.upper():
-                return project_id
-
-    def get_harvest_project_data(self, name, code):
-        """
-        Get project data for a given project name and code
-        """
-        for project_id, project_data in self.harvest_projects.items():
-            data = {"client": project_data["client"],
-                    "is_billable": project_data["is_billable"],
-                    "is_active": project_data["is_active"],
-                    "id": project_id,
-                    "name": project_data["name"]}
-            if project_data["name"].upper() == name.upper() and project_data["code"].upper() == code.upper():
-                return data
-        return
+    cache = get_warm_cache()
+    # Harvest rows handed from the harvest_stream stage to the stream_tasks one, unbounded when the graph runs a
+    # stage at a time while profiling, the producer then finishing before the consumer starts
+    stream = RowStream(maxsize=0 if profiling_enabled() else config.stream_queue_size)
+
+    def harvest_runner():
+        from harvest.harvest_wrapper import HarvestAnalytics
+        return cache.get('harvest_runner', lambda: HarvestAnalytics(config.past_entries_lookup,
+                                                                     config.harvest_account_id, config.harvest_token))
+
+    def float_runner():
+        from float.float_wrapper import FloatAnalytics
+        from identity.identity_map import IdentityMap
+        identity = cache.get('identity_map', lambda: IdentityMap(config.identity_map_path,
+                                                                      config.fuzzy_threshold))
+        return cache.get('float_runner', lambda: FloatAnalytics(config.float_token, identity=identity))
+
+    def harvest_entries(harvest_runner, weekly_entries, eligible_roles):
+        harvest_runner.weekly_entries = weekly_entries
+        harvest_runner.harvest_eligible_roles = eligible_roles
+        return harvest_runner.get_historical_data()
+
+    def new_rows(harvest_entries):
+        return google_runner.get_missing_rows(harvest_entries, config.past_entries_lookup)
+
+    def append_entries(new_rows):
+        updated_cells = google_runner.gsheet_append(config.entries_sheet, new_rows)
+        google_runner.log_update(updated_cells, config.entries_sheet)
+
+    def update_projects(harvest_runner):
+        updated_cells = google_runner.update_projects(harvest_runner.get_project_rows())
+        google_runner.log_update(updated_cells, config.projects_sheet, "projects")
+
+    def float_linked(float_runner, harvest_runner):
+        float_runner.set_harvest_data(users=harvest_runner.harvest_users, projects=harvest_runner.harvest_projects)
+        return float_runner
+
+    def sync_people(float_linked):
+        return float_linked.sync_people()
+
+    def sync_projects(float_linked):
+        return float_linked.sync_projects()
+
+    def float_logged_time(float_runner):
+        start_date = (datetime.today() - timedelta(days=config.past_entries_lookup)).strftime('%Y-%m-%d')
+        return float_runner.get_logged_time_index(start_date, datetime.today().strftime('%Y-%m-%d'))
+
+    def create_tasks(float_linked, new_rows, float_logged_time, sync_people, sync_projects):
+        return float_linked.create_tasks_from_ghseet(new_rows, existing=float_logged_time,
+                                                     aggregate=config.aggregate_tasks)
+
+    def existing_entry_ids():
+        return google_runner.get_entry_ids(config.past_entries_lookup)
+
+    def harvest_stream(harvest_runner, weekly_entries, eligible_roles, existing_entry_ids):
+        harvest_runner.weekly_entries = weekly_entries
+        harvest_runner.harvest_eligible_roles = eligible_roles
+        new_rows = []
+        try:
+            for page_rows in harvest_runner.iter_historical_pages():
+                for row in page_rows:
+                    if row[0] not in existing_entry_ids:
+                        new_rows.append(row)
+                        stream.put(row)
+        finally:
+            stream.close()
+        return new_rows
 
-    def sync_projects(self):
-        """
-        Sync Float projects from Harvest's projects
-        :return: none
-        """
-        try:
-            print('Syncing Float Projects')
-            for id, project_data in self.float_projects.items():
-                harvest_data = self.get_harvest_project_data(project_data["name"], project_data["code"])
-                if harvest_data:
-                    is_billable = 0 if harvest_data["is_billable"] else 1
-                    is_active = 1 if harvest_data["is_active"] else 0
-                    client = harvest_data["client"]
-                    body = {}
-                    if project_data["client"] != self.float_clients[client]["id"]:
-                        body["client_id"] = self.float_clients[client]["id"]
-                    if project_data["is_billable"] != is_billable:
-                        body["non_billable"] = is_billable
-                    if project_data["is_active"] != is_active:
-                        body["active"] = is_active
-                    if body:
-                        self.update_data('projects', id, body)
-                else:
-                    print('Float project data not found in Harvest', id, project_data)
-        except Exception as e:
-            print(f'Error while syncing projects. Error was {e}')
+    def stream_tasks(float_linked, float_logged_time, sync_people, sync_projects):
+        try:
+            return float_linked.create_tasks_from_ghseet(stream, existing=float_logged_time,
+                                                         aggregate=config.aggregate_tasks)
+        finally:
+            stream.stop()
+
+    graph = StageGraph(run_log=run_log)
+    graph.add('weekly_entries', google_runner.get_weekly_entries)
+    graph.add('eligible_roles', google_runner.get_eligible_roles)
+    graph.add('harvest_runner', harvest_runner)
+    graph.add('float_runner', float_runner)
+    graph.add('append_entries', append_entries, deps=('new_rows',))
+    graph.add('update_projects', update_projects, deps=('harvest_runner',))
+    graph.add('float_linked', float_linked, deps=('float_runner', 'harvest_runner'))
+    graph.add('sync_people', sync_people, deps=('float_linked',))
+    graph.add('sync_projects', sync_projects, deps=('float_linked',))
+    graph.add('float_logged_time', float_logged_time, deps=('float_runner',))
+    if config.stream_entries:
+        graph.add('existing_entry_ids', existing_entry_ids)
+        # Harvest pages are fetched while Float syncs, the rows waiting on the stream until the people and
+        # projects they refer to are created or reactivated on Float
+        graph.add('new_rows', harvest_stream, deps=('harvest_runner', 'weekly_entries', 'eligible_roles',
+                                                    'existing_entry_ids'))
+        graph.add('create_tasks', stream_tasks, deps=('float_linked', 'float_logged_time', 'sync_people',
+                                                      'sync_projects'))
+        graph.on_failure.append(stream.stop)
+    else:
+        graph.add('harvest_entries', harvest_entries, deps=('harvest_runner', 'weekly_entries', 'eligible_roles'))
+        graph.add('new_rows', new_rows, deps=('harvest_entries',))
+        graph.add('create_tasks', create_tasks, deps=('float_linked', 'new_rows', 'float_logged_time',
+                                                      'sync_people', 'sync_projects'))
+    return graph
 
-    def sync_people(self):
-        """
-        Sync Float Users from Harvest
-        :return: none
-        """
-        try:
-            print('Syncing Float Users')
-            for user, user_data in self.float_users.items():
-                if user not in self.harvest_users.keys():
-                    continue
-                float_rate = float(user_data["default_hourly_rate"]) if user_data["default_hourly_rate"] else float(0)
-                float_role = user_data["role"] if user_data["role"] else ""
-                float_status = user_data["active"]
-                if self.harvest_users[user]["default_hourly_rate"]:
-                    harvest_rate = self.harvest_users[user]["default_hourly_rate"]
-                else:
-                    harvest_rate = float(0)
-                harvest_role = self.harvest_users[user]["role"]
-                harvest_status = self.harvest_users[user]["active"]
-                body = {}
-                if float_rate != harvest_rate:
-                    body["default_hourly_rate"] = harvest_rate
-                if float_role != harvest_role:
-                    body["job_title"] = harvest_role
-                if float_status != harvest_status:
-                    body["active"] = harvest_status
-                if body:
-                    # print(user, rate, self.harvest_users[user])
-                    self.update_data('people', user_data["id"], body)
-        except Exception as e:
-            print(f'Error while syncing Users. Error was {e}')
 
-    def update_data(self, endpoint, id, body):
-        """
-        Update via PATCH method a Float field on specified endpoint
-        """
-        url = f"{self.float_api}/{endpoint}/{id}"
-        headers = {
-            "User-Agent": "Python Float App",
-            "Authorization": f"Bearer {self.float_token}"
-        }
-        try:
-            response = requests.patch(url, verify=False, headers=headers, data=body).json()
-            print(f'Updated {endpoint}/{id}. Input: {body}. Response: {response}')
-        except Exception as e:
-            print(f'Error while updating {endpoint}/{id}: {e}')
+def runner(event, context):
+    logging.info(f'Starting Cloud function Runner. {event}: {context}')
+    config = load_config()
+    metrics = start_run()
+    cache = get_warm_cache()
+    cache.ttl = config.warm_cache_ttl
+    cache.reset_stats()
+    keys = invalidate_keys(event)
+    invalidated = cache.invalidate(*keys) if keys is not None else []
+    # heavy dependencies are imported on first use, once the config is known to be valid
+    import urllib3
+    from gsheet.gsheet_wrapper import GoogleRunner
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    google_runner = cache.get('google_runner', lambda: GoogleRunner(*config.runner_args()))
+    try:
+        run(google_runner, config, invalidated)
+    except Exception:
+        # reference data loaded by a failed run may be partial, the next run starts from scratch
+        cache.invalidate()
+        raise
+    finally:
+        metrics.emit(config.run_report_path, config.prometheus_textfile)
+        write_profiles()
 
 
-class GoogleRunner:
+def invalidate_keys(event):
     """
-    A class to manage Google Sheets
+    Get the warm cache keys an event asks to drop, from its invalidate_cache attribute
+    :param event: Pub/Sub event, {"attributes": {"invalidate_cache": "all"}} or comma separated keys
+    :return: keys list, empty to drop everything, None if nothing is to be dropped
     """
-
-    def __init__(self, spreadsheet_id, credentials_file, entries_sheet, logs_sheet, roles_sheet,
-                 weekly_tasks_sheet, projects_sheet):
-        self.spreadsheet_id = spreadsheet_id
-        self.credentials_file = credentials_file
-        self.entries_sheet = entries_sheet
-        self.logs_sheet = logs_sheet
-        self.roles_sheet = roles_sheet
-        self.weekly_tasks_sheet = weekly_tasks_sheet
-        self.projects_sheet = projects_sheet
-
-    def google_auth(self):
-        """
-        oauth2 authentication agains Google Gsheet API
-        :return:
-        """
-        scope = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        try:
-            credentials = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_file, scope)
-            service = build('sheets', 'v4', http=credentials.authorize(httplib2.Http()), cache_discovery=False)
-            return service
-        except Exception as e:
-            print(f"Error connecting: {e}. Retrying connection...")
-            credentials = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_file, scope)
-            service = build('sheets', 'v4', http=credentials.authorize(httplib2.Http()), cache_discovery=False)
-            return service
-
-    def gsheet_append(self, gsheet_range, values):
-        """
-        Append rows to Google Sheet
-        :param ghseet_range:
-        :param values:
-        :return:
-        """
-        try:
-            if values:
-                service = self.google_auth()
-                print(f'Updating {gsheet_range} Google Sheet')
-                body = {
-                    'values': values
-                }
-                result = service.spreadsheets().values().append(spreadsheetId=self.spreadsheet_id, range=gsheet_range,
-                                                                insertDataOption="INSERT_ROWS",
-                                                                valueInputOption="RAW", body=body).execute()
-                updated_data = result.get('updates').get('updatedCells')
-                print('{0} cells appended.'.format(updated_data))
-                return updated_data
-            else:
-                print('Current entries are up to date')
-                return None
-        except Exception as e:
-            print(f'Error while updating Gsheet {self.spreadsheet_id}. Error was: {e}')
-
-    def gsheet_update(self, gsheet_range, values):
-        """
-        Update row range on Google Sheet
-        :param values:
-        :param gsheet_range:
-        :return:
-        """
-        try:
-            if values:
-                service = self.google_auth()
-                print(f'Updating {gsheet_range} Google Sheet')
-                body = {
-                    'values': values
-                }
-                result = service.spreadsheets().values().update(spreadsheetId=self.spreadsheet_id, range=gsheet_range,
-                                                                valueInputOption="RAW", body=body).execute()
-                updated_data = result.get('updatedCells')
-                print(f'{updated_data} cells on Row {gsheet_range} were updated.')
-                return updated_data
-            else:
-                print('There is nothing to be updated')
-                return None
-        except Exception as e:
-            print(f'Error while updating Gsheet Row {gsheet_range}. Error was: {e}')
-
-    def read_gsheet_data(self, sheet_range):
-        """
-        Append rows to Google Sheet
-        :param sheet_range:
-        :return: all rows if exists
-        """
-        try:
-            print(f'Getting data from {sheet_range}')
-            service = self.google_auth()
-            sheet = service.spreadsheets()
-            result = sheet.values().get(spreadsheetId=self.spreadsheet_id,
-                                        range=sheet_range).execute()
-            values = result.get('values', [])
-            if not values:
-                print('No data found.')
-                return None
-            else:
-                return values
-        except Exception as e:
-            print(f'Error while reading Gsheet data from {self.spreadsheet_id}. Error was: {e}')
-
-    def get_missing_rows(self, input_entries, past_entries_lookup):
-        """
-        Get missing rows in Gsheet, based on a list of rows input
-        :param input_entries: potential new rows from previous fortnight
-        :param past_entries_lookup: days to compare in the past
-        :return: missing rows
-        """
-        print('Getting Missing Rows from Google Sheet')
-        current_rows = self.read_gsheet_data(self.entries_sheet)
-        last_period_initial_date = (datetime.today() - timedelta(days=past_entries_lookup)).strftime('%Y-%m-%d')
-        last_period_rows_uid = [int(row[0]) for row in current_rows[1:] if row[1] >= last_period_initial_date]
-        new_rows = [row for row in input_entries if row[0] not in last_period_rows_uid]
-        return new_rows
-
-    def get_weekly_entries(self):
-        """
-        Get weekly automated Harvest tasks
-        :return:
-        """
-        print('Getting Automated time-entries from Google Sheet')
-        weekly_entries = self.read_gsheet_data(self.weekly_tasks_sheet)
-        entries = [{"user": row[0], "project": row[1], "code": row[2], "task": row[3], "date": row[4],
-                    "hours": row[5]} for row in weekly_entries[1:]]
-        return entries
-
-    def get_eligible_roles(self):
-        """
-        Get roles and their target utilization
-        :return: dict: {'role_a': 0.15}
-        """
-        print(f'Getting AirTable Roles from {self.roles_sheet} Google Sheet')
-        eligible_roles_rows = self.read_gsheet_data(self.roles_sheet)
-        eligible_roles = {}
-        for row in eligible_roles_rows[1:]:
-            if '%' in row[1]:
-                eligible_roles.update({row[0]: float('0.' + row[1].strip('%'))})
-            else:
-                eligible_roles.update({row[0]: float(row[1])})
-        return eligible_roles
-
-    def log_update(self, payload, sheet_id, type="entries"):
-        """
-        Log updated rows on Gsheet
-        :param payload:
-        :param sheet_id:
-        :param type: gsheet column length identifier
-        :return: None
-        """
-        sheet_type = {
-            "projects": 12,
-            "entries": 15
-        }
-        length = sheet_type[type]
-        log_date = date.today()
-        rows = int(payload) // length
-        update_msg = f'Logging info for {log_date}: {rows} rows were appended on {sheet_id}'
-        self.gsheet_append(self.logs_sheet, [[update_msg]])
-
-
-def runner(event, context):
-    logging.info(f'Starting Cloud function Runner. {event}: {context}')
-    google_runner = GoogleRunner(SPREADSHEET_ID, CREDENTIALS_FILE, ENTRIES_SHEET, LOGS_SHEET,
-                                 ROLES_SHEET, WEEKLY_TASKS_SHEET, PROJECTS_SHEET)
-    weekly_entries = google_runner.get_weekly_entries()
-    eligible_roles = google_runner.get_eligible_roles()
-    harvest_runner = HarvestAnalytics(PAST_ENTRIES_LOOKUP, HARVEST_ACCOUNT_ID, HARVEST_TOKEN,
-                                      weekly_entries, eligible_roles)
-    harvest_entries = harvest_runner.get_historical_data()
-    new_rows = google_runner.get_missing_rows(harvest_entries, PAST_ENTRIES_LOOKUP)
-    updated_cells = google_runner.gsheet_append(ENTRIES_SHEET, new_rows)
-    google_runner.log_update(updated_cells, ENTRIES_SHEET)
-    projects_status = harvest_runner.get_project_rows()
-    projects_range = f'{PROJECTS_SHEET}!A2:M'
-    updated_cells = google_runner.gsheet_update(projects_range, projects_status)
-    google_runner.log_update(updated_cells, PROJECTS_SHEET, "projects")
-    harvest_users = harvest_runner.harvest_users
-    harvest_projects = harvest_runner.harvest_projects
-    float_runner = FloatAnalytics(FLOAT_TOKEN, users=harvest_users, projects=harvest_projects)
-    float_runner.sync_people()
-    float_runner.sync_projects()
-    float_runner.create_tasks_from_ghseet(new_rows)
+    attributes = (event.get('attributes') or {}) if isinstance(event, dict) else {}
+    keys = attributes.get('invalidate_cache')
+    if not keys:
+        return None
+    return [] if keys == 'all' else [key.strip() for key in keys.split(',')]
+
+
+def run(google_runner, config, invalidated=()):
+    cache = get_warm_cache()
+    with google_runner.run_log as run_log:
+        results = build_stage_graph(google_runner, run_log, config).run()
+        people_updates = results['sync_people']
+        project_updates = results['sync_projects']
+        if people_updates or project_updates:
+            # cached Float people and projects no longer match what was patched
+            cache.invalidate('float_runner')
+        run_log.record('float_sync', f'{people_updates} people and {project_updates} projects were updated on Float',
+                       people=people_updates, projects=project_updates)
+        identity = results['float_linked'].identity
+        identity.save()
+        identity_stats = identity.stats()
+        run_log.record('identity_map', f'{identity_stats["mismatches"]} Harvest entities without a Float match, '
+                                       f'{identity_stats["unresolved"]} row names unresolved, '
+                                       f'{len(identity_stats["fuzzy_matched"])} projects matched by similarity',
+                       **identity_stats)
+        run_log.record('float_rate', 'Float rate governor usage', **results['float_linked'].governor.stats())
+        created_tasks = results['create_tasks']
+        task_stats = results['float_linked'].task_stats
+        run_log.record('float_tasks', f'{created_tasks} logged-time tasks were created on Float, '
+                                      f'{task_stats.get("duplicates_skipped", 0)} duplicates skipped',
+                       tasks=created_tasks, **task_stats)
+        if results['float_logged_time']:
+            run_log.record('float_dedupe', 'Float logged time pre-flight check',
+                           **results['float_logged_time'].stats())
+        run_log.record('sheets_quota', 'Sheets quota usage', **google_runner.governor.stats())
+        cache_stats = cache.stats()
+        run_log.record('warm_cache', f'{cache_stats["hits"]} warm cache hits and {cache_stats["misses"]} misses',
+                       invalidated=list(invalidated), **cache_stats)
 
 
 def wrapper(event, context):
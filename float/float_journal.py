@@ -0,0 +1,151 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+
+FLOAT_JOURNAL_PATH = 'float_journal.sqlite3'
+
+
+class TaskJournal:
+    """
+    A class to record every row submitted to Float on a local SQLite journal, so a rerun skips the rows
+    already created and resumes where the previous one stopped
+    """
+
+    def __init__(self, path=FLOAT_JOURNAL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS submissions (
+                                       row_key TEXT PRIMARY KEY,
+                                       task_type TEXT NOT NULL,
+                                       status TEXT NOT NULL,
+                                       status_code INTEGER,
+                                       float_id INTEGER,
+                                       attempts INTEGER NOT NULL DEFAULT 0,
+                                       error TEXT,
+                                       updated_at TEXT NOT NULL)''')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS windows (
+                                       window_key TEXT PRIMARY KEY,
+                                       task_type TEXT NOT NULL,
+                                       status TEXT NOT NULL,
+                                       rows INTEGER NOT NULL DEFAULT 0,
+                                       created INTEGER NOT NULL DEFAULT 0,
+                                       updated_at TEXT NOT NULL)''')
+
+    @staticmethod
+    def row_key(row, task_type):
+        """
+        Identity of an entries row, its Harvest time entry id
+        """
+        return f'{task_type}:{row[0]}'
+
+    def created_keys(self, task_type):
+        """
+        Get the keys of the rows confirmed as created on Float, or found there already
+        :param task_type: logged-time or tasks
+        :return: row keys set
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT row_key FROM submissions "
+                                           "WHERE task_type = ? AND status IN ('created', 'duplicate')",
+                                           (task_type,)).fetchall()
+        return {row_key for row_key, in rows}
+
+    def start(self, row_keys, task_type):
+        """
+        Record rows as about to be posted, a row left pending means the run died before its response
+        :param row_keys: keys of the rows a single task is posted for
+        """
+        with self.lock:
+            self.connection.executemany('''INSERT INTO submissions (row_key, task_type, status, attempts, updated_at)
+                                           VALUES (?, ?, 'pending', 1, ?)
+                                           ON CONFLICT (row_key) DO UPDATE SET status = 'pending',
+                                           attempts = attempts + 1, error = NULL, updated_at = excluded.updated_at''',
+                                        [(row_key, task_type, self.now()) for row_key in row_keys])
+
+    def finish(self, row_keys, status, status_code=None, float_id=None, error=None):
+        """
+        Record the result of a posted task on the rows it was posted for
+        :param status: created, duplicate (already on Float), rejected (non 2xx response), failed (exception),
+        invalid or unresolvable (set aside before posting), only created and duplicate rows being final
+        """
+        with self.lock:
+            self.connection.executemany('''UPDATE submissions SET status = ?, status_code = ?, float_id = ?,
+                                           error = ?, updated_at = ? WHERE row_key = ?''',
+                                        [(status, status_code, float_id, error, self.now(), row_key)
+                                         for row_key in row_keys])
+
+    def final_count(self, row_keys):
+        """
+        Count the rows created on Float, or found there already
+        :param row_keys: keys of the rows to check
+        :return: int
+        """
+        row_keys = list(row_keys)
+        count = 0
+        with self.lock:
+            for start in range(0, len(row_keys), 500):
+                chunk = row_keys[start:start + 500]
+                count += self.connection.execute(f"SELECT COUNT(*) FROM submissions WHERE status IN "
+                                                 f"('created', 'duplicate') AND row_key IN "
+                                                 f"({', '.join('?' * len(chunk))})", chunk).fetchone()[0]
+        return count
+
+    def completed_windows(self, task_type):
+        """
+        Get the backfill windows every row of which was created on Float
+        :return: window keys set
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT window_key FROM windows "
+                                           "WHERE task_type = ? AND status = 'complete'", (task_type,)).fetchall()
+        return {window_key for window_key, in rows}
+
+    def finish_window(self, window_key, task_type, status, rows=0, created=0):
+        """
+        Checkpoint a backfill window
+        :param window_key: e.g. 'logged-time:2021-03-01:2021-03-31'
+        :param status: complete, skipping the window on the next run, or incomplete
+        """
+        with self.lock:
+            self.connection.execute('''INSERT INTO windows (window_key, task_type, status, rows, created, updated_at)
+                                       VALUES (?, ?, ?, ?, ?, ?)
+                                       ON CONFLICT (window_key) DO UPDATE SET status = excluded.status,
+                                       rows = excluded.rows, created = excluded.created,
+                                       updated_at = excluded.updated_at''',
+                                    (window_key, task_type, status, rows, created, self.now()))
+
+    def seed(self, rows, task_type='logged-time'):
+        """
+        Mark rows created before the journal existed as created, e.g. a backfill run with a manual offset
+        :return: seeded rows count
+        """
+        keys = [(self.row_key(row, task_type), task_type, self.now()) for row in rows]
+        with self.lock:
+            self.connection.executemany('''INSERT OR IGNORE INTO submissions (row_key, task_type, status, updated_at)
+                                           VALUES (?, ?, 'created', ?)''', keys)
+        return len(keys)
+
+    def summary(self, task_type=None):
+        """
+        Get submitted rows count by status
+        :return: dict, e.g. {'created': 120, 'pending': 1}
+        """
+        query = 'SELECT status, COUNT(*) FROM submissions'
+        params = ()
+        if task_type:
+            query += ' WHERE task_type = ?'
+            params = (task_type,)
+        with self.lock:
+            return dict(self.connection.execute(query + ' GROUP BY status', params).fetchall())
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    @staticmethod
+    def now():
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,150 @@
+import random
+import threading
+from collections import deque
+from time import monotonic
+from pipeline.run_metrics import current_metrics, endpoint_of
+
+
+FLOAT_REQUESTS_PER_MINUTE = 180
+LOW_REMAINING = 15
+COOLDOWN_SECONDS = 90
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class FloatRateGovernor:
+    """
+    A class to pace the Float requests of an account under its per minute rate limit, shared by every thread
+    """
+
+    def __init__(self, requests_per_minute=FLOAT_REQUESTS_PER_MINUTE, low_remaining=LOW_REMAINING,
+                 cooldown=COOLDOWN_SECONDS, max_retries=5, base_delay=1, max_delay=60):
+        """
+        :param requests_per_minute: requests sent over any sliding minute
+        :param low_remaining: X-RateLimit-Remaining-Minute value pausing every request for the cooldown
+        :param cooldown: seconds paused once the remaining requests are low
+        """
+        self.limit = requests_per_minute
+        self.low_remaining = low_remaining
+        self.cooldown = cooldown
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.window = deque()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+        self.counters = {
+            "requests": 0,
+            "retries": 0,
+            "failed": 0,
+            "cooldowns": 0,
+            "paced_seconds": 0.0,
+            "backoff_seconds": 0.0
+        }
+
+    def acquire(self):
+        """
+        Wait until a request fits in the sliding one minute window and no cooldown is in progress
+        :return: None
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    while self.window and now - self.window[0] >= 60:
+                        self.window.popleft()
+                    if len(self.window) < self.limit:
+                        self.window.append(now)
+                        self.counters["requests"] += 1
+                        return
+                    wait = 60 - (now - self.window[0])
+                self.counters["paced_seconds"] += wait
+            current_metrics().sleep(wait, "float_rate_limit")
+
+    def observe(self, response):
+        """
+        Pause every request for the cooldown when Float reports the minute budget is nearly spent
+        :param response: requests response
+        :return: None
+        """
+        remaining = response.headers.get('X-RateLimit-Remaining-Minute')
+        if remaining is None or int(remaining) > self.low_remaining:
+            return
+        with self.lock:
+            now = monotonic()
+            if now < self.paused_until:
+                return
+            self.paused_until = now + self.cooldown
+            self.counters["cooldowns"] += 1
+        print(f'Float rate limit nearly reached, {remaining} requests left. Cooling down {self.cooldown} secs')
+
+    def retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        try:
+            return min(self.max_delay, float(retry_after))
+        except (TypeError, ValueError):
+            return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def request(self, session, method, url, **kwargs):
+        """
+        Send a Float request under the rate limit, retrying 429, 5xx and connection errors
+        :param session: requests session
+        :param method: HTTP method
+        :param url:
+        :param kwargs: requests arguments
+        :return: requests response, the last one if every retry failed
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                response = session.request(method, url, **kwargs)
+            except OSError as e:
+                if attempt >= self.max_retries:
+                    with self.lock:
+                        self.counters["failed"] += 1
+                    raise
+                reason = e.__class__.__name__
+                delay = self.retry_delay(attempt)
+            else:
+                self.observe(response)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                if attempt >= self.max_retries:
+                    with self.lock:
+                        self.counters["failed"] += 1
+                    return response
+                reason = f'HTTP {response.status_code}'
+                delay = self.retry_delay(attempt, response)
+            attempt += 1
+            with self.lock:
+                self.counters["retries"] += 1
+                self.counters["backoff_seconds"] += delay
+            print(f'Float {method.upper()} {endpoint_of(url)} failed with {reason}, '
+                  f'retry #{attempt} in {delay:.1f} secs')
+            current_metrics().record_retry("float")
+            current_metrics().sleep(delay, "float_backoff")
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["limit_per_minute"] = self.limit
+        return stats
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_float_governor(account, **kwargs):
+    """
+    Get the governor shared by every runner of a Float account
+    :param account: account identifier, e.g. its token
+    :param kwargs: FloatRateGovernor settings, only used on first call
+    :return: FloatRateGovernor
+    """
+    with _governors_lock:
+        if account not in _governors:
+            _governors[account] = FloatRateGovernor(**kwargs)
+        return _governors[account]
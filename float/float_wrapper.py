@@ -1,23 +1,58 @@
-from time import sleep
-import requests
-import unidecode
+from concurrent.futures import ThreadPoolExecutor
+from pipeline.run_metrics import instrumented_session
+from pipeline.profiling import profile_stage
+from float.logged_time_index import LoggedTimeIndex
+from float.float_rate import get_float_governor
+from float.preflight import TaskPreflight
+from identity.identity_map import IdentityMap
+import threading
+import os
 
 
 class FloatAnalytics:
     """
     A class to process and structure Float data
     """
-    def __init__(self, float_token, users=None, projects=None, clients=None, tasks=None):
+    def __init__(self, float_token, users=None, projects=None, clients=None, tasks=None, identity=None):
+        """
+        :param identity: IdentityMap linking Harvest entities to Float ids, an in memory one by default
+        """
         self.float_token = float_token
-        self.float_api = 'https://api.float.com/v3'
-        self.float_clients = self.get_clients()
-        self.float_projects = self.get_projects()
-        self.float_users = self.get_people()
+        self.identity = identity if identity is not None else IdentityMap()
+        self.float_api = os.environ.get('FLOAT_API_URL', 'https://api.float.com/v3')
+        self.session = instrumented_session('float')
+        self.governor = get_float_governor(float_token)
+        self.pending_updates = {}
+        self.updates_lock = threading.Lock()
+        self.float_clients, self.float_projects, self.float_users = self.get_reference_data()
         # self.float_tasks = self.get_tasks()
-        self.harvest_users = {unidecode.unidecode(user): data for user, data in users.items()}
+        self.set_harvest_data(users, projects, clients, tasks)
+        self.task_stats = {}
+
+    @profile_stage('float.get_reference_data')
+    def get_reference_data(self):
+        """
+        Get Float clients, projects and people concurrently
+        :return: (clients, projects, people) dicts
+        """
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            clients = executor.submit(self.get_clients)
+            projects = executor.submit(self.get_projects)
+            people = executor.submit(self.get_people)
+            return clients.result(), projects.result(), people.result()
+
+    def set_harvest_data(self, users=None, projects=None, clients=None, tasks=None):
+        """
+        Set the Harvest data Float is synced from, Float reference data can be loaded before it. The identity
+        map links the Harvest entities seen for the first time
+        :return: None
+        """
+        self.harvest_users = users or {}
         self.harvest_projects = projects
         self.harvest_clients = clients
         self.harvest_tasks = tasks
+        self.identity.update(self.float_users, self.float_projects, self.float_clients, users, projects, clients)
+        self.identity.save()
 
     def get_tasks(self):
         """
@@ -32,11 +67,12 @@ class FloatAnalytics:
         try:
             print('Getting Float Tasks')
             tasks_hashmap = {}
-            total_pages = requests.get(clients_url, verify=False, headers=headers).headers['X-Pagination-Page-Count']
+            response = self.session.get(clients_url, verify=False, headers=headers)
+            total_pages = response.headers['X-Pagination-Page-Count']
             for page in range(1, int(total_pages) + 1):
                 # for page in range(1, 30):
                 print(f'Getting Float entries from page #{page}')
-                tasks = requests.get(clients_url, verify=False, headers=headers, params={'page': page}).json()
+                tasks = self.session.get(clients_url, verify=False, headers=headers, params={'page': page}).json()
                 for task in tasks:
                     name = task["task_name"]
                     project_id = task["project_id"]
@@ -54,6 +90,43 @@ class FloatAnalytics:
         except Exception as e:
             print(f'Error while getting tasks. Error was {e}')
 
+    def get_logged_time(self, start_date, end_date):
+        """
+        Get Float logged time of a date window, filtered server side
+        :param start_date: 'YYYY-MM-DD'
+        :param end_date: 'YYYY-MM-DD'
+        :return: logged time records list
+        """
+        logged_time_url = f"{self.float_api}/logged-time"
+        headers = {
+            "User-Agent": "Python Float App",
+            "Authorization": f"Bearer {self.float_token}"
+        }
+        params = {"start_date": start_date, "end_date": end_date, "per-page": 200}
+        try:
+            print(f'Getting Float logged time from {start_date} to {end_date}')
+            response = self.session.get(logged_time_url, verify=False, headers=headers, params=params)
+            total_pages = int(response.headers['X-Pagination-Page-Count'])
+            records = response.json()
+            for page in range(2, total_pages + 1):
+                records.extend(self.session.get(logged_time_url, verify=False, headers=headers,
+                                                params=dict(params, page=page)).json())
+            return records
+        except Exception as e:
+            print(f'Error while getting logged time. Error was {e}')
+
+    @profile_stage('float.get_logged_time_index')
+    def get_logged_time_index(self, start_date, end_date):
+        """
+        Index the Float logged time of a date window, for create_tasks_from_ghseet to skip duplicated rows
+        :return: LoggedTimeIndex, None if the logged time couldn't be loaded
+        """
+        records = self.get_logged_time(start_date, end_date)
+        if records is None:
+            print('Float logged time could not be loaded, rows will be posted without duplicates check')
+            return None
+        return LoggedTimeIndex(records, start_date, end_date)
+
     def get_clients(self):
         """
         Get Float clients
@@ -67,9 +140,10 @@ class FloatAnalytics:
         try:
             print('Getting Float Clients')
             clients_hashmap = {}
-            total_pages = requests.get(clients_url, verify=False, headers=headers).headers['X-Pagination-Page-Count']
+            response = self.session.get(clients_url, verify=False, headers=headers)
+            total_pages = response.headers['X-Pagination-Page-Count']
             for page in range(1, int(total_pages) + 1):
-                clients = requests.get(clients_url, verify=False, headers=headers, params={'page': page}).json()
+                clients = self.session.get(clients_url, verify=False, headers=headers, params={'page': page}).json()
                 for client in clients:
                     name = client["name"]
                     client_id = client["client_id"]
@@ -91,9 +165,10 @@ class FloatAnalytics:
         try:
             print('Getting Float Projects')
             projects_hashmap = {}
-            total_pages = requests.get(projects_url, verify=False, headers=headers).headers['X-Pagination-Page-Count']
+            response = self.session.get(projects_url, verify=False, headers=headers)
+            total_pages = response.headers['X-Pagination-Page-Count']
             for page in range(1, int(total_pages) + 1):
-                projects = requests.get(projects_url, verify=False, headers=headers, params={'page': page}).json()
+                projects = self.session.get(projects_url, verify=False, headers=headers, params={'page': page}).json()
                 for project in projects:
                     name = project["name"].upper()
                     project_id = project["project_id"]
@@ -123,9 +198,10 @@ class FloatAnalytics:
         try:
             print('Getting Float Users')
             user_hashmap = {}
-            total_pages = requests.get(projects_url, verify=False, headers=headers).headers['X-Pagination-Page-Count']
+            response = self.session.get(projects_url, verify=False, headers=headers)
+            total_pages = response.headers['X-Pagination-Page-Count']
             for page in range(1, int(total_pages) + 1):
-                users = requests.get(projects_url, verify=False, headers=headers, params={'page': page}).json()
+                users = self.session.get(projects_url, verify=False, headers=headers, params={'page': page}).json()
                 for user in users:
                     name = user["name"]
                     people_id = user["people_id"]
@@ -154,7 +230,9 @@ class FloatAnalytics:
                 body = {
                     "name": name
                 }
-                response = requests.post(clients_url, verify=False, headers=headers, data=body).json()
+                response = self.session.post(clients_url, verify=False, headers=headers, data=body).json()
+                if "client_id" in response:
+                    self.identity.link('clients', data["id"], response["client_id"])
             print(f"{len(self.harvest_clients)} were created")
         except Exception as e:
             print(f'Error while creating clients. Error was {e}')
@@ -176,22 +254,32 @@ class FloatAnalytics:
                 is_billable = 0 if data["is_billable"] else 1
                 body = {
                     "name": data["name"],
-                    "client_id": self.float_clients[data["client"]]["id"],
+                    "client_id": self.identity.client(data["client"]),
                     "budget_type": 2,  # 2 Total Fee
                     "budget_total": data["budget"],
                     "non_billable": is_billable,  # 0 billable, 1 non-billable
                     "active": is_active  # 1 active, 0 inactive
                 }
-                response = requests.post(clients_url, verify=False, headers=headers, data=body)
+                response = self.session.post(clients_url, verify=False, headers=headers, data=body)
                 print(response.status_code, response.json())
+                if 200 <= response.status_code < 300:
+                    self.identity.link('projects', project_id, response.json()["project_id"])
             print(f"{len(self.harvest_projects)} were created")
         except Exception as e:
             print(f'Error while creating projects. Error was {e}')
+        self.identity.save()
 
-    def create_tasks_from_ghseet(self, gsheet_data, scheduled=False):
+    @profile_stage('float.create_tasks_from_ghseet')
+    def create_tasks_from_ghseet(self, gsheet_data, scheduled=False, journal=None, existing=None, aggregate=False):
         """
-        Create Float task
-        :return: none
+        Create Float task, a failing row being reported and skipped without abandoning the rest. Rows are checked
+        first, invalid rows and rows whose person or project can't be resolved never reach Float
+        :param gsheet_data: entries rows, an iterable
+        :param scheduled: create scheduled tasks instead of logged time
+        :param journal: TaskJournal, rows created on a previous run are skipped and every result is recorded
+        :param existing: LoggedTimeIndex, rows duplicating an existing record are skipped before being posted
+        :param aggregate: post a single task per person, project, date, task and billable, see iter_task_bodies
+        :return: created tasks count
         """
         task_type = 'tasks' if scheduled else 'logged-time'
         tasks_url = f"{self.float_api}/{task_type}"
@@ -199,37 +287,142 @@ class FloatAnalytics:
             "User-Agent": "Python Float App",
             "Authorization": f"Bearer {self.float_token}"
         }
+        count = 0
+        rejected = 0
+        failed = 0
+        duplicates = 0
+        stats = {"journal_skipped": 0, "aggregated_rows": 0}
+        created_keys = set()
+        if journal:
+            created_keys = journal.created_keys(task_type)
+            pending = journal.summary(task_type).get('pending', 0)
+            print(f'Journal {journal.path}: {len(created_keys)} rows already created, {pending} left pending by '
+                  f'an interrupted run will be posted again')
+
+        def pending_rows():
+            for row in gsheet_data:
+                if journal and journal.row_key(row, task_type) in created_keys:
+                    stats["journal_skipped"] += 1
+                    continue
+                yield row
+
+        def skip_row(row, status, reason):
+            if journal:
+                row_keys = [journal.row_key(row, task_type)]
+                journal.start(row_keys, task_type)
+                journal.finish(row_keys, status, error=reason)
+
+        preflight = TaskPreflight(self.identity)
         try:
             print(f'Creating Float {task_type} Tasks')
-            count = 0
-            for row in gsheet_data:
-                # if row[1][:4] == '2021':
-                body = {
-                    "project_id": self.get_project_id(row[6].upper(), row[7]),
-                    "people_id": self.float_users[unidecode.unidecode(row[2])]['id'],
-                    "hours": round(float(row[11]) * 4) / 4 if float(row[11]) >= 0.25 else 0.25,
-                    "date": row[1],
-                    "billable": 1 if row[9].strip().upper() == 'TRUE' else 0,
-                    "task_name": row[8]
-                }
-                response = requests.post(tasks_url, verify=False, headers=headers, data=body)
-                print(row[9], body["billable"], response.json()[0]["billable"])
-                if 'X-RateLimit-Remaining-Minute' in response.headers:
-                    rate_limit_remaining = response.headers['X-RateLimit-Remaining-Minute']
-                    if int(rate_limit_remaining) <= 15:
-                        print("Cooling down 1:30 minutes")
-                        sleep(90)
-                else:
-                    sleep(0.65)  # 650ms pause to avoid API Throttle
-                count += 1
-                if response.status_code == 200:
-                    print(count, response.status_code, response.json())
-                else:
-                    print(count, response.status_code, row)
+            ready_rows = preflight.split(pending_rows(), on_skip=skip_row)
+            for rows, body, error in self.iter_task_bodies(ready_rows, aggregate, stats):
+                row_keys = [journal.row_key(row, task_type) for row in rows] if journal else []
+                try:
+                    if journal:
+                        journal.start(row_keys, task_type)
+                    if error:
+                        raise error
+                    if existing and existing.claim(body):
+                        duplicates += 1
+                        if journal:
+                            journal.finish(row_keys, 'duplicate', error='already logged on Float')
+                        continue
+                    response = self.governor.request(self.session, 'post', tasks_url, verify=False, headers=headers,
+                                                     data=body)
+                    count += 1
+                    if 200 <= response.status_code < 300:
+                        created = response.json()
+                        print(count, response.status_code, created)
+                        if journal:
+                            float_id = created.get('task_id' if scheduled else 'logged_time_id')
+                            journal.finish(row_keys, 'created', response.status_code, float_id)
+                    else:
+                        rejected += 1
+                        print(count, response.status_code, rows[0] if len(rows) == 1 else body)
+                        if journal:
+                            journal.finish(row_keys, 'rejected', response.status_code, error=response.text[:500])
+                except Exception as e:
+                    failed += len(rows)
+                    print(f'Error while creating task for rows {[row[0] for row in rows]}. Error was {e}')
+                    if journal:
+                        journal.finish(row_keys, 'failed', error=str(e))
 
-            print(f" {count} Tasks were successfully created")
+            print(f" {count - rejected} Tasks were successfully created, {rejected} rejected, {failed} rows failed, "
+                  f"{stats['journal_skipped']} rows already created and {duplicates} tasks already logged on Float "
+                  f"skipped, {stats['aggregated_rows']} rows aggregated")
+            if preflight.unresolvable or preflight.invalid:
+                print(f'{len(preflight.unresolvable)} unresolvable and {len(preflight.invalid)} invalid rows not '
+                      f'posted: {dict(preflight.reasons.most_common(20))}')
         except Exception as e:
             print(f'Error while creating tasks. Error was {e}')
+        self.task_stats = {"created": count - rejected, "rejected": rejected, "failed": failed,
+                           "duplicates_skipped": duplicates, **stats, **preflight.stats()}
+        return count - rejected
+
+    def iter_task_bodies(self, rows, aggregate=False, stats=None):
+        """
+        Build the Float bodies of entries rows. Aggregated, rows of the same person, project, date, task and
+        billable flag become a single body with their hours summed and rounded once, rows being buffered until
+        the last one is read
+        :param rows: entries rows iterable
+        :param aggregate: group rows
+        :param stats: dict counting aggregated_rows, the rows merged into another row body
+        :return: (rows, body, error) generator, rows being the entries rows a body stands for and error the
+        exception raised while building it
+        """
+        if not aggregate:
+            for row in rows:
+                try:
+                    yield [row], self.build_task_body(row), None
+                except Exception as e:
+                    yield [row], None, e
+            return
+        groups = {}
+        for row in rows:
+            try:
+                body = self.build_task_body(row, round_hours=False)
+            except Exception as e:
+                yield [row], None, e
+                continue
+            key = (body["people_id"], body["project_id"], body["date"], body["task_name"], body["billable"])
+            if key in groups:
+                groups[key][0].append(row)
+                groups[key][1]["hours"] += body["hours"]
+                if stats is not None:
+                    stats["aggregated_rows"] = stats.get("aggregated_rows", 0) + 1
+            else:
+                groups[key] = ([row], body)
+        for group_rows, body in groups.values():
+            body["hours"] = self.round_hours(body["hours"])
+            yield group_rows, body, None
+
+    def build_task_body(self, row, round_hours=True):
+        """
+        Build a Float logged-time / task body from an entries row
+        :param row: entries row, see gsheet.sheet_schema.ENTRIES_SCHEMA
+        :param round_hours: round hours to the quarter, as Float stores them
+        :return: body dict
+        """
+        people_id = self.identity.person(row[2])
+        if people_id is None:
+            raise KeyError(row[2])
+        hours = row[11]
+        return {
+            "project_id": self.identity.project(row[6], row[7]),
+            "people_id": people_id,
+            "hours": self.round_hours(hours) if round_hours else hours,
+            "date": row[1],
+            "billable": 1 if row[9] == 'TRUE' else 0,
+            "task_name": row[8]
+        }
+
+    @staticmethod
+    def round_hours(hours):
+        """
+        Round hours to the quarter, a quarter at least
+        """
+        return round(hours * 4) / 4 if hours >= 0.25 else 0.25
 
     def create_people(self):
         pass
@@ -240,80 +433,67 @@ class FloatAnalytics:
     def create_reports(self):
         pass
 
-    def get_project_id(self, name, code):
-        """
-        Get Float project id, based on project name and code
-        """
-        for project_id, project_data in self.float_projects.items():
-            if code and project_data["code"]:
-                if project_data["name"].upper() == name.upper() and project_data["code"].upper() == code.upper():
-                    return project_id
-            elif project_data["name"].upper() == name.upper():
-                return project_id
-
-    def get_harvest_project_data(self, name, code):
-        """
-        Get project data for a given project name and code
-        """
-        for project_id, project_data in self.harvest_projects.items():
-            data = {"client": project_data["client"],
-                    "is_billable": project_data["is_billable"],
-                    "is_active": project_data["is_active"],
-                    "id": project_id,
-                    "name": project_data["name"]}
-            if project_data["name"].upper() == name.upper() and project_data["code"].upper() == code.upper():
-                return data
-        return
-
     #  SYNC FUNCTIONS
+    @profile_stage('float.sync_projects')
     def sync_projects(self):
         """
         Sync Float projects from Harvest's projects
-        :return: none
+        :return: updated projects count
         """
+        updated = 0
+        not_found = []
         try:
             print('Syncing Float Projects')
             for id, project_data in self.float_projects.items():
-                harvest_data = self.get_harvest_project_data(project_data["name"], project_data["code"])
+                harvest_id = self.identity.harvest_id('projects', id)
+                harvest_data = self.harvest_projects.get(harvest_id) if harvest_id is not None else None
                 if harvest_data:
                     is_billable = 0 if harvest_data["is_billable"] else 1
                     is_active = 1 if harvest_data["is_active"] else 0
-                    client = harvest_data["client"]
+                    client_id = self.identity.client(harvest_data["client"])
                     body = {}
-                    if project_data["client"] != self.float_clients[client]["id"]:
-                        body["client_id"] = self.float_clients[client]["id"]
+                    if client_id is not None and project_data["client"] != client_id:
+                        body["client_id"] = client_id
                     if project_data["is_billable"] != is_billable:
                         body["non_billable"] = is_billable
                     if project_data["is_active"] != is_active:
                         body["active"] = is_active
                     if body:
                         # print('projects', id, body)
-                        sleep(0.4)
-                        self.update_data('projects', id, body)
+                        self.queue_update('projects', id, body)
+                        updated += 1
                 else:
-                    print('Float project data not found in Harvest', id, project_data)
+                    not_found.append(f'{id} {project_data["name"]} ({project_data["code"]})')
         except Exception as e:
             print(f'Error while syncing projects. Error was {e}')
+        if not_found:
+            print(f'{len(not_found)} Float projects not found in Harvest: {", ".join(not_found)}')
+        self.flush_updates()
+        return updated
 
+    @profile_stage('float.sync_people')
     def sync_people(self):
         """
         Sync Float Users from Harvest
-        :return: none
+        :return: updated users count
         """
+        updated = 0
         try:
             print('Syncing Float Users')
-            for user, user_data in self.float_users.items():
-                if user not in self.harvest_users.keys():
+            float_people = {data["id"]: data for data in self.float_users.values()}
+            for user, harvest_data in self.harvest_users.items():
+                user_data = float_people.get(self.identity.float_id('people', harvest_data["id"]))
+                if user_data is None:
                     continue
                 float_rate = float(user_data["default_hourly_rate"]) if user_data["default_hourly_rate"] else float(0)
                 float_role = user_data["role"] if user_data["role"] else ""
                 float_status = user_data["active"]
-                if self.harvest_users[user]["default_hourly_rate"]:
-                    harvest_rate = self.harvest_users[user]["default_hourly_rate"]
+                if harvest_data["default_hourly_rate"]:
+                    harvest_rate = harvest_data["default_hourly_rate"]
                 else:
                     harvest_rate = float(0)
-                harvest_role = self.harvest_users[user]["role"]
-                harvest_status = self.harvest_users[user]["active"]
+                harvest_role = harvest_data["role"]
+                harvest_status = harvest_data["active"]
                 body = {}
                 if float_rate != harvest_rate:
                     body["default_hourly_rate"] = harvest_rate
@@ -323,13 +503,44 @@ class FloatAnalytics:
                     body["active"] = harvest_status
                 if body:
                     # print(user, rate, self.harvest_users[user])
-                    self.update_data('people', user_data["id"], body)
+                    self.queue_update('people', user_data["id"], body)
+                    updated += 1
         except Exception as e:
             print(f'Error while syncing Users. Error was {e}')
+        self.flush_updates()
+        return updated
+
+    def queue_update(self, endpoint, id, body):
+        """
+        Queue a PATCH, the fields queued for the same entity being merged into a single request
+        :param endpoint: Float endpoint, e.g. projects
+        :param id: entity id
+        :param body: changed fields
+        :return: None
+        """
+        with self.updates_lock:
+            self.pending_updates.setdefault((endpoint, id), {}).update(body)
+
+    def flush_updates(self, max_workers=4):
+        """
+        Send the queued PATCH requests concurrently, paced by the account rate governor
+        :param max_workers: concurrent requests
+        :return: (updated, failed) entities count
+        """
+        with self.updates_lock:
+            updates, self.pending_updates = self.pending_updates, {}
+        if not updates:
+            return 0, 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda update: self.update_data(*update[0], update[1]), updates.items()))
+        updated = sum(results)
+        print(f'{updated} Float entities updated, {len(results) - updated} failed')
+        return updated, len(results) - updated
 
     def update_data(self, endpoint, id, body):
         """
         Update via PATCH method a Float field on specified endpoint
+        :return: True if Float accepted the update
         """
         url = f"{self.float_api}/{endpoint}/{id}"
         headers = {
@@ -337,7 +548,9 @@ class FloatAnalytics:
             "Authorization": f"Bearer {self.float_token}"
         }
         try:
-            response = requests.patch(url, verify=False, headers=headers, data=body).json()
-            print(f'Updated {endpoint}/{id}. Input: {body}. Response: {response}')
+            response = self.governor.request(self.session, 'patch', url, verify=False, headers=headers, data=body)
+            print(f'Updated {endpoint}/{id}. Input: {body}. Response: {response.status_code} {response.text[:200]}')
+            return 200 <= response.status_code < 300
         except Exception as e:
             print(f'Error while updating {endpoint}/{id}: {e}')
+            return False
@@ -0,0 +1,50 @@
+import threading
+from collections import Counter
+
+
+class LoggedTimeIndex:
+    """
+    A class to index existing Float logged time by person, project, date, task and hours, so rows that would
+    duplicate a record are dropped before they are posted
+    """
+
+    def __init__(self, records, start_date=None, end_date=None):
+        """
+        :param records: Float logged-time records of the window
+        :param start_date: first date of the window the records were loaded for
+        :param end_date: last date of the window
+        """
+        self.start_date = start_date
+        self.end_date = end_date
+        self.counts = Counter(self.key(record) for record in records)
+        self.records = sum(self.counts.values())
+        self.duplicates = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(record):
+        """
+        Identity of a logged-time record or of a task body, hours rounded to the quarter Float stores
+        """
+        return (int(record["people_id"]), int(record["project_id"]), str(record["date"]),
+                record.get("task_name") or "", round(float(record["hours"]) * 4) / 4)
+
+    def claim(self, body):
+        """
+        Check a task body against the index, each existing record matching a single body
+        :param body: logged-time body, as FloatAnalytics.build_task_body builds it
+        :return: True if the body duplicates an existing record and must not be posted
+        """
+        if body["project_id"] is None or body["people_id"] is None:
+            return False
+        key = self.key(body)
+        with self.lock:
+            if self.counts[key] > 0:
+                self.counts[key] -= 1
+                self.duplicates += 1
+                return True
+        return False
+
+    def stats(self):
+        return {"window_start": self.start_date, "window_end": self.end_date, "existing_records": self.records,
+                "duplicates_skipped": self.duplicates}
@@ -0,0 +1,82 @@
+import re
+from collections import Counter
+
+
+DATE_FORMAT = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+ENTRIES_WIDTH = 12
+
+
+class TaskPreflight:
+    """
+    A class to check entries rows before they are posted to Float, resolving each distinct person and project
+    once, so only rows Float can accept spend the rate limit. Other rows are set aside with their reason:
+    invalid if the row itself is malformed, unresolvable if its person or project has no Float id
+    """
+
+    def __init__(self, identity):
+        """
+        :param identity: IdentityMap resolving rows names to Float ids
+        """
+        self.identity = identity
+        self.people = {}
+        self.projects = {}
+        self.ready = 0
+        self.unresolvable = []
+        self.invalid = []
+        self.reasons = Counter()
+
+    def check(self, row):
+        """
+        Check a row
+        :param row: entries row, see gsheet.sheet_schema.ENTRIES_SCHEMA
+        :return: (status, reason) tuple, status being ready, invalid or unresolvable
+        """
+        if len(row) < ENTRIES_WIDTH:
+            return 'invalid', f'{len(row)} columns'
+        if row[0] in (None, ''):
+            return 'invalid', 'no entry id'
+        if not isinstance(row[1], str) or not DATE_FORMAT.match(row[1]):
+            return 'invalid', f'date {row[1]!r}'
+        if isinstance(row[11], bool) or not isinstance(row[11], (int, float)) or row[11] <= 0:
+            return 'invalid', f'hours {row[11]!r}'
+        if row[2] not in self.people:
+            self.people[row[2]] = self.identity.person(row[2])
+        if self.people[row[2]] is None:
+            return 'unresolvable', f'unknown person {row[2]}'
+        project = (row[6], row[7])
+        if project not in self.projects:
+            self.projects[project] = self.identity.project(*project)
+        if self.projects[project] is None:
+            return 'unresolvable', f'unknown project {row[6]} ({row[7]})'
+        return 'ready', None
+
+    def split(self, rows, on_skip=None):
+        """
+        Yield the ready rows, the other ones being kept on unresolvable / invalid with their reason
+        :param rows: entries rows iterable, e.g. a RowStream
+        :param on_skip: callable(row, status, reason) called for each row set aside
+        :return: ready rows generator
+        """
+        for row in rows:
+            status, reason = self.check(row)
+            if status == 'ready':
+                self.ready += 1
+                yield row
+                continue
+            getattr(self, status).append((row, reason))
+            self.reasons[reason] += 1
+            if on_skip:
+                on_skip(row, status, reason)
+
+    def partition(self, rows):
+        """
+        Split rows at once
+        :return: dict of ready rows list, unresolvable and invalid (row, reason) lists and reasons counts
+        """
+        ready = list(self.split(rows))
+        return {"ready": ready, "unresolvable": self.unresolvable, "invalid": self.invalid,
+                "reasons": dict(self.reasons)}
+
+    def stats(self):
+        return {"ready": self.ready, "unresolvable": len(self.unresolvable), "invalid": len(self.invalid),
+                "skipped_reasons": dict(self.reasons.most_common(20))}
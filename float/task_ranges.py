@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+
+def next_working_day(day):
+    """
+    Get the working day after a date, Friday being followed by Monday
+    :param day: 'YYYY-MM-DD'
+    :return: 'YYYY-MM-DD'
+    """
+    following = datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)
+    while following.weekday() >= 5:
+        following += timedelta(days=1)
+    return following.strftime('%Y-%m-%d')
+
+
+def collapse_scheduled_tasks(tasks):
+    """
+    Merge the single day scheduled tasks of consecutive working days with the same person, project, name and
+    hours into ranged Float tasks, Float hours being per day. A second task of the same day stays on its own
+    :param tasks: (row, body) iterable, bodies having people_id, project_id, name, hours and start_date
+    :return: [(rows, body)] list, one ranged body per run of days with the rows it stands for
+    """
+    groups = {}
+    for row, body in tasks:
+        key = (body["people_id"], body["project_id"], body["name"], body["hours"])
+        groups.setdefault(key, []).append((body["start_date"], row, body))
+    ranged = []
+    for days in groups.values():
+        days.sort(key=lambda day: day[0])
+        current = None
+        for day, row, body in days:
+            if current and day == current[1]["end_date"]:
+                ranged.append(([row], dict(body, end_date=day)))
+                continue
+            if current and day == next_working_day(current[1]["end_date"]):
+                current[0].append(row)
+                current[1]["end_date"] = day
+                continue
+            current = ([row], dict(body, end_date=day))
+            ranged.append(current)
+    return ranged
@@ -1,7 +1,15 @@
-import httplib2
-from googleapiclient.discovery import build
-from oauth2client.service_account import ServiceAccountCredentials
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
+from gsheet.sheets_quota import get_governor
+from gsheet.run_log import RunLog
+from pipeline.profiling import profile_stage
+from gsheet.sheet_schema import decode_rows, ENTRIES_SCHEMA, ROLES_SCHEMA, WEEKLY_TASKS_SCHEMA
+import os
+
+
+SHEETS_API_URL = os.environ.get('SHEETS_API_URL')
 
 
 class GoogleRunner:
@@ -18,22 +26,51 @@ class GoogleRunner:
         self.roles_sheet = roles_sheet
         self.weekly_tasks_sheet = weekly_tasks_sheet
         self.projects_sheet = projects_sheet
+        self.governor = get_governor(spreadsheet_id)
+        self.run_log = RunLog(self)
+        self.local = threading.local()
+        self.credentials = None
+        self.credentials_lock = threading.Lock()
 
     def google_auth(self):
         """
-        oauth2 authentication agains Google Gsheet API
+        oauth2 authentication agains Google Gsheet API, the credentials being loaded once per runner and the
+        service built once per thread on its own http, given httplib2 connections can't be shared between threads
         :return:
         """
-        scope = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+        service = getattr(self.local, 'service', None)
+        if service:
+            return service
+        # imported on first use, keeping them off the cold start of runs that fail before reaching Sheets
+        import httplib2
+        from googleapiclient.discovery import build
+        if SHEETS_API_URL:
+            # local Sheets emulator, e.g. the benchmarks fake server, no credentials needed
+            service = build('sheets', 'v4', http=httplib2.Http(), cache_discovery=False,
+                            client_options={'api_endpoint': SHEETS_API_URL})
+            self.local.service = service
+            return service
+        credentials = self.google_credentials()
         try:
-            credentials = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_file, scope)
             service = build('sheets', 'v4', http=credentials.authorize(httplib2.Http()), cache_discovery=False)
-            return service
         except Exception as e:
             print(f"Error connecting: {e}. Retrying connection...")
-            credentials = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_file, scope)
             service = build('sheets', 'v4', http=credentials.authorize(httplib2.Http()), cache_discovery=False)
-            return service
+        self.local.service = service
+        return service
+
+    def google_credentials(self):
+        """
+        Service account credentials, read from the credentials file once per runner and shared by the threads
+        services, the access token being refreshed once for all of them
+        :return: ServiceAccountCredentials
+        """
+        with self.credentials_lock:
+            if self.credentials is None:
+                from oauth2client.service_account import ServiceAccountCredentials
+                scope = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+                self.credentials = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_file, scope)
+            return self.credentials
 
     def gsheet_append(self, gsheet_range, values):
         """
@@ -49,9 +86,10 @@ class GoogleRunner:
                 body = {
                     'values': values
                 }
-                result = service.spreadsheets().values().append(spreadsheetId=self.spreadsheet_id, range=gsheet_range,
-                                                                insertDataOption="INSERT_ROWS",
-                                                                valueInputOption="RAW", body=body).execute()
+                values_api = service.spreadsheets().values()
+                request = values_api.append(spreadsheetId=self.spreadsheet_id, range=gsheet_range,
+                                            insertDataOption="INSERT_ROWS", valueInputOption="RAW", body=body)
+                result = self.governor.execute(request, "write")
                 updated_data = result.get('updates').get('updatedCells')
                 print('{0} cells appended.'.format(updated_data))
                 return updated_data
@@ -60,6 +98,7 @@ class GoogleRunner:
                 return None
         except Exception as e:
             print(f'Error while updating Gsheet {self.spreadsheet_id}. Error was: {e}')
+            raise
 
     def gsheet_update(self, gsheet_range, values):
         """
@@ -75,8 +114,10 @@ class GoogleRunner:
                 body = {
                     'values': values
                 }
-                result = service.spreadsheets().values().update(spreadsheetId=self.spreadsheet_id, range=gsheet_range,
-                                                                valueInputOption="RAW", body=body).execute()
+                values_api = service.spreadsheets().values()
+                request = values_api.update(spreadsheetId=self.spreadsheet_id, range=gsheet_range,
+                                            valueInputOption="RAW", body=body)
+                result = self.governor.execute(request, "write")
                 updated_data = result.get('updatedCells')
                 print(f'{updated_data} cells on Row {gsheet_range} were updated.')
                 return updated_data
@@ -85,19 +126,51 @@ class GoogleRunner:
                 return None
         except Exception as e:
             print(f'Error while updating Gsheet Row {gsheet_range}. Error was: {e}')
+            raise
+
+    def gsheet_batch_update(self, data):
+        """
+        Update several ranges on Google Sheet within a single request
+        :param data: list of value ranges, {'range': ..., 'values': ...}
+        :return: updated cells count
+        """
+        try:
+            if data:
+                service = self.google_auth()
+                print(f'Updating {len(data)} ranges on Google Sheet')
+                body = {
+                    'valueInputOption': 'RAW',
+                    'data': data
+                }
+                request = service.spreadsheets().values().batchUpdate(spreadsheetId=self.spreadsheet_id, body=body)
+                result = self.governor.execute(request, "write")
+                updated_data = result.get('totalUpdatedCells')
+                print(f'{updated_data} cells on {len(data)} ranges were updated.')
+                return updated_data
+            else:
+                print('There is nothing to be updated')
+                return None
+        except Exception as e:
+            print(f'Error while batch updating Gsheet {self.spreadsheet_id}. Error was: {e}')
+            raise
 
-    def read_gsheet_data(self, sheet_range):
+    def read_gsheet_data(self, sheet_range, value_render_option='FORMATTED_VALUE',
+                         date_time_render_option='FORMATTED_STRING'):
         """
         Append rows to Google Sheet
         :param sheet_range:
+        :param value_render_option: FORMATTED_VALUE returns strings, UNFORMATTED_VALUE returns typed cells
+        :param date_time_render_option: FORMATTED_STRING or SERIAL_NUMBER, for unformatted reads
         :return: all rows if exists
         """
         try:
             print(f'Getting data from {sheet_range}')
             service = self.google_auth()
             sheet = service.spreadsheets()
-            result = sheet.values().get(spreadsheetId=self.spreadsheet_id,
-                                        range=sheet_range).execute()
+            request = sheet.values().get(spreadsheetId=self.spreadsheet_id, range=sheet_range,
+                                         valueRenderOption=value_render_option,
+                                         dateTimeRenderOption=date_time_render_option)
+            result = self.governor.execute(request, "read")
             values = result.get('values', [])
             if not values:
                 print('No data found.')
@@ -106,7 +179,64 @@ class GoogleRunner:
                 return values
         except Exception as e:
             print(f'Error while reading Gsheet data from {self.spreadsheet_id}. Error was: {e}')
+            raise
+
+    def read_typed_rows(self, sheet_range, schema, header=True):
+        """
+        Read unformatted rows from Google Sheet and decode them with a schema
+        :param sheet_range:
+        :param schema: one decoder per column, see gsheet.sheet_schema
+        :param header: skip the first row
+        :return: typed rows, empty list if there is no data
+        """
+        rows = self.read_gsheet_data(sheet_range, value_render_option='UNFORMATTED_VALUE',
+                                     date_time_render_option='SERIAL_NUMBER') or []
+        return decode_rows(rows[1:] if header else rows, schema)
+
+    def get_sheet_row_count(self, sheet):
+        """
+        Get the grid row count of a sheet, including trailing empty rows
+        :param sheet: sheet name
+        :return: row count
+        """
+        service = self.google_auth()
+        request = service.spreadsheets().get(spreadsheetId=self.spreadsheet_id, ranges=[sheet],
+                                             fields='sheets.properties.gridProperties.rowCount')
+        result = self.governor.execute(request, "read")
+        return result['sheets'][0]['properties']['gridProperties']['rowCount']
 
+    def iter_gsheet_rows(self, sheet, start_row=2, end_row=None, block_size=5000, workers=4, schema=None):
+        """
+        Stream rows of a large sheet, fetching blocks of rows concurrently under the Sheets quota
+        :param sheet: sheet name
+        :param start_row: first sheet row to read, 2 skips the header
+        :param end_row: last sheet row to read, the sheet row count by default
+        :param block_size: rows fetched per request
+        :param workers: concurrent requests
+        :param schema: decode rows with a sheet_schema schema, raw formatted rows if None
+        :return: non empty rows generator, in sheet order
+        """
+        end_row = end_row or self.get_sheet_row_count(sheet)
+        blocks = [f'{sheet}!{first}:{min(first + block_size - 1, end_row)}'
+                  for first in range(start_row, end_row + 1, block_size)]
+        print(f'Reading {sheet} rows {start_row} to {end_row} on {len(blocks)} blocks')
+        value_render_option = 'UNFORMATTED_VALUE' if schema else 'FORMATTED_VALUE'
+        date_time_render_option = 'SERIAL_NUMBER' if schema else 'FORMATTED_STRING'
+
+        def read_block(block_range):
+            rows = self.read_gsheet_data(block_range, value_render_option, date_time_render_option) or []
+            rows = [row for row in rows if row]
+            return decode_rows(rows, schema) if schema else rows
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for block_range in blocks:
+                pending.append(executor.submit(read_block, block_range))
+                if len(pending) >= workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    @profile_stage('gsheet.get_missing_rows')
     def get_missing_rows(self, input_entries, past_entries_lookup):
         """
         Get missing rows in Gsheet, based on a list of rows input
@@ -115,21 +245,111 @@ class GoogleRunner:
         :return: missing rows
         """
         print('Getting Missing Rows from Google Sheet')
-        current_rows = self.read_gsheet_data(self.entries_sheet)
-        last_period_initial_date = (datetime.today() - timedelta(days=past_entries_lookup)).strftime('%Y-%m-%d')
-        last_period_rows_uid = [int(row[0]) for row in current_rows[1:] if row[1] >= last_period_initial_date]
+        last_period_rows_uid = self.get_entry_ids(past_entries_lookup)
         new_rows = [row for row in input_entries if row[0] not in last_period_rows_uid]
         return new_rows
 
+    @profile_stage('gsheet.get_entry_ids')
+    def get_entry_ids(self, past_entries_lookup):
+        """
+        Get entry ids already on the entries sheet for the lookup period
+        :param past_entries_lookup: days to compare in the past
+        :return: entry ids set
+        """
+        current_rows = self.read_typed_rows(self.entries_sheet, ENTRIES_SCHEMA)
+        last_period_initial_date = (datetime.today() - timedelta(days=past_entries_lookup)).strftime('%Y-%m-%d')
+        return {row[0] for row in current_rows if row[1] >= last_period_initial_date}
+
+    def get_changed_ranges(self, sheet, current_rows, input_rows, first_row=2, key_columns=(0,)):
+        """
+        Diff input rows against the rows currently on a sheet, matching them by key columns
+        :param sheet: sheet name
+        :param current_rows: rows read from the sheet, starting on first_row
+        :param input_rows: fresh rows
+        :param first_row: sheet row number of current_rows[0]
+        :param key_columns: columns identifying a row
+        :return: value ranges with the changed cells only, plus new rows appended after the last one
+        """
+        key_width = max(key_columns) + 1
+        current_index = {}
+        for offset, row in enumerate(current_rows):
+            if len(row) >= key_width:
+                current_index[tuple(str(row[column]) for column in key_columns)] = (first_row + offset, row)
+        changed_ranges = []
+        new_rows = []
+        for row in input_rows:
+            key = tuple(str(row[column]) for column in key_columns)
+            if key not in current_index:
+                new_rows.append(row)
+                continue
+            row_number, current_row = current_index[key]
+            start = None
+            for column in range(len(row) + 1):
+                changed = column < len(row) and not self.same_cell(
+                    current_row[column] if column < len(current_row) else None, row[column])
+                if changed and start is None:
+                    start = column
+                elif not changed and start is not None:
+                    changed_ranges.append({'range': f'{sheet}!{self.column_letter(start)}{row_number}',
+                                           'values': [row[start:column]]})
+                    start = None
+        if new_rows:
+            changed_ranges.append({'range': f'{sheet}!A{first_row + len(current_rows)}', 'values': new_rows})
+        return changed_ranges
+
+    def gsheet_diff_write(self, sheet, rows, key_columns=(0,)):
+        """
+        Write rows on a sheet with a header row, sending only the cells that changed and the new rows
+        :param sheet: sheet name
+        :param rows: fresh rows
+        :param key_columns: columns identifying a row
+        :return: updated cells count
+        """
+        print(f'Getting changed rows from {sheet} Google Sheet')
+        current_rows = self.read_gsheet_data(sheet, value_render_option='UNFORMATTED_VALUE') or []
+        changed_ranges = self.get_changed_ranges(sheet, current_rows[1:], rows, key_columns=key_columns)
+        return self.gsheet_batch_update(changed_ranges)
+
+    def update_projects(self, projects_rows):
+        """
+        Update projects sheet, writing only the cells that changed and the new projects
+        :param projects_rows: Harvest project rows, project_id on first column
+        :return: updated cells count
+        """
+        return self.gsheet_diff_write(self.projects_sheet, projects_rows)
+
+    @staticmethod
+    def same_cell(current_value, new_value):
+        """
+        Compare an unformatted sheet cell with a raw value, empty cells being equal to None
+        """
+        current_value = '' if current_value is None else current_value
+        new_value = '' if new_value is None else new_value
+        if isinstance(current_value, bool) or isinstance(new_value, bool):
+            return current_value is new_value
+        return current_value == new_value
+
+    @staticmethod
+    def column_letter(index):
+        """
+        Convert a zero based column index into its A1 notation letters
+        """
+        letters = ''
+        index += 1
+        while index:
+            index, remainder = divmod(index - 1, 26)
+            letters = chr(65 + remainder) + letters
+        return letters
+
     def get_weekly_entries(self):
         """
         Get weekly automated Harvest tasks
         :return:
         """
         print('Getting Automated time-entries from Google Sheet')
-        weekly_entries = self.read_gsheet_data(self.weekly_tasks_sheet)
+        weekly_entries = self.read_typed_rows(self.weekly_tasks_sheet, WEEKLY_TASKS_SCHEMA)
         entries = [{"user": row[0], "project": row[1], "code": row[2], "task": row[3], "date": row[4],
-                    "hours": row[5]} for row in weekly_entries[1:]]
+                    "hours": row[5]} for row in weekly_entries]
         return entries
 
     def get_eligible_roles(self):
@@ -138,18 +358,13 @@ class GoogleRunner:
         :return: dict: {'role_a': 0.15}
         """
         print(f'Getting AirTable Roles from {self.roles_sheet} Google Sheet')
-        eligible_roles_rows = self.read_gsheet_data(self.roles_sheet)
-        eligible_roles = {}
-        for row in eligible_roles_rows[1:]:
-            if '%' in row[1]:
-                eligible_roles.update({row[0]: float('0.' + row[1].strip('%'))})
-            else:
-                eligible_roles.update({row[0]: float(row[1])})
+        eligible_roles_rows = self.read_typed_rows(self.roles_sheet, ROLES_SCHEMA)
+        eligible_roles = {row[0]: row[1] for row in eligible_roles_rows}
         return eligible_roles
 
     def log_update(self, payload, sheet_id, type="entries"):
         """
-        Log updated rows on Gsheet
+        Log updated rows on the run log, written on Gsheet when the run log is flushed
         :param payload:
         :param sheet_id:
         :param type: gsheet column length identifier
@@ -157,14 +372,17 @@ class GoogleRunner:
         """
         sheet_type = {
             "projects": 12,
-            "entries": 15
+            "entries": 15,
+            "forecast": 8,
+            "variance": 9
         }
         length = sheet_type[type]
         log_date = date.today()
-        rows = int(payload) // length
+        rows = int(payload or 0) // length
         update_msg = f'Logging info for {log_date}: {rows} rows were appended on {sheet_id}'
-        self.gsheet_append(self.logs_sheet, [[update_msg]])
+        self.run_log.record(type, update_msg, sheet=sheet_id, rows=rows, cells=int(payload or 0))
 
+    @profile_stage('gsheet.get_new_rows')
     def get_new_rows(self, input_entries, past_entries_lookup):
         """
         Get missing rows in Gsheet, based on a list of rows input
@@ -172,19 +390,17 @@ class GoogleRunner:
         """
         print('Getting Missing Rows from Google Sheet')
         new_rows = []
-        current_rows = self.read_gsheet_data(self.entries_sheet)
+        current_rows = self.read_typed_rows(self.entries_sheet, ENTRIES_SCHEMA)
         last_period_initial_date = (datetime.today() - timedelta(days=past_entries_lookup)).strftime('%Y-%m-%d')
         last_period_rows = {}
-        for index, row in enumerate(current_rows[1:]):
+        for index, row in enumerate(current_rows):
             if row[1] >= last_period_initial_date:
-                last_period_rows.update({row[0]: {'values': row[1:11] + [float(row[11]), int(row[12])]
-                                                  + list(map(float, row[13:])), 'index': index + 2}})
-        last_period_rows_uid = [int(row) for row in last_period_rows.keys()]
+                last_period_rows.update({row[0]: {'values': row[1:], 'index': index + 2}})
         for row in input_entries:
-            if row[0] not in last_period_rows_uid:
+            if row[0] not in last_period_rows:
                 new_rows.append(row)
-            elif row[1:] != last_period_rows[str(row[0])]['values']:
-                print(f'{last_period_rows[str(row[0])]["index"]}: {row}')
+            elif row[1:] != last_period_rows[row[0]]['values']:
+                print(f'{last_period_rows[row[0]]["index"]}: {row}')
                 # row_index = last_period_rows[str(row[0])]['index']
                 # gsheet_range = f'{ENTRIES_SHEET}!A{row_index}:P{row_index}'
                 # gsheet_update(CREDENTIALS_FILE, SPREADSHEET_ID, ENTRIES_SHEET, gsheet_range, [row])
@@ -0,0 +1,69 @@
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import monotonic
+
+
+class RunLog:
+    """
+    A class to buffer run events and write them on the logs sheet with a single append
+    """
+
+    def __init__(self, google_runner):
+        self.google_runner = google_runner
+        self.events = []
+        self.lock = threading.Lock()
+        self.started = monotonic()
+
+    def __enter__(self):
+        self.started = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.record("failed", f"Run failed with {exc_type.__name__}: {exc_value}")
+        self.record("run", f"Run finished in {monotonic() - self.started:.1f} secs",
+                    seconds=round(monotonic() - self.started, 3))
+        self.flush()
+        return False
+
+    def record(self, event, message, **fields):
+        """
+        Buffer a run event
+        :param event: event type, e.g. entries, projects, float_sync
+        :param message: human readable message
+        :param fields: structured values, written as JSON
+        :return: None
+        """
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        print(f'{event}: {message}')
+        with self.lock:
+            self.events.append([timestamp, event, message, json.dumps(fields, default=str) if fields else ""])
+
+    @contextmanager
+    def timed(self, event):
+        """
+        Record the time spent on a block of the run
+        :param event: event type
+        """
+        started = monotonic()
+        try:
+            yield
+        finally:
+            seconds = monotonic() - started
+            self.record(event, f"{event} took {seconds:.1f} secs", seconds=round(seconds, 3))
+
+    def flush(self):
+        """
+        Append every buffered event on the logs sheet with a single request
+        :return: appended cells count
+        """
+        with self.lock:
+            rows, self.events = self.events, []
+        if not rows:
+            return None
+        try:
+            return self.google_runner.gsheet_append(self.google_runner.logs_sheet, rows)
+        except Exception as e:
+            print(f'Error while flushing run log, {len(rows)} events were lost. Error was: {e}')
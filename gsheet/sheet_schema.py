@@ -0,0 +1,86 @@
+from datetime import date, timedelta
+
+
+SHEETS_EPOCH = date(1899, 12, 30)
+
+
+def as_str(value):
+    """
+    Decode a cell as text, numbers keep their shortest representation
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return str(value).upper()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def as_flag(value):
+    """
+    Decode a boolean cell as 'TRUE' / 'FALSE' text, as Harvest rows are built
+    """
+    if isinstance(value, str):
+        return 'TRUE' if value.strip().upper() == 'TRUE' else 'FALSE'
+    return 'TRUE' if value else 'FALSE'
+
+
+def as_int(value):
+    """
+    Decode a numeric cell as int, empty cells as None
+    """
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+def as_float(value):
+    """
+    Decode a numeric cell as float, empty cells as None
+    """
+    if value is None or value == '':
+        return None
+    return float(value)
+
+
+def as_percent(value):
+    """
+    Decode a percentage cell as a ratio, '15%' and 0.15 both being 0.15
+    """
+    if isinstance(value, str):
+        if '%' in value:
+            return float(value.strip().strip('%')) / 100
+        return float(value)
+    return as_float(value)
+
+
+def as_date(value):
+    """
+    Decode a date cell as a 'YYYY-MM-DD' string, either from a serial number or from text
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (SHEETS_EPOCH + timedelta(days=int(value))).strftime('%Y-%m-%d')
+    return as_str(value)
+
+
+ENTRIES_SCHEMA = (as_int, as_date, as_str, as_str, as_str, as_str, as_str, as_str, as_str, as_flag, as_flag,
+                  as_float, as_float, as_float, as_float)
+ROLES_SCHEMA = (as_str, as_percent)
+WEEKLY_TASKS_SCHEMA = (as_str, as_str, as_str, as_str, as_str, as_float)
+
+
+def decode_rows(rows, schema):
+    """
+    Decode unformatted sheet rows into typed rows in a single pass
+    :param rows: rows as returned by a UNFORMATTED_VALUE / SERIAL_NUMBER read
+    :param schema: one decoder per column, missing trailing cells are decoded from None
+    :return: typed rows
+    """
+    width = len(schema)
+    typed_rows = []
+    for row in rows:
+        if len(row) < width:
+            row = row + [None] * (width - len(row))
+        typed_rows.append([decode(value) for decode, value in zip(schema, row)])
+    return typed_rows
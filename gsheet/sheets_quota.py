@@ -0,0 +1,149 @@
+import random
+import threading
+from collections import deque
+from time import monotonic
+from pipeline.run_metrics import current_metrics
+
+
+READ_REQUESTS_PER_MINUTE = 60
+WRITE_REQUESTS_PER_MINUTE = 60
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class SheetsGovernor:
+    """
+    A class to pace Google Sheets requests of a spreadsheet under its per minute quotas
+    """
+
+    def __init__(self, spreadsheet_id, reads_per_minute=READ_REQUESTS_PER_MINUTE,
+                 writes_per_minute=WRITE_REQUESTS_PER_MINUTE, max_retries=6, base_delay=1, max_delay=64):
+        self.spreadsheet_id = spreadsheet_id
+        self.limits = {"read": reads_per_minute, "write": writes_per_minute}
+        self.windows = {"read": deque(), "write": deque()}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.counters = {
+            "read": 0,
+            "write": 0,
+            "retries": 0,
+            "failed": 0,
+            "paced_seconds": 0.0,
+            "backoff_seconds": 0.0,
+            "peak_read_per_minute": 0,
+            "peak_write_per_minute": 0
+        }
+
+    def acquire(self, kind):
+        """
+        Wait until a request of the given kind fits in the sliding one minute window
+        :param kind: read or write
+        :return: None
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                window = self.windows[kind]
+                while window and now - window[0] >= 60:
+                    window.popleft()
+                if len(window) < self.limits[kind]:
+                    window.append(now)
+                    self.counters[kind] += 1
+                    peak = f"peak_{kind}_per_minute"
+                    self.counters[peak] = max(self.counters[peak], len(window))
+                    return
+                wait = 60 - (now - window[0])
+                self.counters["paced_seconds"] += wait
+            current_metrics().sleep(wait, "sheets_quota")
+
+    def execute(self, request, kind="read"):
+        """
+        Execute a Sheets API request under quota, retrying 429 and 5xx with jittered exponential backoff
+        :param request: googleapiclient HttpRequest
+        :param kind: read or write, the quota the request counts against
+        :return: request response
+        """
+        from googleapiclient.errors import HttpError
+        attempt = 0
+        metrics = current_metrics()
+        endpoint = getattr(request, 'methodId', None) or 'sheets.spreadsheets'
+        received = self.measure_response(request)
+        while True:
+            self.acquire(kind)
+            started = monotonic()
+            try:
+                response = request.execute()
+                metrics.record_request("sheets", endpoint, monotonic() - started, 200,
+                                       bytes_sent=len(getattr(request, 'body', None) or ''),
+                                       bytes_received=received.pop() if received else 0)
+                return response
+            except HttpError as e:
+                status = int(e.resp.status)
+                metrics.record_request("sheets", endpoint, monotonic() - started, status,
+                                       bytes_sent=len(getattr(request, 'body', None) or ''),
+                                       bytes_received=len(e.content or b''))
+                if status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    with self.lock:
+                        self.counters["failed"] += 1
+                    raise
+                reason = f"HTTP {status}"
+            except (ConnectionError, TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    with self.lock:
+                        self.counters["failed"] += 1
+                    raise
+                reason = e.__class__.__name__
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            attempt += 1
+            with self.lock:
+                self.counters["retries"] += 1
+                self.counters["backoff_seconds"] += delay
+            print(f'Sheets {kind} request failed with {reason}, retry #{attempt} in {delay:.1f} secs')
+            metrics.record_retry("sheets")
+            metrics.sleep(delay, "sheets_backoff")
+
+    @staticmethod
+    def measure_response(request):
+        """
+        Hook the response parsing of a request to measure its body, execute only returning the parsed response
+        :param request: googleapiclient HttpRequest
+        :return: list the body size of each successful response is appended to
+        """
+        received = []
+        postproc = getattr(request, 'postproc', None)
+        if postproc is not None:
+            def measured_postproc(resp, content):
+                received.append(len(content or b''))
+                return postproc(resp, content)
+            request.postproc = measured_postproc
+        return received
+
+    def stats(self):
+        """
+        Get request counters, including the busiest minute seen for each quota
+        :return: counters dict
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        stats.update({"spreadsheet_id": self.spreadsheet_id,
+                      "read_limit_per_minute": self.limits["read"],
+                      "write_limit_per_minute": self.limits["write"]})
+        return stats
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(spreadsheet_id, **kwargs):
+    """
+    Get the governor shared by every runner of a spreadsheet
+    :param spreadsheet_id:
+    :param kwargs: SheetsGovernor settings, only used on first call
+    :return: SheetsGovernor
+    """
+    with _governors_lock:
+        if spreadsheet_id not in _governors:
+            _governors[spreadsheet_id] = SheetsGovernor(spreadsheet_id, **kwargs)
+        return _governors[spreadsheet_id]
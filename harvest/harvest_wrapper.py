@@ -1,23 +1,40 @@
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from pipeline.run_metrics import instrumented_session
+from pipeline.profiling import profile_stage
 from datetime import datetime, timedelta
+from time import sleep
 import logging
+import os
 
 
 class HarvestAnalytics:
     """
     A class to process and structure Harvest data
     """
-    def __init__(self, entries_lookup, harvest_account, harvest_token, weekly_entries, eligible_roles):
+    def __init__(self, entries_lookup, harvest_account, harvest_token, weekly_entries=None, eligible_roles=None):
         self.past_entries_lookup = entries_lookup
-        self.harvest_api = 'https://api.harvestapp.com/v2/'
+        self.harvest_api = os.environ.get('HARVEST_API_URL', 'https://api.harvestapp.com/v2/')
         self.harvest_account = harvest_account
         self.harvest_token = harvest_token
+        self.session = instrumented_session('harvest')
         self.weekly_entries = weekly_entries
         self.harvest_eligible_roles = eligible_roles
-        self.harvest_tasks = self.get_tasks()
-        self.harvest_projects = self.get_projects()
-        self.harvest_users = self.get_users_data()
+        self.harvest_tasks, self.harvest_projects, self.harvest_users = self.get_reference_data()
 
+    @profile_stage('harvest.get_reference_data')
+    def get_reference_data(self):
+        """
+        Get Harvest tasks, projects, budgets and users concurrently
+        :return: (tasks, projects, users) dicts
+        """
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            tasks = executor.submit(self.get_tasks)
+            budgets = executor.submit(self.get_budgets)
+            projects = executor.submit(self.get_projects, budgets)
+            users = executor.submit(self.get_users_data)
+            return tasks.result(), projects.result(), users.result()
+
+    @profile_stage('harvest.get_historical_data')
     def get_historical_data(self):
         """
         :return:
@@ -30,7 +47,7 @@ class HarvestAnalytics:
             "Harvest-Account-ID": self.harvest_account
         }
         try:
-            total_pages = requests.get(url_time_entries, verify=False, headers=headers).json()['total_pages']
+            total_pages = self.session.get(url_time_entries, verify=False, headers=headers).json()['total_pages']
             users_full_data = self.get_row_list(url_time_entries, headers, total_pages)
             print('Harvest Data was retrieved successfully')
             return users_full_data
@@ -52,7 +69,7 @@ class HarvestAnalytics:
         try:
             users_data = {}
             print('Getting Harvest Users data')
-            harvest_users_data = requests.get(url_users, verify=False, headers=headers).json()
+            harvest_users_data = self.session.get(url_users, verify=False, headers=headers).json()
             for user in harvest_users_data['users']:
                 full_name = user['first_name'] + " " + user['last_name']
                 role = user['roles'][0] if user['roles'] else None
@@ -73,56 +90,119 @@ class HarvestAnalytics:
         except Exception as e:
             print(f'Error while getting users roles. Error was {e}')
 
-    def get_row_list(self, url, headers, total_pages):
+    def iter_historical_pages(self):
         """
-        Get rows list of lists, each list representing a new row
+        Stream time entry rows from Harvest page by page, for consumers to start before the last page
+        :return: rows lists generator, one per page
+        """
+        print('Streaming Historical time entries from Harvest')
+        url_time_entries = self.harvest_api + 'time_entries'
+        headers = {
+            "User-Agent": "Python Harvest API Sample",
+            "Authorization": "Bearer {}".format(self.harvest_token),
+            "Harvest-Account-ID": self.harvest_account
+        }
+        total_pages = self.session.get(url_time_entries, verify=False, headers=headers).json()['total_pages']
+        yield from self.iter_row_pages(url_time_entries, headers, total_pages)
+
+    def iter_window_pages(self, from_date, to_date):
+        """
+        Stream the time entry rows of a date window page by page, the window being filtered by Harvest
+        :param from_date: 'YYYY-MM-DD'
+        :param to_date: 'YYYY-MM-DD', included
+        :return: rows lists generator, one per page
+        """
+        url_time_entries = self.harvest_api + 'time_entries'
+        headers = {
+            "User-Agent": "Python Harvest API Sample",
+            "Authorization": "Bearer {}".format(self.harvest_token),
+            "Harvest-Account-ID": self.harvest_account
+        }
+        window = {'from': from_date, 'to': to_date, 'per_page': 2000}
+        total_pages = self.get_page(url_time_entries, headers, window)['total_pages']
+        yield from self.iter_row_pages(url_time_entries, headers, total_pages, window)
+
+    def get_page(self, url, headers, params=None):
+        """
+        Get a Harvest page, waiting for the Retry-After delay while Harvest rate limits the account
+        :return: page json
+        """
+        while True:
+            response = self.session.get(url, verify=False, params=params, headers=headers)
+            if response.status_code != 429:
+                return response.json()
+            retry_after = int(response.headers.get('Retry-After', 15))
+            print(f'Harvest rate limit reached, retrying in {retry_after} secs')
+            sleep(retry_after)
+
+    def iter_row_pages(self, url, headers, total_pages, window=None):
+        """
+        Get rows list of lists page by page, stopping on the first entry older than the lookup period
         :param url:
         :param headers:
         :param total_pages:
-        :return:
+        :param window: {'from': 'YYYY-MM-DD', 'to': 'YYYY-MM-DD'} Harvest filter replacing the lookup period
+        :return: rows lists generator, one per page
         """
         available_roles = self.harvest_eligible_roles.keys()
-        users_entries = []
         start_date = (datetime.today() - timedelta(days=self.past_entries_lookup)).strftime('%Y-%m-%d')
         execution_date = datetime.today().strftime('%Y-%m-%d')
+        if window:
+            start_date, execution_date = window['from'], window['to']
         # start_date = '2019-01-01'
+        for page in range(1, total_pages + 1):
+            print(f'Getting Harvest entries from page #{page}')
+            page_entries = self.get_page(url, headers, dict(window or {}, page=page))
+            page_rows = []
+            for entry in page_entries['time_entries']:
+                entry_date = entry['spent_date']
+                full_name = entry['user']['name']
+                role = self.harvest_users[full_name]['role']
+                if role in available_roles and start_date <= entry_date <= execution_date:
+                    entry_id = entry['id']
+                    date = entry_date
+                    staff_member = full_name
+                    geography = self.harvest_users[full_name]['geography']
+                    client = entry['client']['name']
+                    project = entry['project']['name']
+                    project_code = entry['project']['code']
+                    task = entry['task']['name']
+                    billable = str(entry['billable']).upper()
+                    locked = str(entry['is_locked']).upper()
+                    hours = entry['hours']
+                    target_utilization = self.harvest_eligible_roles[role]
+                    cost_rate = entry['cost_rate']
+                    hourly_rate = entry['user_assignment']['hourly_rate']
+                    row = [entry_id, date, staff_member, role, geography, client, project, project_code, task,
+                           billable, locked, hours, target_utilization, cost_rate, hourly_rate]
+                    page_rows.append(row)
+                elif entry_date >= start_date:
+                    pass
+                else:
+                    yield page_rows
+                    return
+            yield page_rows
+
+    def get_row_list(self, url, headers, total_pages):
+        """
+        Get rows list of lists, each list representing a new row
+        :param url:
+        :param headers:
+        :param total_pages:
+        :return:
+        """
+        users_entries = []
         try:
-            for page in range(1, total_pages + 1):
-                print(f'Getting Harvest entries from page #{page}')
-                page_entries = requests.get(url, verify=False, params={'page': page}, headers=headers).json()
-                for entry in page_entries['time_entries']:
-                    entry_date = entry['spent_date']
-                    full_name = entry['user']['name']
-                    role = self.harvest_users[full_name]['role']
-                    if role in available_roles and start_date <= entry_date <= execution_date:
-                        entry_id = entry['id']
-                        date = entry_date
-                        staff_member = full_name
-                        geography = self.harvest_users[full_name]['geography']
-                        client = entry['client']['name']
-                        project = entry['project']['name']
-                        project_code = entry['project']['code']
-                        task = entry['task']['name']
-                        billable = str(entry['billable']).upper()
-                        locked = str(entry['is_locked']).upper()
-                        hours = entry['hours']
-                        target_utilization = self.harvest_eligible_roles[role]
-                        cost_rate = entry['cost_rate']
-                        hourly_rate = entry['user_assignment']['hourly_rate']
-                        row = [entry_id, date, staff_member, role, geography, client, project, project_code, task,
-                               billable, locked, hours, target_utilization, cost_rate, hourly_rate]
-                        users_entries.append(row)
-                    elif entry_date >= start_date:
-                        pass
-                    else:
-                        return users_entries
+            for page_rows in self.iter_row_pages(url, headers, total_pages):
+                users_entries.extend(page_rows)
             return users_entries
         except Exception as e:
             print(f'Error while getting page Data. Error was {e}')
 
-    def get_projects(self):
+    def get_projects(self, budgets=None):
         """
         Get Harvest projects
+        :param budgets: budgets dict, or a future resolving to it, fetched if not given
         :return: projects list of dicts
         """
         url_projects = self.harvest_api + 'projects'
@@ -133,16 +213,20 @@ class HarvestAnalytics:
         }
         try:
             print('Getting Harvest Projects')
-            budgets = self.get_budgets()
             projects_hashmap = {}
             none_budget = {
                 "budget": 0,
                 "spent": 0,
                 "remaining": 0
             }
-            total_pages = requests.get(url_projects, verify=False, headers=headers, ).json()['total_pages']
-            for page in range(1, total_pages + 1):
-                projects = requests.get(url_projects, verify=False, headers=headers, params={'page': page}).json()
+            total_pages = self.session.get(url_projects, verify=False, headers=headers, ).json()['total_pages']
+            projects_pages = [self.session.get(url_projects, verify=False, headers=headers,
+                                               params={'page': page}).json() for page in range(1, total_pages + 1)]
+            if budgets is None:
+                budgets = self.get_budgets()
+            elif hasattr(budgets, 'result'):
+                budgets = budgets.result()
+            for projects in projects_pages:
                 for project in projects["projects"]:
                     project_id = project["id"]
                     project_data = {
@@ -185,9 +269,9 @@ class HarvestAnalytics:
         try:
             print('Getting Harvest Budgets')
             budget_hashmap = {}
-            total_pages = requests.get(url_budget, verify=False, headers=headers).json()['total_pages']
+            total_pages = self.session.get(url_budget, verify=False, headers=headers).json()['total_pages']
             for page in range(1, total_pages + 1):
-                projects = requests.get(url_budget, verify=False, headers=headers, params={'page': page}).json()
+                projects = self.session.get(url_budget, verify=False, headers=headers, params={'page': page}).json()
                 for project in projects["results"]:
                     name = project["project_name"].upper()
                     project_id = project["project_id"]
@@ -214,9 +298,9 @@ class HarvestAnalytics:
         try:
             print('Getting Harvest Tasks')
             tasks_hashmap = {}
-            total_pages = requests.get(url_tasks, verify=False, headers=headers).json()['total_pages']
+            total_pages = self.session.get(url_tasks, verify=False, headers=headers).json()['total_pages']
             for page in range(1, total_pages + 1):
-                tasks = requests.get(url_tasks, verify=False, headers=headers, params={'page': page}).json()
+                tasks = self.session.get(url_tasks, verify=False, headers=headers, params={'page': page}).json()
                 for task in tasks["tasks"]:
                     name = task["name"].upper()
                     task_id = task["id"]
@@ -250,7 +334,7 @@ class HarvestAnalytics:
             "hours": hours
         }
         try:
-            response = requests.post(url_time_entries, verify=False, data=body, headers=headers).json()
+            response = self.session.post(url_time_entries, verify=False, data=body, headers=headers).json()
             # entry_id = response["id"]
             print(f'Entry created, response was: {response}')
             return response
@@ -270,7 +354,7 @@ class HarvestAnalytics:
             "Harvest-Account-ID": self.harvest_account
         }
         try:
-            response = requests.delete(url_time_entry, verify=False, headers=headers).json()
+            response = self.session.delete(url_time_entry, verify=False, headers=headers).json()
             print(f'Entry deleted, response was: {response}')
         except Exception as e:
             print(f'Error while creating time-entry. Error was {e}')
@@ -325,9 +409,9 @@ class HarvestAnalytics:
         try:
             print('Getting Harvest Clients')
             clients_hashmap = {}
-            total_pages = requests.get(url_tasks, verify=False, headers=headers).json()['total_pages']
+            total_pages = self.session.get(url_tasks, verify=False, headers=headers).json()['total_pages']
             for page in range(1, total_pages + 1):
-                clients = requests.get(url_tasks, verify=False, headers=headers, params={'page': page}).json()
+                clients = self.session.get(url_tasks, verify=False, headers=headers, params={'page': page}).json()
                 for client in clients["clients"]:
                     name = client["name"]
                     client_id = client["id"]
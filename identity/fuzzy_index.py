@@ -0,0 +1,99 @@
+import heapq
+import re
+from collections import Counter
+
+
+FUZZY_THRESHOLD = 0.85
+FUZZY_MARGIN = 0.05
+MIN_CANDIDATE_SCORE = 0.3
+# trigrams shared by more projects than this ratio, e.g. 'pro' of 'project', are too common to find candidates
+COMMON_TRIGRAM_RATIO = 0.05
+SHORTLIST = 50
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+
+
+class TrigramIndex:
+    """
+    A class to index project names and codes by trigrams, ranking the candidates of a name that drifted between
+    systems by similarity without comparing it to every project
+    """
+
+    def __init__(self, threshold=FUZZY_THRESHOLD, margin=FUZZY_MARGIN):
+        """
+        :param threshold: similarity a candidate needs to be matched automatically
+        :param margin: similarity the best candidate needs over the second one, similar names being ambiguous
+        """
+        self.threshold = threshold
+        self.margin = margin
+        self.postings = {}
+        self.entries = {}
+
+    @staticmethod
+    def normalize(text):
+        """
+        Lower case ASCII words, punctuation and accents dropped
+        """
+        import unidecode
+        return NON_ALPHANUMERIC.sub(' ', unidecode.unidecode(text or '').lower()).strip()
+
+    @staticmethod
+    def trigrams(text):
+        padded = f'  {text} '
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, key, name, code=None):
+        """
+        Index a project
+        :param key: project id
+        :param name: project name
+        :param code: project code
+        :return: None
+        """
+        grams = self.trigrams(self.normalize(f'{name} {code or ""}'))
+        self.entries[key] = (name, code, grams)
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(key)
+
+    def search(self, name, code=None, limit=5):
+        """
+        Rank indexed projects by trigram similarity (Dice coefficient) with a name and code. Candidates are found
+        on the query rare trigrams, only the shortlist sharing most of them being scored on every trigram
+        :return: [(score, key)] list, best first, candidates under MIN_CANDIDATE_SCORE left out
+        """
+        grams = self.trigrams(self.normalize(f'{name} {code or ""}'))
+        postings = sorted((self.postings[gram] for gram in grams if gram in self.postings), key=len)
+        common = max(SHORTLIST, len(self.entries) * COMMON_TRIGRAM_RATIO)
+        rare = [keys for keys in postings if len(keys) <= common] or postings[:1]
+        shared = Counter()
+        for keys in rare:
+            shared.update(keys)
+        scores = ((round(2 * len(grams & self.entries[key][2]) / (len(grams) + len(self.entries[key][2])), 3), key)
+                  for key, _ in shared.most_common(SHORTLIST))
+        return heapq.nlargest(limit, (candidate for candidate in scores if candidate[0] >= MIN_CANDIDATE_SCORE))
+
+    def match(self, name, code=None, veto=None):
+        """
+        Get the project a name and code match confidently
+        :param veto: callable(key) returning why a candidate can't be matched, None if it can
+        :return: (key, candidates) tuple, key being None if no allowed candidate reaches the threshold with the
+        margin, candidates including the vetoed ones
+        """
+        candidates = self.search(name, code, limit=5)
+        allowed = [candidate for candidate in candidates if veto is None or veto(candidate[1]) is None]
+        if allowed and allowed[0][0] >= self.threshold:
+            if len(allowed) == 1 or allowed[0][0] - allowed[1][0] >= self.margin:
+                return allowed[0][1], candidates
+        return None, candidates
+
+    def describe(self, candidates, veto=None):
+        """
+        Candidates as reported, e.g. on the identity map mismatches, with the reason a vetoed one wasn't matched
+        """
+        described = []
+        for score, key in candidates:
+            candidate = {"id": key, "name": self.entries[key][0], "code": self.entries[key][1], "score": score}
+            reason = veto(key) if veto else None
+            if reason:
+                candidate["vetoed"] = reason
+            described.append(candidate)
+        return described
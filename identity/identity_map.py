@@ -0,0 +1,319 @@
+import json
+import os
+import threading
+from identity.fuzzy_index import TrigramIndex, FUZZY_THRESHOLD
+
+
+IDENTITY_MAP_PATH = 'identity_map.json'
+KINDS = ('people', 'projects', 'clients')
+
+
+class IdentityMap:
+    """
+    A class to link Harvest people, projects and clients to their Float ids, persisted between runs. Entities
+    are matched by name once, when first seen, every later resolution being a dict lookup. Project names of
+    entries rows without an exact match are matched on a trigram index when the similarity is above the fuzzy
+    threshold. Harvest projects themselves, which syncs write to through their link, are only linked on an exact
+    match, their closest Float projects being listed on the mismatches for review
+    """
+
+    def __init__(self, path=None, fuzzy_threshold=FUZZY_THRESHOLD):
+        """
+        :param path: JSON file the map is loaded from and saved to, kept in memory only if None
+        :param fuzzy_threshold: similarity, from 0 to 1, a project needs to be matched on the trigram index
+        """
+        self.path = path
+        self.fuzzy_threshold = fuzzy_threshold
+        self.fuzzy_index = None
+        self.fuzzy_matches = []
+        self.unresolved = {}
+        self.lock = threading.Lock()
+        # harvest id -> float id, by kind
+        self.links = {kind: {} for kind in KINDS}
+        # harvest name (project name and code for projects) -> harvest id, by kind
+        self.names = {kind: {} for kind in KINDS}
+        # names only known from rows, e.g. renamed Harvest projects, resolved against Float once -> float id
+        self.aliases = {kind: {} for kind in KINDS}
+        self.reverse = {kind: {} for kind in KINDS}
+        self.float_people = {}
+        self.float_projects = {}
+        self.float_project_data = {}
+        self.mismatches = []
+        self.changed = False
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def project_key(name, code):
+        """
+        Identity of a Harvest project, its name and code as Harvest and entries rows write them
+        """
+        return f'{name}\x1f{code or ""}'
+
+    def load(self):
+        with open(self.path) as file:
+            data = json.load(file)
+        for kind in KINDS:
+            kind_data = data.get(kind, {})
+            self.links[kind] = {harvest_id: float_id for harvest_id, float_id in kind_data.get("links", [])}
+            self.names[kind] = dict(kind_data.get("names", {}))
+            self.aliases[kind] = dict(kind_data.get("aliases", {}))
+            self.reverse[kind] = {float_id: harvest_id for harvest_id, float_id in self.links[kind].items()}
+        print(f'Identity map loaded from {self.path}: '
+              f'{", ".join(f"{len(self.links[kind])} {kind}" for kind in KINDS)} linked')
+
+    def save(self):
+        """
+        Write the map if it changed, through a temporary file so an interrupted write keeps the previous map
+        :return: None
+        """
+        if not self.path or not self.changed:
+            return
+        with self.lock:
+            data = {kind: {"links": [[harvest_id, float_id] for harvest_id, float_id in self.links[kind].items()],
+                           "names": self.names[kind],
+                           "aliases": self.aliases[kind]} for kind in KINDS}
+            self.changed = False
+        with open(f'{self.path}.tmp', 'w') as file:
+            json.dump(data, file)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def update(self, float_people, float_projects, float_clients, harvest_users=None, harvest_projects=None,
+               harvest_clients=None):
+        """
+        Link the Harvest entities not linked yet, or whose Float entity no longer exists, and list the ones
+        without a Float match. Names are normalized once per entity instead of once per row
+        :param float_people: FloatAnalytics.float_users
+        :param float_projects: FloatAnalytics.float_projects
+        :param float_clients: FloatAnalytics.float_clients
+        :param harvest_users: HarvestAnalytics.harvest_users
+        :param harvest_projects: HarvestAnalytics.harvest_projects
+        :param harvest_clients: Harvest clients by name, projects clients are linked by name when missing
+        :return: mismatches list of dicts
+        """
+        import unidecode
+        with self.lock:
+            self.float_people = {name: data["id"] for name, data in (float_people or {}).items()}
+            self.float_projects = {}
+            for project_id, data in (float_projects or {}).items():
+                self.float_projects.setdefault(data["name"].upper(), []).append((data["code"].upper(), project_id))
+            self.float_project_data = float_projects or {}
+            self.fuzzy_index = None
+            self.fuzzy_matches = []
+            self.unresolved = {}
+            float_client_ids = {name: data["id"] for name, data in (float_clients or {}).items()}
+            mismatches = []
+            # aliases are resolved again once their Float entity is gone, or created for the unresolved ones
+            current_ids = (('people', set(self.float_people.values())), ('projects', set(float_projects or {})),
+                           ('clients', set(float_client_ids.values())))
+            for kind, float_ids in current_ids:
+                self.aliases[kind] = {name: float_id for name, float_id in self.aliases[kind].items()
+                                      if float_id in float_ids}
+
+            float_ids = set(self.float_people.values())
+            for name, data in (harvest_users or {}).items():
+                self.add_name('people', name, data["id"])
+                if self.links['people'].get(data["id"]) not in float_ids:
+                    self.link_or_miss('people', data["id"], self.float_people.get(unidecode.unidecode(name)), name,
+                                      mismatches)
+
+            float_ids = set(float_projects or {})
+            for project_id, data in (harvest_projects or {}).items():
+                self.add_name('projects', self.project_key(data["name"], data["code"]), project_id)
+                if self.links['projects'].get(project_id) not in float_ids:
+                    candidates = []
+                    self.link_or_miss('projects', project_id,
+                                      self.match_project(data["name"], data["code"], candidates, project_id,
+                                                         fuzzy=False, locked=True),
+                                      f'{data["name"]} ({data["code"]})', mismatches, candidates)
+
+            if harvest_clients:
+                clients = {name: data["id"] for name, data in harvest_clients.items()}
+            else:
+                clients = {data["client"]: data["client"] for data in (harvest_projects or {}).values()}
+            float_ids = set(float_client_ids.values())
+            for name, harvest_id in clients.items():
+                self.add_name('clients', name, harvest_id)
+                if self.links['clients'].get(harvest_id) not in float_ids:
+                    self.link_or_miss('clients', harvest_id, float_client_ids.get(name), name, mismatches)
+
+            self.mismatches = mismatches
+        if mismatches:
+            print(f'{len(mismatches)} Harvest entities not linked to Float: '
+                  f'{", ".join(mismatch["kind"] + " " + mismatch["name"] for mismatch in mismatches[:20])}')
+        return mismatches
+
+    def add_name(self, kind, name, harvest_id):
+        if self.names[kind].get(name) != harvest_id:
+            self.names[kind][name] = harvest_id
+            self.changed = True
+
+    def link_or_miss(self, kind, harvest_id, float_id, name, mismatches, candidates=None):
+        if float_id is None:
+            mismatch = {"kind": kind, "harvest_id": harvest_id, "name": name}
+            if candidates:
+                mismatch["candidates"] = candidates
+            mismatches.append(mismatch)
+            if harvest_id in self.links[kind]:
+                self.reverse[kind].pop(self.links[kind].pop(harvest_id), None)
+                self.changed = True
+            return
+        if not self.link(kind, harvest_id, float_id, locked=True):
+            mismatches.append({"kind": kind, "harvest_id": harvest_id, "name": name,
+                               "conflict": {"float_id": float_id, "harvest_id": self.reverse[kind][float_id]}})
+
+    def link(self, kind, harvest_id, float_id, locked=False):
+        """
+        Link a Harvest entity to its Float id, e.g. once created on Float. A Float id backs a single Harvest
+        entity, linking it to a second one is refused
+        :param kind: people, projects or clients
+        :param locked: the caller already holds the map lock
+        :return: True if linked, False if the Float id is linked to another Harvest entity
+        """
+        if not locked:
+            with self.lock:
+                return self.link(kind, harvest_id, float_id, locked=True)
+        if self.linked_elsewhere(kind, harvest_id, float_id):
+            return False
+        previous = self.links[kind].get(harvest_id)
+        if self.reverse[kind].get(previous) == harvest_id:
+            del self.reverse[kind][previous]
+        self.links[kind][harvest_id] = float_id
+        self.reverse[kind][float_id] = harvest_id
+        self.changed = True
+        return True
+
+    def linked_elsewhere(self, kind, harvest_id, float_id):
+        """
+        Check if a Float id is already linked to another Harvest entity
+        """
+        other = self.reverse[kind].get(float_id)
+        return other is not None and other != harvest_id and self.links[kind].get(other) == float_id
+
+    def match_project(self, name, code, candidates=None, harvest_id=None, fuzzy=True, locked=False):
+        """
+        Match a project against Float, on its name and on its code when both sides have one, then on the trigram
+        index of Float projects names and codes. A similar project is never matched when both sides have a
+        different code, e.g. the 2021 and 2022 editions of a project, or when it is linked to another Harvest one
+        :param candidates: list the ranked Float candidates are added to when no project matches
+        :param harvest_id: Harvest project matched, None for names only known from rows
+        :param fuzzy: match on the trigram index, else its candidates are only added to candidates
+        :param locked: the caller already holds the map lock
+        :return: Float project id, None if not found
+        """
+        upper_code = (code or "").upper()
+        for float_code, project_id in self.float_projects.get(name.upper(), ()):
+            if not upper_code or not float_code or float_code == upper_code:
+                return project_id
+        fuzzy_index = self.project_index(locked)
+
+        def veto(float_id):
+            float_code = (self.float_project_data[float_id]["code"] or "").upper()
+            if upper_code and float_code and float_code != upper_code:
+                return f'code {float_code} differs'
+            if harvest_id is not None and self.linked_elsewhere('projects', harvest_id, float_id):
+                return f'linked to Harvest project {self.reverse["projects"][float_id]}'
+
+        if not fuzzy:
+            if candidates is not None:
+                candidates.extend(fuzzy_index.describe(fuzzy_index.search(name, code), veto))
+            return None
+        project_id, ranked = fuzzy_index.match(name, code, veto)
+        if project_id is not None:
+            self.fuzzy_matches.append({"name": name, "code": code, "float_id": project_id,
+                                       "float_name": fuzzy_index.entries[project_id][0], "score": ranked[0][0]})
+            print(f'Project {name} ({code}) matched to Float project {project_id} '
+                  f'{fuzzy_index.entries[project_id][0]}, similarity {ranked[0][0]}')
+        elif candidates is not None:
+            candidates.extend(fuzzy_index.describe(ranked, veto))
+        return project_id
+
+    def project_index(self, locked=False):
+        """
+        Get the trigram index of Float projects, built on first use and published once complete so concurrent
+        resolutions never search a partial index
+        :param locked: the caller already holds the map lock
+        :return: TrigramIndex
+        """
+        if self.fuzzy_index is not None:
+            return self.fuzzy_index
+        if not locked:
+            with self.lock:
+                return self.project_index(locked=True)
+        fuzzy_index = TrigramIndex(self.fuzzy_threshold)
+        for project_id, data in self.float_project_data.items():
+            fuzzy_index.add(project_id, data["name"], data["code"])
+        self.fuzzy_index = fuzzy_index
+        return fuzzy_index
+
+    def resolve(self, kind, name, match):
+        harvest_id = self.names[kind].get(name)
+        if harvest_id is not None and harvest_id in self.links[kind]:
+            return self.links[kind][harvest_id]
+        if name in self.aliases[kind]:
+            return self.aliases[kind][name]
+        candidates = []
+        float_id = match(candidates)
+        with self.lock:
+            self.aliases[kind][name] = float_id
+            if float_id is None:
+                self.unresolved[(kind, name)] = candidates
+            self.changed = True
+        return float_id
+
+    def person(self, name):
+        """
+        Get the Float id of a person, by the name Harvest writes on entries rows
+        :return: Float people id, None if unresolved
+        """
+        import unidecode
+        return self.resolve('people', name, lambda candidates: self.float_people.get(unidecode.unidecode(name)))
+
+    def project(self, name, code):
+        """
+        Get the Float id of a project, by the name and code Harvest writes on entries rows
+        :return: Float project id, None if unresolved
+        """
+        return self.resolve('projects', self.project_key(name, code),
+                            lambda candidates: self.match_project(name, code, candidates))
+
+    def client(self, name):
+        """
+        Get the Float id of a client, by its Harvest name
+        :return: Float client id, None if unresolved
+        """
+        harvest_id = self.names['clients'].get(name)
+        return self.links['clients'].get(harvest_id) if harvest_id is not None else None
+
+    def float_id(self, kind, harvest_id):
+        """
+        Get the Float id a Harvest entity is linked to
+        :return: Float id, None if not linked
+        """
+        return self.links[kind].get(harvest_id)
+
+    def harvest_id(self, kind, float_id):
+        """
+        Get the Harvest id a Float entity is linked to
+        :return: Harvest id, None if not linked
+        """
+        return self.reverse[kind].get(float_id)
+
+    def unresolved_report(self):
+        """
+        Names of entries rows no entity resolved since the last update, with the closest Float projects
+        :return: list of dicts
+        """
+        with self.lock:
+            unresolved = list(self.unresolved.items())
+        return [{"kind": kind, "name": name.replace('\x1f', ' ').strip(), "candidates": candidates}
+                for (kind, name), candidates in unresolved]
+
+    def stats(self):
+        unresolved = self.unresolved_report()
+        return {**{f'{kind}_linked': len(self.links[kind]) for kind in KINDS},
+                "mismatches": len(self.mismatches),
+                "mismatched": self.mismatches[:50],
+                "fuzzy_matched": self.fuzzy_matches[:50],
+                "unresolved": len(unresolved),
+                "unresolved_names": unresolved[:50]}
@@ -4,8 +4,16 @@ import os
 from dotenv import load_dotenv
 from harvest.harvest_wrapper import HarvestAnalytics
 from float.float_wrapper import FloatAnalytics
+from float.float_journal import TaskJournal, FLOAT_JOURNAL_PATH
+from identity.identity_map import IdentityMap, IDENTITY_MAP_PATH
+from identity.fuzzy_index import FUZZY_THRESHOLD
 from gsheet.gsheet_wrapper import GoogleRunner
-# from .myforecast.forecast_wrapper import ForecastAnalytics
+from gsheet.sheet_schema import ENTRIES_SCHEMA
+from pipeline.run_metrics import start_run
+from pipeline.profiling import write_profiles
+from myforecast.forecast_wrapper import ForecastAnalytics
+from datetime import datetime, timedelta
+from variance.variance_analytics import VarianceAnalytics
 
 
 load_dotenv()
@@ -22,13 +30,28 @@ HARVEST_TOKEN = os.environ["HARVEST_TOKEN"]
 HARVEST_ACCOUNT_ID = os.environ["HARVEST_ACCOUNT_ID"]
 PAST_ENTRIES_LOOKUP = int(os.environ["PAST_ENTRIES_LOOKUP"])
 FLOAT_TOKEN = os.environ["FLOAT_TOKEN"]
-# FORECAST_SHEET = os.environ["FORECAST_SHEET"]
-# FORECAST_TOKEN = os.environ["FORECAST_TOKEN"]
-# FORECAST_ACCOUNT_ID = os.environ["FORECAST_ACCOUNT_ID"]
+FLOAT_JOURNAL = os.environ.get("FLOAT_JOURNAL", FLOAT_JOURNAL_PATH)
+AGGREGATE_TASKS = os.environ.get("AGGREGATE_TASKS", "false").lower() == "true"
+# last entries sheet row the offset based backfill posted before the journal existed, 0 if none
+JOURNAL_SEED_END_ROW = int(os.environ.get("JOURNAL_SEED_END_ROW", 53331))
+IDENTITY_MAP = os.environ.get("IDENTITY_MAP", IDENTITY_MAP_PATH)
+FUZZY_MATCH_THRESHOLD = float(os.environ.get("FUZZY_MATCH_THRESHOLD", FUZZY_THRESHOLD))
+# Forecast assignments and their variance with Harvest hours are exported only when their sheet is set
+FORECAST_SHEET = os.environ.get("FORECAST_SHEET")
+FORECAST_TOKEN = os.environ.get("FORECAST_TOKEN")
+FORECAST_ACCOUNT_ID = os.environ.get("FORECAST_ACCOUNT_ID")
+FORECAST_LOOKAHEAD = int(os.environ.get("FORECAST_LOOKAHEAD", 30))
+VARIANCE_SHEET = os.environ.get("VARIANCE_SHEET")
+VARIANCE_PERIOD = os.environ.get("VARIANCE_PERIOD", "week")
+
+
+def describe_candidates(candidates):
+    return [(candidate["name"], candidate["score"], candidate.get("vetoed")) for candidate in candidates]
 
 
 def main(event, context):
     logging.info(f'Payload input data is {event} and context {context}')
+    metrics = start_run()
     google_runner = GoogleRunner(SPREADSHEET_ID, CREDENTIALS_FILE, ENTRIES_SHEET, LOGS_SHEET,
                                  ROLES_SHEET, WEEKLY_TASKS_SHEET, PROJECTS_SHEET)
     weekly_entries = google_runner.get_weekly_entries()
@@ -43,21 +66,66 @@ def main(event, context):
     # updated_cells = google_runner.gsheet_append(ENTRIES_SHEET, new_rows)
     # google_runner.log_update(updated_cells, ENTRIES_SHEET, "entries")
     # projects_status = harvest_runner.get_project_rows()
-    # projects_range = f'{PROJECTS_SHEET}!A2:M'
-    # updated_cells = google_runner.gsheet_update(projects_range, projects_status)
+    # updated_cells = google_runner.update_projects(projects_status)
     # google_runner.log_update(updated_cells, PROJECTS_SHEET, "projects")
     harvest_users = harvest_runner.harvest_users
     harvest_projects = harvest_runner.harvest_projects
-    float_runner = FloatAnalytics(FLOAT_TOKEN, users=harvest_users, projects=harvest_projects)
+    float_runner = FloatAnalytics(FLOAT_TOKEN, users=harvest_users, projects=harvest_projects,
+                                  identity=IdentityMap(IDENTITY_MAP, FUZZY_MATCH_THRESHOLD))
+    for mismatch in float_runner.identity.mismatches:
+        if "conflict" in mismatch:
+            print(f'Not linked: {mismatch["kind"]} {mismatch["harvest_id"]} {mismatch["name"]}, Float id '
+                  f'{mismatch["conflict"]["float_id"]} already linked to {mismatch["conflict"]["harvest_id"]}')
+            continue
+        print(f'Not on Float: {mismatch["kind"]} {mismatch["harvest_id"]} {mismatch["name"]}, closest '
+              f'{describe_candidates(mismatch.get("candidates", []))}')
     float_runner.sync_people()
     float_runner.sync_projects()
     # float_runner.create_tasks_from_ghseet(new_rows)
-    new_rows = google_runner.read_gsheet_data(ENTRIES_SHEET)
-    float_runner.create_tasks_from_ghseet(new_rows[53331:])
-    # forecast_runner = ForecastAnalytics(FORECAST_ACCOUNT_ID, FORECAST_TOKEN)
-    # forecast_assignments = forecast_runner.get_forecast_assignments()
-    # updated_cells = google_runner.gsheet_append(FORECAST_SHEET, forecast_assignments)
-    # google_runner.log_update(updated_cells, FORECAST_SHEET, "entries")
+    # rows already created on Float are skipped through the journal, a rerun resumes where the last one stopped
+    journal = TaskJournal(FLOAT_JOURNAL)
+    if JOURNAL_SEED_END_ROW and not journal.summary('logged-time'):
+        seeded = journal.seed(google_runner.iter_gsheet_rows(ENTRIES_SHEET, end_row=JOURNAL_SEED_END_ROW,
+                                                             schema=ENTRIES_SCHEMA))
+        print(f'Float journal {FLOAT_JOURNAL} seeded with {seeded} rows posted up to row {JOURNAL_SEED_END_ROW}')
+    new_rows = list(google_runner.iter_gsheet_rows(ENTRIES_SHEET, schema=ENTRIES_SCHEMA))
+    # rows not final on the journal are checked against Float: posted by the Cloud Function, which doesn't
+    # journal them, left pending by an interrupted run, or failed or rejected after Float created the task
+    created_keys = journal.created_keys('logged-time')
+    unchecked_dates = [row[1] for row in new_rows if journal.row_key(row, 'logged-time') not in created_keys]
+    existing = None
+    if unchecked_dates:
+        existing = float_runner.get_logged_time_index(min(unchecked_dates), max(unchecked_dates))
+    float_runner.create_tasks_from_ghseet(new_rows, journal=journal, existing=existing, aggregate=AGGREGATE_TASKS)
+    print(f'Float journal: {journal.summary()}')
+    for unresolved in float_runner.identity.unresolved_report():
+        print(f'Unresolved {unresolved["kind"]} {unresolved["name"]}, closest '
+              f'{describe_candidates(unresolved["candidates"])}')
+    float_runner.identity.save()
+    journal.close()
+    forecast_assignments = None
+    forecast_start = (datetime.today() - timedelta(days=PAST_ENTRIES_LOOKUP)).strftime('%Y-%m-%d')
+    today = datetime.today().strftime('%Y-%m-%d')
+    if FORECAST_SHEET or VARIANCE_SHEET:
+        forecast_runner = ForecastAnalytics(FORECAST_ACCOUNT_ID, FORECAST_TOKEN)
+        forecast_end = (datetime.today() + timedelta(days=FORECAST_LOOKAHEAD)).strftime('%Y-%m-%d')
+        if FORECAST_SHEET:
+            forecast_assignments, updated_cells = forecast_runner.export_assignments(google_runner, FORECAST_SHEET,
+                                                                                     forecast_start, forecast_end)
+            google_runner.log_update(updated_cells, FORECAST_SHEET, "forecast")
+        else:
+            forecast_assignments = forecast_runner.get_forecast_assignments(forecast_start, today)
+    if VARIANCE_SHEET and forecast_assignments is not None:
+        # planned and actual hours of the past days only, the ones to come having nothing logged yet
+        planned_rows = [row for row in forecast_assignments if row[1] <= today]
+        harvest_entries = [row for row in harvest_runner.get_historical_data() or []
+                           if forecast_start <= row[1] <= today]
+        variance_runner = VarianceAnalytics(planned_rows, harvest_entries, period=VARIANCE_PERIOD)
+        updated_cells = variance_runner.export_variance(google_runner, VARIANCE_SHEET)
+        google_runner.log_update(updated_cells, VARIANCE_SHEET, "variance")
+    google_runner.run_log.flush()
+    metrics.emit(os.environ.get("RUN_REPORT_PATH"), os.environ.get("PROMETHEUS_TEXTFILE"))
+    write_profiles()
 
 
 if __name__ == "__main__":
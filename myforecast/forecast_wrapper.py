@@ -1,4 +1,6 @@
-import forecast
+import threading
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 
 
 class ForecastAnalytics:
@@ -9,21 +11,44 @@ class ForecastAnalytics:
     def __init__(self, forecast_account, forecast_token):
         self.forecast_account = forecast_account
         self.forecast_token = forecast_token
+        # imported on first use, keeping pyforecast off the runs that don't export Forecast assignments
+        import forecast
+        self.api = forecast.Api(account_id=self.forecast_account, auth_token=self.forecast_token)
+        self.reference_lock = threading.Lock()
+        self.reference_data = None
 
-    def get_forecast_assignments(self):
+    def get_reference_data(self):
         """
-        Get Forecast user assignments
+        Get Forecast clients, projects and users, fetched concurrently once per instance
+        :return: (projects, users) dicts
+        """
+        with self.reference_lock:
+            if self.reference_data is None:
+                with ThreadPoolExecutor(max_workers=3) as executor:
+                    clients = executor.submit(self.get_forecast_clients)
+                    projects = executor.submit(self.get_forecast_projects, clients)
+                    users = executor.submit(self.get_forecast_users)
+                    self.reference_data = (projects.result(), users.result())
+            return self.reference_data
+
+    def get_forecast_assignments(self, start_date=None, end_date=None):
+        """
+        Get Forecast user assignments, one row per assigned working day
+        :param start_date: 'YYYY-MM-DD' window start, pushed down to the Forecast API
+        :param end_date: 'YYYY-MM-DD' window end, pushed down to the Forecast API
         :return: assignments as rows to be inserted in gsheets
         """
         user_assignments = []
-        projects = self.get_forecast_projects()
-        users = self.get_forecast_users()
+        projects, users = self.get_reference_data()
+        window = {}
+        if start_date:
+            window["start_date"] = start_date
+        if end_date:
+            window["end_date"] = end_date
         try:
-            print('Getting Forecast Assignments')
-            api = forecast.Api(account_id=self.forecast_account, auth_token=self.forecast_token)
-            for assignment in api.get_assignments():
+            print(f'Getting Forecast Assignments {window}')
+            for assignment in self.api.get_assignments(**window):
                 assignment_id = assignment.id
-                date = assignment.start_date
                 hours = assignment.allocation / 3600
                 project_data = projects[assignment.project_id]
                 project = project_data["name"]
@@ -31,23 +56,64 @@ class ForecastAnalytics:
                 client = project_data["client"]
                 staff_member = users[assignment.person_id]["name"]
                 role = users[assignment.person_id]["role"]
-                row = [assignment_id, date, staff_member, role, client, project, project_code, hours]
-                user_assignments.append(row)
+                first_day = str(assignment.start_date)
+                last_day = str(assignment.end_date or assignment.start_date)
+                first_day = max(first_day, start_date) if start_date else first_day
+                last_day = min(last_day, end_date) if end_date else last_day
+                for day in self.working_days(first_day, last_day):
+                    row = [assignment_id, day, staff_member, role, client, project, project_code, hours]
+                    user_assignments.append(row)
             return user_assignments
         except Exception as e:
             print(f'Error while getting Forecast data. Error was {e}')
 
-    def get_forecast_projects(self):
+    def export_assignments(self, google_runner, sheet, start_date=None, end_date=None):
+        """
+        Write the assignments of a window on a sheet, rows being matched on assignment and day so a later export
+        only sends the cells that changed and the new rows
+        :param google_runner: GoogleRunner of the spreadsheet
+        :param sheet: sheet name, its first row being a header
+        :param start_date: 'YYYY-MM-DD' window start
+        :param end_date: 'YYYY-MM-DD' window end
+        :return: (assignments rows, updated cells count), rows being None if Forecast couldn't be read
+        """
+        assignments = self.get_forecast_assignments(start_date, end_date)
+        if assignments is None:
+            return None, 0
+        return assignments, google_runner.gsheet_diff_write(sheet, assignments, key_columns=(0, 1))
+
+    @staticmethod
+    def working_days(start_date, end_date):
+        """
+        Get the Monday to Friday days of a date range, Forecast allocations being per working day
+        :param start_date: 'YYYY-MM-DD'
+        :param end_date: 'YYYY-MM-DD', inclusive
+        :return: 'YYYY-MM-DD' days list
+        """
+        first = date.fromisoformat(start_date).toordinal()
+        last = date.fromisoformat(end_date).toordinal()
+        days = []
+        for ordinal in range(first, last + 1):
+            # ordinal 1 (0001-01-01) is a Monday
+            if (ordinal - 1) % 7 < 5:
+                days.append(date.fromordinal(ordinal).isoformat())
+        return days
+
+    def get_forecast_projects(self, clients=None):
         """
         Get Forecast projects
+        :param clients: clients dict, or a future resolving to it, fetched if not given
         :return: projects dicts with its info: name, client, code
         """
         projects = {}
         try:
-            clients = self.get_forecast_clients()
             print('Getting Forecast Projects')
-            api = forecast.Api(account_id=self.forecast_account, auth_token=self.forecast_token)
-            for project in api.get_projects():
+            forecast_projects = self.api.get_projects()
+            if clients is None:
+                clients = self.get_forecast_clients()
+            elif hasattr(clients, 'result'):
+                clients = clients.result()
+            for project in forecast_projects:
                 project_id = project.id
                 name = project.name
                 code = project.code
@@ -65,8 +131,7 @@ class ForecastAnalytics:
         clients = {}
         try:
             print('Getting Forecast Clients')
-            api = forecast.Api(account_id=self.forecast_account, auth_token=self.forecast_token)
-            for client in api.get_clients():
+            for client in self.api.get_clients():
                 client_id = client.id
                 name = client.name
                 clients.update({client_id: name})
@@ -82,8 +147,7 @@ class ForecastAnalytics:
         users = {}
         try:
             print('Getting Forecast Users')
-            api = forecast.Api(account_id=self.forecast_account, auth_token=self.forecast_token)
-            for person in api.get_people():
+            for person in self.api.get_people():
                 person_id = person.id
                 full_name = person.first_name + ' ' + person.last_name
                 role = person.roles[0] if person.roles else None
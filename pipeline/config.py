@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+from identity.fuzzy_index import FUZZY_THRESHOLD
+
+
+REQUIRED_VARS = ("SPREADSHEET_ID", "CREDENTIALS_FILE", "ENTRIES_SHEET", "LOGS_SHEET", "ROLES_SHEET",
+                 "WEEKLY_TASKS_SHEET", "PROJECTS_SHEET", "HARVEST_TOKEN", "HARVEST_ACCOUNT_ID",
+                 "PAST_ENTRIES_LOOKUP", "FLOAT_TOKEN")
+
+
+class ConfigError(ValueError):
+    """
+    Raised when environment variables are missing or invalid, listing every problem at once
+    """
+
+
+class PipelineConfig:
+    """
+    A class to load and validate the pipeline settings from environment variables
+    """
+
+    def __init__(self, environ=None):
+        """
+        :param environ: variables mapping, os.environ by default
+        :raise ConfigError: if a required variable is missing or a variable has an invalid value
+        """
+        environ = os.environ if environ is None else environ
+        errors = [f'{name} is not set' for name in REQUIRED_VARS if not environ.get(name)]
+        self.spreadsheet_id = environ.get("SPREADSHEET_ID")
+        self.credentials_file = environ.get("CREDENTIALS_FILE")
+        self.entries_sheet = environ.get("ENTRIES_SHEET")
+        self.logs_sheet = environ.get("LOGS_SHEET")
+        self.roles_sheet = environ.get("ROLES_SHEET")
+        self.weekly_tasks_sheet = environ.get("WEEKLY_TASKS_SHEET")
+        self.projects_sheet = environ.get("PROJECTS_SHEET")
+        self.harvest_token = environ.get("HARVEST_TOKEN")
+        self.harvest_account_id = environ.get("HARVEST_ACCOUNT_ID")
+        self.float_token = environ.get("FLOAT_TOKEN")
+        self.past_entries_lookup = self.int_var(environ, "PAST_ENTRIES_LOOKUP", None, errors)
+        self.stream_entries = environ.get("STREAM_ENTRIES", "false").lower() == "true"
+        self.aggregate_tasks = environ.get("AGGREGATE_TASKS", "false").lower() == "true"
+        self.stream_queue_size = self.int_var(environ, "STREAM_QUEUE_SIZE", 500, errors)
+        self.warm_cache_ttl = self.int_var(environ, "WARM_CACHE_TTL", 300, errors, minimum=0)
+        self.identity_map_path = environ.get("IDENTITY_MAP")
+        self.fuzzy_threshold = self.ratio_var(environ, "FUZZY_MATCH_THRESHOLD", FUZZY_THRESHOLD, errors)
+        self.run_report_path = environ.get("RUN_REPORT_PATH")
+        self.prometheus_textfile = environ.get("PROMETHEUS_TEXTFILE")
+        if errors:
+            raise ConfigError(f'Invalid configuration: {"; ".join(errors)}')
+
+    @staticmethod
+    def int_var(environ, name, default, errors, minimum=1):
+        value = environ.get(name)
+        if not value:
+            return default
+        try:
+            number = int(value)
+        except ValueError:
+            errors.append(f'{name} must be an integer, got {value!r}')
+            return default
+        if number < minimum:
+            errors.append(f'{name} must be at least {minimum}, got {number}')
+        return number
+
+    @staticmethod
+    def ratio_var(environ, name, default, errors):
+        value = environ.get(name)
+        if not value:
+            return default
+        try:
+            ratio = float(value)
+        except ValueError:
+            errors.append(f'{name} must be a number, got {value!r}')
+            return default
+        if not 0 <= ratio <= 1:
+            errors.append(f'{name} must be between 0 and 1, got {ratio}')
+        return ratio
+
+    def runner_args(self):
+        """
+        GoogleRunner positional arguments
+        """
+        return (self.spreadsheet_id, self.credentials_file, self.entries_sheet, self.logs_sheet, self.roles_sheet,
+                self.weekly_tasks_sheet, self.projects_sheet)
+
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def load_config(reload=False):
+    """
+    Load the pipeline config on first use, kept for the next runs of a warm instance
+    :param reload: read the environment again
+    :return: PipelineConfig
+    """
+    global _config
+    with _config_lock:
+        if _config is None or reload:
+            logging.info('Loading ENV vars')
+            _config = PipelineConfig()
+        return _config
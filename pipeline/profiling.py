@@ -0,0 +1,123 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+
+PROFILE_DIR = "pipeline_profiles"
+PROFILE_TOP = 25
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+# a single cProfile profile can be enabled at a time in the process, Python 3.12 raising on a second one
+_active_lock = threading.Lock()
+_skipped = {}
+_local = threading.local()
+
+
+def profiling_enabled():
+    """
+    Read PIPELINE_PROFILE on every call, so a warm Cloud Function instance follows the current config
+    """
+    return os.environ.get("PIPELINE_PROFILE", "").lower() == "cprofile"
+
+
+@contextmanager
+def profiled(stage):
+    """
+    Profile a pipeline stage with cProfile when PIPELINE_PROFILE=cprofile. A stage started within another one
+    on the same thread, e.g. gsheet.get_missing_rows within new_rows, pauses the outer profile and gets its own,
+    the run profile adding them all up. StageGraph runs stages one at a time while profiling, given cProfile
+    only sees the thread it was enabled on: work a stage hands to executor threads is not in its profile, and a
+    stage started on another thread while one is profiled runs unprofiled and is listed by write_profiles
+    :param stage: stage name, used for the dumped .prof file
+    """
+    if not profiling_enabled():
+        yield
+        return
+    stack = getattr(_local, "stack", None)
+    if not stack and not _active_lock.acquire(blocking=False):
+        with _profiles_lock:
+            _skipped[stage] = _skipped.get(stage, 0) + 1
+        yield
+        return
+    if stack is None:
+        stack = _local.stack = []
+    outer = stack[-1] if stack else None
+    profile = cProfile.Profile()
+    stack.append(profile)
+    try:
+        if outer:
+            outer.disable()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with _profiles_lock:
+                _profiles.setdefault(stage, []).append(profile)
+    finally:
+        stack.pop()
+        if outer:
+            outer.enable()
+        else:
+            _active_lock.release()
+
+
+def profile_stage(stage):
+    """
+    Decorator profiling every call of a method as the given stage
+    """
+    def decorator(func):
+        @wraps(func)
+        def profiled_func(*args, **kwargs):
+            with profiled(stage):
+                return func(*args, **kwargs)
+        return profiled_func
+    return decorator
+
+
+def write_profiles(top=None, profile_dir=None):
+    """
+    Dump one .prof file per stage and print the top hot functions per stage and for the whole run, the run
+    profile adding up the stage ones
+    :param top: functions listed per summary, PIPELINE_PROFILE_TOP by default
+    :param profile_dir: directory for the .prof files, readable with pstats or snakeviz, PIPELINE_PROFILE_DIR by
+    default
+    :return: summary text, None if profiling is disabled
+    """
+    top = top or int(os.environ.get("PIPELINE_PROFILE_TOP", PROFILE_TOP))
+    profile_dir = profile_dir or os.environ.get("PIPELINE_PROFILE_DIR", PROFILE_DIR)
+    with _profiles_lock:
+        profiles = dict(_profiles)
+        skipped = dict(_skipped)
+        _profiles.clear()
+        _skipped.clear()
+    if not profiles:
+        return None
+    os.makedirs(profile_dir, exist_ok=True)
+    summary = io.StringIO()
+    if skipped:
+        summary.write(f'Stages run unprofiled while another one was profiled: '
+                      f'{", ".join(f"{stage} x{count}" for stage, count in sorted(skipped.items()))}\n')
+    run_stats = None
+    for stage, stage_profiles in sorted(profiles.items()):
+        stats = pstats.Stats(*stage_profiles, stream=summary)
+        file_name = re.sub(r'[^\w.-]', '_', stage)
+        stats.dump_stats(os.path.join(profile_dir, f'{file_name}.prof'))
+        summary.write(f'\n=== {stage}: top {top} functions by own time ===\n')
+        stats.sort_stats('tottime').print_stats(top)
+        if run_stats is None:
+            run_stats = pstats.Stats(*stage_profiles, stream=summary)
+        else:
+            run_stats.add(*stage_profiles)
+    summary.write(f'\n=== run: top {top} functions by own time ===\n')
+    run_stats.sort_stats('tottime').print_stats(top)
+    run_stats.dump_stats(os.path.join(profile_dir, 'run.prof'))
+    text = summary.getvalue()
+    print(text)
+    return text
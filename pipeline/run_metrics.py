@@ -0,0 +1,224 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+
+ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def percentile(sorted_values, ratio):
+    """
+    Nearest rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(ratio * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class RunMetrics:
+    """
+    A class to collect per stage spans and per endpoint request metrics of a run
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.started_monotonic = time.monotonic()
+        self.spans = []
+        self.endpoints = {}
+        self.retries = {}
+        self.sleeps = {}
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time a block of the run, e.g. a pipeline stage
+        :param name: span name
+        """
+        started = time.monotonic()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e.__class__.__name__
+            raise
+        finally:
+            with self.lock:
+                self.spans.append({"name": name,
+                                   "start": round(started - self.started_monotonic, 3),
+                                   "seconds": round(time.monotonic() - started, 3),
+                                   "thread": threading.current_thread().name,
+                                   "error": error})
+
+    def record_request(self, service, endpoint, seconds, status, bytes_sent=0, bytes_received=0):
+        """
+        Record an API request
+        :param service: harvest, float, sheets
+        :param endpoint: endpoint path, ids replaced by {id}
+        :param seconds: request latency
+        :param status: HTTP status code
+        """
+        with self.lock:
+            stats = self.endpoints.setdefault((service, endpoint), {"latencies": [], "bytes_sent": 0,
+                                                                    "bytes_received": 0, "statuses": {}})
+            stats["latencies"].append(seconds)
+            stats["bytes_sent"] += bytes_sent or 0
+            stats["bytes_received"] += bytes_received or 0
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+
+    def record_retry(self, service):
+        with self.lock:
+            self.retries[service] = self.retries.get(service, 0) + 1
+
+    def record_sleep(self, reason, seconds):
+        with self.lock:
+            self.sleeps[reason] = self.sleeps.get(reason, 0) + seconds
+
+    def sleep(self, seconds, reason):
+        """
+        Sleep, accounting the time to a rate limit reason
+        """
+        self.record_sleep(reason, seconds)
+        time.sleep(seconds)
+
+    def report(self):
+        """
+        Build the structured run report
+        :return: report dict
+        """
+        with self.lock:
+            endpoints = []
+            for (service, endpoint), stats in sorted(self.endpoints.items()):
+                latencies = sorted(stats["latencies"])
+                endpoints.append({"service": service,
+                                  "endpoint": endpoint,
+                                  "requests": len(latencies),
+                                  "statuses": {str(status): count for status, count in stats["statuses"].items()},
+                                  "bytes_sent": stats["bytes_sent"],
+                                  "bytes_received": stats["bytes_received"],
+                                  "latency_seconds": {"p50": percentile(latencies, 0.5),
+                                                      "p90": percentile(latencies, 0.9),
+                                                      "p99": percentile(latencies, 0.99),
+                                                      "max": latencies[-1] if latencies else None,
+                                                      "total": round(sum(latencies), 3)}})
+            return {"started": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                    "wall_seconds": round(time.monotonic() - self.started_monotonic, 3),
+                    "spans": sorted(self.spans, key=lambda span: span["start"]),
+                    "endpoints": endpoints,
+                    "retries": dict(self.retries),
+                    "sleep_seconds": {reason: round(seconds, 3) for reason, seconds in self.sleeps.items()}}
+
+    def to_prometheus(self, report=None):
+        """
+        Render the run report in Prometheus text exposition format, one group per metric family
+        :return: text
+        """
+        report = report or self.report()
+        families = {
+            "run_seconds": [("", report["wall_seconds"])],
+            "run_timestamp_seconds": [("", round(self.started, 3))],
+            "stage_seconds": [(f'stage="{span["name"]}"', span["seconds"]) for span in report["spans"]],
+            "requests_total": [],
+            "request_latency_seconds": [],
+            "bytes_received_total": [],
+            "bytes_sent_total": [],
+            "retries_total": [(f'service="{service}"', count) for service, count in report["retries"].items()],
+            "sleep_seconds_total": [(f'reason="{reason}"', seconds)
+                                    for reason, seconds in report["sleep_seconds"].items()]
+        }
+        for endpoint in report["endpoints"]:
+            labels = f'service="{endpoint["service"]}",endpoint="{endpoint["endpoint"]}"'
+            families["requests_total"].append((labels, endpoint["requests"]))
+            for quantile, key in (("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99")):
+                families["request_latency_seconds"].append((f'{labels},quantile="{quantile}"',
+                                                            endpoint["latency_seconds"][key]))
+            families["request_latency_seconds"].append((labels, endpoint["latency_seconds"]["total"], "_sum"))
+            families["request_latency_seconds"].append((labels, endpoint["requests"], "_count"))
+            families["bytes_received_total"].append((labels, endpoint["bytes_received"]))
+            families["bytes_sent_total"].append((labels, endpoint["bytes_sent"]))
+        lines = []
+        for family, samples in families.items():
+            name = f"harvest_wrapper_{family}"
+            if family.endswith("_total"):
+                metric_type = "counter"
+            elif family == "request_latency_seconds":
+                metric_type = "summary"
+            else:
+                metric_type = "gauge"
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value, *suffix in samples:
+                sample = name + "".join(suffix)
+                lines.append(f"{sample}{{{labels}}} {value}" if labels else f"{sample} {value}")
+        return "\n".join(lines) + "\n"
+
+    def emit(self, report_path=None, prometheus_path=None):
+        """
+        Print the run report as a single JSON line, optionally writing it and a Prometheus textfile
+        :param report_path: JSON report file
+        :param prometheus_path: node_exporter textfile collector file, written atomically
+        :return: report dict
+        """
+        report = self.report()
+        print(f'Run report: {json.dumps(report)}')
+        if report_path:
+            with open(report_path, 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+        if prometheus_path:
+            temp_path = f'{prometheus_path}.tmp'
+            with open(temp_path, 'w') as prometheus_file:
+                prometheus_file.write(self.to_prometheus(report))
+            os.replace(temp_path, prometheus_path)
+        return report
+
+
+_current = RunMetrics()
+
+
+def current_metrics():
+    """
+    Get the metrics of the run in progress
+    """
+    return _current
+
+
+def start_run():
+    """
+    Start collecting metrics for a new run
+    :return: RunMetrics
+    """
+    global _current
+    _current = RunMetrics()
+    return _current
+
+
+def endpoint_of(url):
+    """
+    Get an endpoint name from a request url, numeric ids replaced by {id}
+    """
+    return ID_SEGMENT.sub('/{id}', urlparse(url).path)
+
+
+def instrumented_session(service):
+    """
+    Get a requests session recording every response on the current run metrics
+    :param service: service name the requests are accounted to
+    :return: requests.Session
+    """
+    import requests
+
+    def record_response(response, *args, **kwargs):
+        body = response.request.body
+        current_metrics().record_request(service, endpoint_of(response.request.url),
+                                         response.elapsed.total_seconds(), response.status_code,
+                                         bytes_sent=len(body) if body else 0,
+                                         bytes_received=len(response.content))
+
+    session = requests.Session()
+    session.hooks['response'].append(record_response)
+    return session
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+from pipeline.run_metrics import current_metrics
+from pipeline.profiling import profiled, profiling_enabled
+
+
+class StageGraph:
+    """
+    A class to run pipeline stages as a dependency graph, independent stages running concurrently
+    """
+
+    def __init__(self, max_workers=6, run_log=None):
+        self.max_workers = max_workers
+        self.run_log = run_log
+        self.stages = {}
+        # callables run when a stage fails, e.g. to release stages blocked on a failed one outside the graph
+        self.on_failure = []
+
+    def add(self, name, func, deps=()):
+        """
+        Add a stage to the graph
+        :param name: stage name, its result is passed to dependent stages as a keyword argument of that name
+        :param func: callable taking one keyword argument per dependency
+        :param deps: names of the stages that must finish first
+        :return: None
+        """
+        if name in self.stages:
+            raise ValueError(f'Stage {name} is already defined')
+        self.stages[name] = (func, tuple(deps))
+
+    def validate(self):
+        """
+        Check every dependency exists and the graph has no cycles
+        :return: stage names in a valid execution order
+        """
+        for name, (_, deps) in self.stages.items():
+            missing = [dep for dep in deps if dep not in self.stages]
+            if missing:
+                raise ValueError(f'Stage {name} depends on undefined stages {missing}')
+        order = []
+        done = set()
+        remaining = dict(self.stages)
+        while remaining:
+            ready = [name for name, (_, deps) in remaining.items() if done.issuperset(deps)]
+            if not ready:
+                raise ValueError(f'Stages {sorted(remaining)} have cyclic dependencies')
+            for name in ready:
+                order.append(name)
+                done.add(name)
+                del remaining[name]
+        return order
+
+    def run_stage(self, name, func, kwargs):
+        timer = self.run_log.timed(name) if self.run_log else nullcontext()
+        with timer, current_metrics().span(name), profiled(name):
+            return func(**kwargs)
+
+    def run(self):
+        """
+        Run every stage as soon as its dependencies are done, one at a time when profiling so every stage gets
+        its own cProfile profile
+        :return: results dict by stage name
+        """
+        self.validate()
+        results = {}
+        remaining = dict(self.stages)
+        pending = {}
+        max_workers = 1 if profiling_enabled() else self.max_workers
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while remaining or pending:
+                ready = [name for name, (_, deps) in remaining.items() if all(dep in results for dep in deps)]
+                for name in ready:
+                    func, deps = remaining.pop(name)
+                    kwargs = {dep: results[dep] for dep in deps}
+                    pending[executor.submit(self.run_stage, name, func, kwargs)] = name
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    error = future.exception()
+                    if error:
+                        print(f'Stage {name} failed, cancelling {sorted(remaining)}. Error was {error}')
+                        for other in pending:
+                            other.cancel()
+                        for release in self.on_failure:
+                            release()
+                        raise error
+                    results[name] = future.result()
+        return results
@@ -0,0 +1,63 @@
+from queue import Queue, Empty, Full
+
+
+_DONE = object()
+
+
+class RowStream:
+    """
+    A class to hand rows from a producer thread to a consumer thread through a bounded queue
+    """
+
+    def __init__(self, maxsize=500, timeout=1):
+        self.queue = Queue(maxsize=maxsize)
+        self.timeout = timeout
+        self.consumer_done = False
+        self.produced = 0
+
+    def put(self, row):
+        """
+        Hand a row to the consumer, waiting while the queue is full
+        :return: False if the consumer stopped reading and the row was dropped
+        """
+        while not self.consumer_done:
+            try:
+                self.queue.put(row, timeout=self.timeout)
+                self.produced += 1
+                return True
+            except Full:
+                continue
+        return False
+
+    def close(self):
+        """
+        Signal the consumer there are no more rows
+        :return: None
+        """
+        while not self.consumer_done:
+            try:
+                self.queue.put(_DONE, timeout=self.timeout)
+                return
+            except Full:
+                continue
+
+    def stop(self):
+        """
+        Stop the stream from the consumer side, e.g. when it failed before reading, so the producer puts return
+        False instead of waiting on a full queue
+        :return: None
+        """
+        self.consumer_done = True
+
+    def __iter__(self):
+        try:
+            while True:
+                try:
+                    row = self.queue.get(timeout=self.timeout)
+                except Empty:
+                    continue
+                if row is _DONE:
+                    return
+                yield row
+        finally:
+            self.consumer_done = True
@@ -0,0 +1,88 @@
+import threading
+from time import monotonic
+
+
+WARM_CACHE_TTL = 300
+
+
+class WarmCache:
+    """
+    A class to keep constructed clients and reference data between the invocations of a warm instance,
+    each entry expiring after a TTL
+    """
+
+    def __init__(self, ttl=WARM_CACHE_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.key_locks = {}
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key, factory, ttl=None):
+        """
+        Get a cached value, building it with factory when missing or expired
+        :param key: entry name
+        :param factory: callable building the value, called once even if several threads ask for it
+        :param ttl: seconds the value is kept, the cache TTL by default, 0 disables caching
+        :return: value
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self.key_lock(key):
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry and monotonic() < entry[1]:
+                    self.hits[key] = self.hits.get(key, 0) + 1
+                    return entry[0]
+                self.misses[key] = self.misses.get(key, 0) + 1
+            value = factory()
+            if ttl > 0:
+                with self.lock:
+                    self.entries[key] = (value, monotonic() + ttl)
+            return value
+
+    def invalidate(self, *keys):
+        """
+        Drop cached entries, every entry if no key is given
+        :return: dropped keys
+        """
+        with self.lock:
+            keys = list(self.entries) if not keys else [key for key in keys if key in self.entries]
+            for key in keys:
+                del self.entries[key]
+        return keys
+
+    def stats(self):
+        """
+        Get hit and miss counts since the last reset, by key
+        :return: stats dict
+        """
+        with self.lock:
+            keys = sorted(set(self.hits) | set(self.misses))
+            now = monotonic()
+            expires_in = {key: round(expires - now, 1) for key, (_, expires) in self.entries.items()}
+            return {"hits": sum(self.hits.values()),
+                    "misses": sum(self.misses.values()),
+                    "ttl": self.ttl,
+                    "keys": {key: {"hits": self.hits.get(key, 0),
+                                   "misses": self.misses.get(key, 0),
+                                   "expires_in": expires_in.get(key)} for key in keys}}
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = {}
+            self.misses = {}
+
+
+_cache = WarmCache()
+
+
+def get_warm_cache():
+    """
+    Get the cache shared by every invocation of this instance
+    """
+    return _cache
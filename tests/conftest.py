@@ -0,0 +1,56 @@
+import os
+import re
+import sys
+import pytest
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from gsheet.gsheet_wrapper import GoogleRunner  # noqa: E402
+
+
+CELL = re.compile(r'^(?P<sheet>[^!]+)!(?P<column>[A-Z]+)(?P<row>\d+)$')
+
+
+class SheetRunner(GoogleRunner):
+    """
+    GoogleRunner over in-memory sheets, keeping the value ranges of every batch update it was sent
+    """
+
+    def __init__(self, sheets):
+        """
+        :param sheets: {sheet name: rows}, the first row being the header
+        """
+        self.sheets = sheets
+        self.updates = []
+
+    def read_gsheet_data(self, sheet_range, value_render_option='FORMATTED_VALUE',
+                         date_time_render_option='FORMATTED_STRING'):
+        return [list(row) for row in self.sheets[sheet_range]]
+
+    def gsheet_batch_update(self, data):
+        if not data:
+            return None
+        self.updates.append(data)
+        cells = 0
+        for value_range in data:
+            match = CELL.match(value_range['range'])
+            rows = self.sheets[match['sheet']]
+            first_column = sum((ord(letter) - 64) * 26 ** power
+                               for power, letter in enumerate(reversed(match['column']))) - 1
+            for offset, values in enumerate(value_range['values']):
+                row_index = int(match['row']) - 1 + offset
+                while len(rows) <= row_index:
+                    rows.append([])
+                row = rows[row_index]
+                row.extend([None] * (first_column + len(values) - len(row)))
+                row[first_column:first_column + len(values)] = values
+                cells += len(values)
+        return cells
+
+
+@pytest.fixture
+def sheet_runner():
+    return SheetRunner
@@ -0,0 +1,53 @@
+import threading
+from types import SimpleNamespace
+from myforecast.forecast_wrapper import ForecastAnalytics
+
+
+HEADER = ['assignment_id', 'date', 'person', 'role', 'client', 'project', 'code', 'hours']
+
+
+def forecast_runner(assignments):
+    """
+    ForecastAnalytics reading the given assignments, skipping the pyforecast client __init__ makes
+    """
+    runner = ForecastAnalytics.__new__(ForecastAnalytics)
+    runner.api = SimpleNamespace(get_assignments=lambda **window: assignments)
+    runner.reference_lock = threading.Lock()
+    runner.reference_data = ({10: {"name": "Website", "code": "WEB", "client": "Acme"}},
+                             {20: {"name": "Ada Lovelace", "role": "Engineer"}})
+    return runner
+
+
+def assignment(assignment_id, start_date, end_date, hours):
+    return SimpleNamespace(id=assignment_id, allocation=hours * 3600, project_id=10, person_id=20,
+                           start_date=start_date, end_date=end_date)
+
+
+def test_second_export_writes_only_changed_rows(sheet_runner):
+    google_runner = sheet_runner({'Forecast': [HEADER]})
+    # Monday to Wednesday and Thursday to Friday
+    first = [assignment(1, '2021-03-01', '2021-03-03', 4), assignment(2, '2021-03-04', '2021-03-05', 8)]
+    rows, updated_cells = forecast_runner(first).export_assignments(google_runner, 'Forecast', '2021-03-01',
+                                                                    '2021-03-05')
+    assert len(rows) == 5
+    assert updated_cells == 5 * len(HEADER)
+    assert google_runner.sheets['Forecast'][1:] == rows
+
+    google_runner.updates.clear()
+    _, updated_cells = forecast_runner(first).export_assignments(google_runner, 'Forecast', '2021-03-01',
+                                                                 '2021-03-05')
+    assert updated_cells is None
+    assert google_runner.updates == []
+
+    # assignment 2 hours change and a third one is added on the Friday
+    second = first[:1] + [assignment(2, '2021-03-04', '2021-03-05', 6), assignment(3, '2021-03-05', None, 2)]
+    rows, updated_cells = forecast_runner(second).export_assignments(google_runner, 'Forecast', '2021-03-01',
+                                                                     '2021-03-05')
+    assert google_runner.updates == [[
+        {'range': 'Forecast!H5', 'values': [[6.0]]},
+        {'range': 'Forecast!H6', 'values': [[6.0]]},
+        {'range': 'Forecast!A7', 'values': [[3, '2021-03-05', 'Ada Lovelace', 'Engineer', 'Acme', 'Website',
+                                               'WEB', 2.0]]},
+    ]]
+    assert updated_cells == 2 + len(HEADER)
+    assert google_runner.sheets['Forecast'][1:] == rows
@@ -0,0 +1,59 @@
+from variance.variance_analytics import VarianceAnalytics
+
+
+HEADER = ['period', 'person', 'code', 'project', 'planned', 'actual', 'variance', 'variance %', 'status']
+
+
+def forecast_row(day, person, project, code, hours):
+    return [1, day, person, 'Engineer', 'Acme', project, code, hours]
+
+
+def harvest_row(day, person, project, code, hours):
+    return [1, day, person, 'Engineer', 'Acme', 'Acme', project, code, 'Development', True, 'notes', hours]
+
+
+FORECAST_ROWS = [
+    forecast_row('2021-03-01', 'Ada', 'Website', 'WEB', 4),
+    forecast_row('2021-03-02', 'Ada', 'Website', 'WEB', 4),
+    forecast_row('2021-03-03', 'Ada', 'App', 'APP', 8),
+    forecast_row('2021-03-01', 'Bob', 'Website', 'WEB', 8),
+]
+HARVEST_ROWS = [
+    harvest_row('2021-03-01', 'Ada', 'Website', 'WEB', 5),
+    harvest_row('2021-03-05', 'Ada', 'Website', 'WEB', 5),
+    harvest_row('2021-03-03', 'Ada', 'App', 'APP', 4),
+    harvest_row('2021-03-04', 'Ada', 'Support', 'OPS', 3),
+    harvest_row('2021-03-08', 'Ada', 'Website', 'WEB', 2),
+    harvest_row('2021-03-02', 'Bob', 'Website', 'WEB', 8.4),
+]
+
+
+def test_variance_rows_join_person_code_and_week():
+    rows = VarianceAnalytics(FORECAST_ROWS, HARVEST_ROWS, period="week").get_variance_rows()
+    assert rows == [
+        ['2021-03-01', 'Ada', 'APP', 'App', 8, 4, -4, -0.5, 'UNDER'],
+        ['2021-03-01', 'Ada', 'OPS', 'Support', 0, 3, 3, None, 'UNPLANNED'],
+        ['2021-03-01', 'Ada', 'WEB', 'Website', 8, 10, 2, 0.25, 'OVER'],
+        ['2021-03-01', 'Bob', 'WEB', 'Website', 8, 8.4, 0.4, 0.05, 'ON PLAN'],
+        ['2021-03-08', 'Ada', 'WEB', 'Website', 0, 2, 2, None, 'UNPLANNED'],
+    ]
+
+
+def test_variance_rows_not_logged_by_day():
+    rows = VarianceAnalytics(FORECAST_ROWS[:2], [], period="day").get_variance_rows()
+    assert rows == [
+        ['2021-03-01', 'Ada', 'WEB', 'Website', 4, 0, -4, -1.0, 'NOT LOGGED'],
+        ['2021-03-02', 'Ada', 'WEB', 'Website', 4, 0, -4, -1.0, 'NOT LOGGED'],
+    ]
+
+
+def test_second_export_writes_only_changed_rows(sheet_runner):
+    google_runner = sheet_runner({'Variance': [HEADER]})
+    updated_cells = VarianceAnalytics(FORECAST_ROWS, HARVEST_ROWS).export_variance(google_runner, 'Variance')
+    assert updated_cells == 5 * len(HEADER)
+
+    google_runner.updates.clear()
+    # Bob logs the rest of his planned hours
+    harvest_rows = HARVEST_ROWS[:-1] + [harvest_row('2021-03-02', 'Bob', 'Website', 'WEB', 8)]
+    VarianceAnalytics(FORECAST_ROWS, harvest_rows).export_variance(google_runner, 'Variance')
+    assert google_runner.updates == [[{'range': 'Variance!F5', 'values': [[8, 0, 0.0]]}]]
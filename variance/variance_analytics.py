@@ -0,0 +1,91 @@
+from datetime import date, timedelta
+
+
+class VarianceAnalytics:
+    """
+    A class to compare planned Forecast hours with actual Harvest hours
+    """
+
+    def __init__(self, forecast_rows, harvest_rows, period="week", tolerance=0.1):
+        """
+        :param forecast_rows: ForecastAnalytics.get_forecast_assignments rows, one per day
+        :param harvest_rows: HarvestAnalytics.get_row_list rows
+        :param period: "day" or "week", weeks starting on Monday
+        :param tolerance: variance ratio still considered on plan
+        """
+        self.forecast_rows = forecast_rows
+        self.harvest_rows = harvest_rows
+        self.period = period
+        self.tolerance = tolerance
+        self.week_starts = {}
+
+    def to_period(self, day):
+        """
+        Get the period a 'YYYY-MM-DD' day belongs to, memoized given rows share few distinct days
+        """
+        if self.period == "day":
+            return day
+        week_start = self.week_starts.get(day)
+        if week_start is None:
+            spent_date = date.fromisoformat(day)
+            week_start = (spent_date - timedelta(days=spent_date.weekday())).isoformat()
+            self.week_starts[day] = week_start
+        return week_start
+
+    def aggregate(self, rows, date_index, person_index, project_index, code_index, hours_index):
+        """
+        Sum hours by (person, project code, period) in a single pass
+        :return: {key: [hours, project name]}
+        """
+        totals = {}
+        to_period = self.to_period
+        for row in rows:
+            code = row[code_index] or row[project_index].upper()
+            key = (row[person_index], code, to_period(row[date_index]))
+            total = totals.get(key)
+            if total is None:
+                totals[key] = [row[hours_index] or 0, row[project_index]]
+            else:
+                total[0] += row[hours_index] or 0
+        return totals
+
+    def get_variance_rows(self):
+        """
+        Join planned and actual hours with a hash join on (person, project code, period)
+        :return: rows [period, person, project code, project, planned, actual, variance, variance %, status],
+                 sorted by period, person and project code
+        """
+        print(f'Computing planned vs actual variance by {self.period}')
+        planned = self.aggregate(self.forecast_rows, 1, 2, 5, 6, 7)
+        actual = self.aggregate(self.harvest_rows, 1, 2, 6, 7, 11)
+        variance_rows = []
+        for key in planned.keys() | actual.keys():
+            person, code, period = key
+            planned_hours, project = planned.get(key, (0, None))
+            actual_hours, actual_project = actual.get(key, (0, None))
+            variance = actual_hours - planned_hours
+            variance_ratio = variance / planned_hours if planned_hours else None
+            if not planned_hours:
+                status = "UNPLANNED"
+            elif not actual_hours:
+                status = "NOT LOGGED"
+            elif abs(variance_ratio) <= self.tolerance:
+                status = "ON PLAN"
+            else:
+                status = "OVER" if variance > 0 else "UNDER"
+            variance_rows.append([period, person, code, project or actual_project, round(planned_hours, 2),
+                                  round(actual_hours, 2), round(variance, 2),
+                                  round(variance_ratio, 4) if variance_ratio is not None else None, status])
+        variance_rows.sort(key=lambda row: (row[0], row[1], row[2]))
+        print(f'{len(variance_rows)} variance rows from {len(planned)} planned and {len(actual)} actual totals')
+        return variance_rows
+
+    def export_variance(self, google_runner, sheet):
+        """
+        Write the variance rows on a sheet, rows being matched on period, person and project code so only the
+        cells that changed and the new rows are sent
+        :param google_runner: GoogleRunner of the spreadsheet
+        :param sheet: sheet name, its first row being a header
+        :return: updated cells count
+        """
+        return google_runner.gsheet_diff_write(sheet, self.get_variance_rows(), key_columns=(0, 1, 2))